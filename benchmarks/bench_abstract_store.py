@@ -0,0 +1,95 @@
+"""
+Size and decode throughput of the dictionary encoded abstract store against the brotli compressed text column
+of the works_abstracts parquets.
+
+Builds the store from the given works_abstracts directory into a temp directory (or --store), then reports
+- bytes on disk of the text parquets and of the store (parts + vocabulary + index)
+- full scan: reading every abstract as text, from the text parquets and from the store
+- random access: fetching the abstracts of --sample random work ids, by filtering the text parquets and
+  through the store index
+
+Usage: python benchmarks/bench_abstract_store.py /path/to/parquets/works_abstracts [--parts 10] [--sample 1000]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+sys.path.extend(['../', './'])
+from src.abstract_store import AbstractStore, build_abstract_store
+
+
+def dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+def timed(func):
+    start = perf_counter()
+    result = func()
+    return result, perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('abstracts_dir', type=Path)
+    parser.add_argument('--parts', type=int, default=None, help='only use the first N parts')
+    parser.add_argument('--sample', type=int, default=1_000, help='number of random work ids to look up')
+    parser.add_argument('--store', type=Path, default=None, help='store directory, a temp one by default')
+    args = parser.parse_args()
+
+    parts = sorted(args.abstracts_dir.glob('*.parquet'))[: args.parts]
+    work_dir = Path(tempfile.mkdtemp())
+    text_dir = work_dir / 'text'
+    text_dir.mkdir()
+    for part in parts:
+        (text_dir / part.name).symlink_to(part.resolve())
+    store_dir = args.store or work_dir / 'store'
+
+    _, build_time = timed(lambda: build_abstract_store(text_dir, store_dir, overwrite=True))
+    store = AbstractStore(store_dir)
+    text_bytes = sum(part.stat().st_size for part in parts)
+    store_bytes = dir_size(store_dir)
+    print(f'{len(parts):,} parts, {len(store):,} abstracts, {len(store.vocabulary):,} tokens in the vocabulary, '
+          f'built in {build_time:.1f}s')
+    print(f'{"size":>14} text (brotli) {text_bytes / 2 ** 20:>10.1f} MiB   store {store_bytes / 2 ** 20:>10.1f} MiB '
+          f'({store_bytes / text_bytes:.2f}x)')
+
+    # full scan, decoding everything to text
+    text, text_time = timed(lambda: pa.concat_tables([pq.read_table(part, columns=['work_id', 'abstract'])
+                                                      for part in parts]))
+    decoded, store_time = timed(lambda: pa.concat_tables([store.read_part(i, columns=['work_id', 'abstract'])
+                                                          for i in range(len(store.part_paths))]))
+    num_bytes = pc.sum(pc.binary_length(text.column('abstract'))).as_py() or 0
+    print(f'{"full scan":>14} text (brotli) {num_bytes / 2 ** 20 / text_time:>10.1f} MiB/s  '
+          f'store {num_bytes / 2 ** 20 / store_time:>10.1f} MiB/s ({text_time / store_time:.2f}x)')
+
+    # random access
+    rng = np.random.default_rng(0)
+    work_ids = rng.choice(store.work_ids, size=min(args.sample, len(store)), replace=False)
+    value_set = pa.array(work_ids)
+    _, text_time = timed(lambda: pa.concat_tables([
+        pq.read_table(part, columns=['work_id', 'abstract'], filters=pc.is_in(pc.field('work_id'), value_set))
+        for part in parts]))
+    fetched, store_time = timed(lambda: store.get(work_ids))
+    print(f'{"random access":>14} text (brotli) {len(work_ids) / text_time:>10,.0f} works/s '
+          f'store {len(work_ids) / store_time:>10,.0f} works/s ({text_time / store_time:.2f}x)')
+
+    # the store decodes to the same text
+    expected = dict(zip(text.column('work_id').to_pylist(), text.column('abstract').to_pylist()))
+    assert all(expected[work_id] == abstract for work_id, abstract in
+               zip(fetched.column('work_id').to_pylist(), fetched.column('abstract').to_pylist()))
+    assert decoded.num_rows == text.num_rows
+
+    shutil.rmtree(work_dir)
+    return
+
+
+if __name__ == '__main__':
+    main()
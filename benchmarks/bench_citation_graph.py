@@ -0,0 +1,105 @@
+"""
+Benchmark building the CSR citation graph (src/citation_graph.py) from edge parquets and querying it.
+
+Writes a synthetic works_referenced_works table (--works works, --refs references each on average, in --files parts
+sorted by work_id like flatten_works_v3 writes them) unless a parquet directory of edges is given, builds the graph
+with --bucket-mb buckets in a child process, and reports the build time and its peak RSS, then the time to get the
+references and citations of --queries random works.
+Usage: python benchmarks/bench_citation_graph.py [/path/to/parquet-files/month/works_referenced_works]
+       [--works 2000000] [--refs 20] [--bucket-mb 64]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.extend(['../', './'])
+
+
+def write_synthetic_edges(root: Path, num_works: int, refs: int, files: int) -> np.ndarray:
+    """
+    Citations from each work to older works, more of them to the well cited ones. Returns the work ids
+    """
+    rng = np.random.default_rng(0)
+    work_ids = np.sort(rng.choice(10 ** 10, size=num_works, replace=False)).astype(np.int64) + 2_000_000_000
+    for i, part in enumerate(np.array_split(rng.permutation(num_works), files)):
+        part = np.sort(part)
+        counts = rng.poisson(refs, len(part))
+        sources = np.repeat(part, counts)
+        targets = (sources * rng.random(len(sources)) ** 2).astype(np.int64)  # skewed towards the oldest works
+        table = pa.table({'work_id': work_ids[sources], 'referenced_work_id': work_ids[targets]})
+        pq.write_table(table, root / f'part_{i:03d}.parquet', compression='brotli')
+    return work_ids
+
+
+def build(edges_dir: str, nodes_path: str, out_dir: str, bucket_mb: int) -> dict:
+    from src.citation_graph import build_citation_graph
+    from src.id_sets import SortedIDSet
+
+    nodes = SortedIDSet(path=nodes_path)
+    tic = perf_counter()
+    graph = build_citation_graph(sorted(Path(edges_dir).glob('*.parquet')), nodes=nodes, out_dir=out_dir,
+                                 bucket_bytes=bucket_mb << 20)
+    return dict(seconds=perf_counter() - tic, peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                **graph.meta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('edges_dir', nargs='?', default=None, help='directory of the edge parquets')
+    parser.add_argument('--works', type=int, default=2_000_000, help='works of the synthetic graph')
+    parser.add_argument('--refs', type=int, default=20, help='mean references per work of the synthetic graph')
+    parser.add_argument('--files', type=int, default=20, help='parts of the synthetic graph')
+    parser.add_argument('--bucket-mb', type=int, default=64, help='edges sorted in memory at a time, in MB')
+    parser.add_argument('--queries', type=int, default=100_000, help='random works to get the neighbours of')
+    parser.add_argument('--child', nargs=3, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:  # the build, in its own process for its peak RSS
+        print(json.dumps(build(*args.child, bucket_mb=args.bucket_mb)))
+        return
+
+    from src.citation_graph import CitationGraph
+    from src.id_sets import SortedIDSet
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        if args.edges_dir is None:
+            edges_dir = tmp_dir / 'edges'
+            edges_dir.mkdir()
+            work_ids = write_synthetic_edges(edges_dir, num_works=args.works, refs=args.refs, files=args.files)
+        else:
+            edges_dir = Path(args.edges_dir)
+            work_ids = np.concatenate([pq.read_table(f, columns=['work_id', 'referenced_work_id']).column(0)
+                                       .to_numpy() for f in sorted(edges_dir.glob('*.parquet'))])
+        SortedIDSet.build(work_ids, tmp_dir / 'nodes.npy')
+        del work_ids
+
+        cmd = [sys.executable, __file__, '--bucket-mb', str(args.bucket_mb), '--child', str(edges_dir),
+               str(tmp_dir / 'nodes.npy'), str(tmp_dir / 'graph')]
+        result = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.splitlines()[-1])
+        print(f'built {result["num_nodes"]:,} works, {result["num_edges"]:,} citations '
+              f'({result["dropped_edges"]:,} dropped) in {result["seconds"]:.1f}s, '
+              f'peak RSS {result["peak_rss_mb"]:,.0f} MB with {args.bucket_mb} MB buckets')
+
+        graph = CitationGraph(tmp_dir / 'graph')
+        queries = np.random.default_rng(1).choice(graph.nodes.ids, size=args.queries)
+        tic = perf_counter()
+        num_neighbours = sum(len(graph.references(work_id)) + len(graph.citations(work_id))
+                             for work_id in queries.tolist())
+        seconds = perf_counter() - tic
+        print(f'references + citations of {args.queries:,} works ({num_neighbours:,} neighbours) in {seconds:.2f}s '
+              f'({seconds / args.queries * 1e6:.1f}us a work)')
+    return
+
+
+if __name__ == '__main__':
+    main()
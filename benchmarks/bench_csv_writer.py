@@ -0,0 +1,118 @@
+"""
+Benchmark writing the authors CSV (authors.csv.gz) from the authors table: the old row at a time csv.DictWriter into
+gzip text, pandas to_csv, and the batched Arrow CSVTableWriter at a few gzip levels and with zstd.
+
+The table is read from the authors parquets of flatten_authors_v2 if a directory is given, else it is a synthetic
+one with the authors schema. Reports the rows and uncompressed MB written per second and the size of the file.
+Usage: python benchmarks/bench_csv_writer.py [/path/to/parquet-files/month/authors] [--rows 500000] [--out /tmp]
+"""
+import argparse
+import csv
+import gzip
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.extend(['../', './', './preprocessing', '../preprocessing'])
+
+BATCH_ROWS = 100_000
+
+
+def synthetic_authors(num_rows: int) -> pa.Table:
+    from src.schemas import AUTHORS_SCHEMAS
+
+    rng = np.random.default_rng(0)
+    ids = np.arange(5_000_000_000, 5_000_000_000 + num_rows, dtype=np.int64)
+    names = [f'Author {i % 100_000}, {"Jr." if i % 7 == 0 else "A."}' for i in range(num_rows)]
+    columns = dict(
+        author_id=ids,
+        orcid=[f'https://orcid.org/0000-0002-{i % 10_000:04d}-{i % 9_973:04d}' if i % 3 else None
+               for i in range(num_rows)],
+        author_name=names,
+        display_name_alternatives=['["' + name.replace('"', '\\"') + '"]' for name in names],
+        works_count=rng.integers(1, 500, num_rows).astype(np.uint32),
+        cited_by_count=rng.integers(0, 10_000, num_rows).astype(np.uint32),
+        last_known_institution=np.where(rng.random(num_rows) < 0.8, rng.integers(1, 10 ** 10, num_rows), 0),
+        updated_date=np.datetime64('2025-05-01T12:34:56.123456', 'us') + rng.integers(0, 10 ** 12, num_rows)
+        .astype('timedelta64[us]'),
+    )
+    schema = AUTHORS_SCHEMAS['authors']
+    return pa.table({name: pa.array(columns[name]).cast(schema.field(name).type) for name in schema.names})
+
+
+def write_dictwriter(table: pa.Table, path: Path, columns) -> None:
+    with gzip.open(path, 'wt', compresslevel=6) as fp:
+        writer = csv.DictWriter(fp, fieldnames=columns)
+        writer.writeheader()
+        for batch in table.select(columns).to_batches(BATCH_ROWS):
+            for row in batch.to_pylist():
+                writer.writerow(row)
+
+
+def write_pandas(table: pa.Table, path: Path, columns) -> None:
+    with gzip.open(path, 'wt', compresslevel=6) as fp:
+        for i, batch in enumerate(table.select(columns).to_batches(BATCH_ROWS)):
+            batch.to_pandas(integer_object_nulls=True).to_csv(fp, index=False, header=i == 0,
+                                                              date_format='%Y-%m-%dT%H:%M:%S.%f')
+
+
+def arrow_writer(compression: str, compression_level=None):
+    def _write(table: pa.Table, path: Path, columns) -> Path:
+        from src.writers import CSVTableWriter
+        with CSVTableWriter(path, columns=columns, compression=compression,
+                            compression_level=compression_level) as writer:
+            for batch in table.to_batches(BATCH_ROWS):
+                writer.write(batch)
+        return writer.path
+    return _write
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('parquet_dir', nargs='?', default=None, help='directory of the authors parquets')
+    parser.add_argument('--rows', type=int, default=500_000, help='rows of the synthetic table, or the most read')
+    parser.add_argument('--out', default=None, help='directory of the CSVs, a temp directory by default')
+    args = parser.parse_args()
+
+    from flatten_openalex_files import CSV_FILE_SPECS
+    columns = CSV_FILE_SPECS['authors']['authors']['columns']
+
+    if args.parquet_dir is not None:
+        parq_files = sorted(Path(args.parquet_dir).glob('*.parquet'))
+        table = pa.concat_tables([pq.read_table(f, columns=columns) for f in parq_files]).slice(0, args.rows)
+    else:
+        table = synthetic_authors(args.rows)
+    table = table.combine_chunks()
+
+    paths = {
+        'csv.DictWriter gzip-6': write_dictwriter,
+        'pandas to_csv gzip-6': write_pandas,
+        'arrow gzip-1': arrow_writer('gzip', 1),
+        'arrow gzip-6': arrow_writer('gzip', 6),
+        'arrow zstd-1': arrow_writer('zstd', 1),
+        'arrow zstd-3': arrow_writer('zstd', 3),
+    }
+    with tempfile.TemporaryDirectory(dir=args.out) as tmp_dir:
+        print(f'{table.num_rows:,} authors rows')
+        print(f'{"writer":>24} {"seconds":>9} {"rows/sec":>12} {"MB/sec":>9} {"file MB":>9}')
+        csv_mb = None
+        for i, (name, write) in enumerate(paths.items()):
+            path = Path(tmp_dir) / f'authors_{i}.csv.gz'
+            tic = perf_counter()
+            path = write(table, path, columns) or path
+            seconds = perf_counter() - tic
+            if csv_mb is None:  # uncompressed size of the CSV of the old path
+                with gzip.open(path, 'rb') as fp:
+                    csv_mb = sum(len(chunk) for chunk in iter(lambda: fp.read(1 << 24), b'')) / 2 ** 20
+            print(f'{name:>24} {seconds:>9.2f} {table.num_rows / seconds:>12,.0f} {csv_mb / seconds:>9.1f} '
+                  f'{path.stat().st_size / 2 ** 20:>9.1f}')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Micro-benchmark of the scalar convert_openalex_id_to_int / convert_topic_id_to_int against the batch
+convert_openalex_ids_to_int / convert_topic_ids_to_int, on python lists and on Arrow string arrays.
+
+Usage: python benchmarks/bench_id_parsing.py [--sizes 100 10000 1000000]
+"""
+import argparse
+import sys
+from timeit import Timer
+
+import numpy as np
+import pyarrow as pa
+
+sys.path.extend(['../', './'])
+from src.utils import convert_openalex_id_to_int, convert_openalex_ids_to_int, convert_topic_id_to_int, \
+    convert_topic_ids_to_int
+
+
+def make_ids(size, seed=0):
+    rng = np.random.default_rng(seed)
+    work_ids = [f'https://openalex.org/W{id_}' for id_ in rng.integers(1_000_000, 4_400_000_000, size=size)]
+    topic_ids = [f'https://openalex.org/topics/T{id_}' if i % 2 else f'https://openalex.org/T{id_}'
+                 for i, id_ in enumerate(rng.integers(10_000, 14_000, size=size))]
+    return work_ids, topic_ids
+
+
+def best_of(func, repeat=5):
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f'{"ids":>10} {"function":>10} {"scalar ms":>10} {"batch ms":>10} {"arrow ms":>10} {"speedup":>8}')
+    for size in args.sizes:
+        work_ids, topic_ids = make_ids(size)
+        for name, ids, scalar_fn, batch_fn in [('openalex', work_ids, convert_openalex_id_to_int,
+                                                convert_openalex_ids_to_int),
+                                               ('topic', topic_ids, convert_topic_id_to_int,
+                                                convert_topic_ids_to_int)]:
+            expected = [scalar_fn(id_) for id_ in ids]
+            assert batch_fn(ids)[0].tolist() == expected, f'{name}: batch and scalar results differ'
+
+            arrow_ids = pa.array(ids)
+            scalar_time = best_of(lambda: [scalar_fn(id_) for id_ in ids])
+            batch_time = best_of(lambda: batch_fn(ids))
+            arrow_time = best_of(lambda: batch_fn(arrow_ids))
+            print(f'{size:>10,} {name:>10} {scalar_time * 1e3:>10.2f} {batch_time * 1e3:>10.2f} '
+                  f'{arrow_time * 1e3:>10.2f} {scalar_time / batch_time:>7.1f}x')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Import time of preprocessing/flatten_openalex_files.py, which every works pool worker and script pays.
+
+Imports the module in --runs fresh interpreters and reports the median and worst wall time, the slowest imports
+(python -X importtime, cumulative) and whether the import had side effects: output directories created or
+lookups loaded by the runtime config. Exits with 1 if the median is over --budget seconds or there were side effects.
+
+Usage: python benchmarks/bench_import_time.py [--runs 5] [--budget 1.0] [--top 10]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+IMPORT_SCRIPT = """
+import json, sys
+from time import perf_counter
+sys.path[:0] = [{root!r}, {preprocessing!r}]
+tic = perf_counter()
+import flatten_openalex_files as F
+seconds = perf_counter() - tic
+# cached_property values land in the instance dictionary, so these are only there if they were used
+side_effects = sorted(set(vars(F.CONFIG)) & {{'csv_dir', 'parq_dir', 'inst_lookup', 'topic_lookup'}})
+print(json.dumps(dict(seconds=seconds, side_effects=side_effects)))
+"""
+
+
+def import_once() -> tuple:
+    script = IMPORT_SCRIPT.format(root=str(ROOT), preprocessing=str(ROOT / 'preprocessing'))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], capture_output=True, text=True,
+                          check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result, proc.stderr
+
+
+def slowest_imports(importtime_log: str, top: int) -> list:
+    """
+    (cumulative microseconds, module) of the top slowest imports from the -X importtime log
+    """
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[: top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help='seconds allowed for the median import')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to show')
+    args = parser.parse_args()
+
+    import_once()  # warm up the page cache
+    times, side_effects, log = [], set(), ''
+    for _ in range(args.runs):
+        result, log = import_once()
+        times.append(result['seconds'])
+        side_effects.update(result['side_effects'])
+
+    median = statistics.median(times)
+    print(f'import flatten_openalex_files: median {median:.3f}s, worst {max(times):.3f}s over {args.runs} runs '
+          f'(budget {args.budget:.3f}s)')
+    print('slowest imports (cumulative):')
+    for cumulative, name in slowest_imports(log, top=args.top):
+        print(f'{cumulative / 1e6:>10.3f}s {name}')
+    if side_effects:
+        print(f'side effects on import: {", ".join(sorted(side_effects))}')
+
+    ok = median <= args.budget and not side_effects
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
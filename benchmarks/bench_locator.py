@@ -0,0 +1,90 @@
+"""
+Benchmark random access to works by id with the WorkLocator index (src/locator.py) against a filtered read per id,
+which is what the old get_partition_no / get_rows did once the partition was known.
+
+Indexes the parquets under the given directory (eg: <parq_dir>/works), or a synthetic works-like dataset of
+--files files of --rows rows if none is given, then looks up --lookups random ids with lookup_many. The filtered read
+is timed on --baseline ids and extrapolated.
+Usage: python benchmarks/bench_locator.py [/path/to/parquet-files/month/works] [--lookups 1000000]
+"""
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+sys.path.extend(['../', './'])
+
+
+def write_synthetic_works(root: Path, files: int, rows: int, row_group_rows: int = 100_000) -> None:
+    """
+    Works-like parts: unsorted work ids, a title and a year, like the per part parquets of flatten_works_v3
+    """
+    rng = np.random.default_rng(0)
+    ids = rng.permutation(np.arange(files * rows, dtype=np.int64) * 7 + 2_000_000_000)
+    for i in range(files):
+        part_ids = ids[i * rows: (i + 1) * rows]
+        table = pa.table({'work_id': part_ids,
+                          'title': pa.array([f'Title of work {id_}' for id_ in part_ids.tolist()]),
+                          'publication_year': rng.integers(1950, 2025, rows).astype(np.int16)})
+        pq.write_table(table, root / f'part_{i:03d}.parquet', row_group_size=row_group_rows, compression='brotli')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('parquet_dir', nargs='?', default=None,
+                        help='directory of the parquets, synthetic if not given')
+    parser.add_argument('--files', type=int, default=50, help='files of the synthetic dataset')
+    parser.add_argument('--rows', type=int, default=200_000, help='rows per file of the synthetic dataset')
+    parser.add_argument('--lookups', type=int, default=1_000_000, help='number of random ids to look up')
+    parser.add_argument('--baseline', type=int, default=20, help='ids read with a filter per id')
+    parser.add_argument('--columns', nargs='*', default=['work_id', 'publication_year'])
+    args = parser.parse_args()
+
+    from src.locator import WorkLocator
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        if args.parquet_dir is None:
+            root = tmp_dir / 'works'
+            root.mkdir()
+            tic = perf_counter()
+            write_synthetic_works(root, files=args.files, rows=args.rows)
+            print(f'wrote {args.files * args.rows:,} synthetic works in {perf_counter() - tic:.1f}s')
+        else:
+            root = Path(args.parquet_dir)
+
+        locator = WorkLocator(root, index_dir=tmp_dir / 'index')
+        tic = perf_counter()
+        locator.update()
+        print(f'indexed {locator.num_files:,} files, {len(locator):,} entries in {perf_counter() - tic:.1f}s')
+
+        tic = perf_counter()
+        locator = WorkLocator(root, index_dir=tmp_dir / 'index')
+        print(f'opened the index in {perf_counter() - tic:.3f}s')
+
+        rng = np.random.default_rng(1)
+        work_ids = rng.choice(np.unique(locator.keys), size=args.lookups, replace=args.lookups > len(locator))
+        tic = perf_counter()
+        table = locator.lookup_many(work_ids, columns=args.columns)
+        seconds = perf_counter() - tic
+        print(f'lookup_many: {len(work_ids):,} ids, {table.num_rows:,} rows in {seconds:.2f}s '
+              f'({len(work_ids) / seconds:,.0f} ids/s)')
+
+        dataset = ds.dataset(root, format='parquet')
+        tic = perf_counter()
+        for work_id in work_ids[: args.baseline].tolist():
+            dataset.to_table(columns=args.columns, filter=ds.field('work_id') == work_id)
+        per_id = (perf_counter() - tic) / args.baseline
+        print(f'filtered read per id: {per_id * 1000:.1f}ms per id, '
+              f'{per_id * len(work_ids) / 3600:,.1f} hours for {len(work_ids):,} ids')
+    return
+
+
+if __name__ == '__main__':
+    main()
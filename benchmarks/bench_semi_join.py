@@ -0,0 +1,72 @@
+"""
+Benchmark filtering an edge table down to a selection of works (src/semi_join.py) against what
+write_other_filtered_tables_v2 did before: a Python set of the work ids passed as a pyarrow 'in' filter, then
+pandas isin on both ends.
+
+Writes a synthetic works_referenced_works part (--works works, --refs references each, sorted by work_id like
+flatten_works_v3 writes them), selects --fraction of the works and filters the part both ways, then once more in dense
+ids against the bitmap.
+Usage: python benchmarks/bench_semi_join.py [--works 2000000] [--refs 20] [--fraction 0.2]
+"""
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.extend(['../', './'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--works', type=int, default=2_000_000, help='works of the synthetic table')
+    parser.add_argument('--refs', type=int, default=20, help='mean references per work')
+    parser.add_argument('--fraction', type=float, default=0.2, help='fraction of the works selected')
+    args = parser.parse_args()
+
+    from src.dense_ids import DenseIDMap
+    from src.id_sets import SortedIDSet
+    from src.semi_join import KEY_COLUMNS, WorkSet, semi_join_parquet
+
+    rng = np.random.default_rng(0)
+    # spread over the range of the current work ids, W1.. to W4.4B
+    work_ids = np.sort(rng.choice(3_400_000_000, size=args.works, replace=False)).astype(np.int64) + 1_000_000_000
+    sources = np.repeat(np.arange(args.works), rng.poisson(args.refs, args.works))
+    targets = rng.integers(0, args.works, len(sources))
+    selected = rng.choice(work_ids, size=int(args.works * args.fraction), replace=False)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        path, dense_path = tmp_dir / 'part.parquet', tmp_dir / 'part_dense.parquet'
+        pq.write_table(pa.table({'work_id': work_ids[sources], 'referenced_work_id': work_ids[targets]}), path)
+        dense_table = pa.table({'work_id': sources.astype(np.uint32), 'referenced_work_id': targets.astype(np.uint32)})
+        pq.write_table(dense_table, dense_path)
+        print(f'{len(sources):,} edges, {len(selected):,} works selected')
+
+        tic = perf_counter()
+        selected_set = set(selected.tolist())
+        df = pd.read_parquet(path, engine='pyarrow', filters=[[('work_id', 'in', selected_set)]])
+        df = df[df.work_id.isin(selected_set)]
+        df = df[df.referenced_work_id.isin(selected_set)]
+        print(f'set + isin: {len(df):,} edges kept in {perf_counter() - tic:.2f}s')
+
+        tic = perf_counter()
+        work_set = WorkSet(SortedIDSet.build(selected, tmp_dir / 'work_ids.npy'))
+        table = semi_join_parquet(path, work_set=work_set, key_columns=KEY_COLUMNS['referenced_works'])
+        print(f'semi-join: {table.num_rows:,} edges kept in {perf_counter() - tic:.2f}s')
+
+        dense_ids = DenseIDMap.build(work_ids, tmp_dir / 'dense_ids.npy')
+        work_set = WorkSet(work_set.work_ids, dense_ids=dense_ids)
+        tic = perf_counter()
+        table = semi_join_parquet(dense_path, work_set=work_set, key_columns=KEY_COLUMNS['referenced_works_dense'])
+        print(f'semi-join on dense ids: {table.num_rows:,} edges kept in {perf_counter() - tic:.2f}s')
+    return
+
+
+if __name__ == '__main__':
+    main()
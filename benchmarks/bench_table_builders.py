@@ -0,0 +1,159 @@
+"""
+Benchmark building the works, authorships, topics, keywords and concepts tables of one works part file
+with the pandas path (row dicts -> pd.DataFrame -> astype -> Arrow) against the columnar TableBuilders.
+
+Each path runs in its own process so that the peak RSS numbers don't bleed into each other.
+Usage: python benchmarks/bench_table_builders.py /path/to/openalex-snapshot/data/works/updated_date=.../part_000.gz
+"""
+import argparse
+import gzip
+import json
+import resource
+import subprocess
+import sys
+from pathlib import Path
+from time import perf_counter
+
+import orjson
+
+sys.path.extend(['../', './', './preprocessing', '../preprocessing'])
+
+KINDS = ['works', 'authorships', 'topics', 'keywords', 'concepts']
+
+
+def load_works(path, limit=None):
+    works = []
+    with gzip.open(path, 'r') as fp:
+        for line in fp:
+            if line.strip():
+                works.append(orjson.loads(line))
+            if limit is not None and len(works) >= limit:
+                break
+    return works
+
+
+def get_topic_info(works):
+    """
+    Stand-in topic lookup with the topic ids of the sample, the real one is read from topics.csv.gz
+    """
+    from src.utils import convert_topic_id_to_int
+    topic_ids = {convert_topic_id_to_int(topic['id']) for work in works for topic in work.get('topics') or []}
+    info = {col: {} for col in ['topic_name', 'subfield_id', 'subfield_name', 'field_id', 'field_name', 'domain_id',
+                                'domain_name']}
+    for topic_id in topic_ids:
+        for col in info:
+            info[col][topic_id] = f'{col}_{topic_id}' if col.endswith('name') else topic_id % 1000
+    return info
+
+
+def build_tables(works, mode, parq_filename):
+    import flatten_openalex_files as F
+    from src.id_sets import SortedIDSet
+    from src.lookups import CompiledLookup
+    from src.utils import convert_openalex_id_to_int, convert_topic_id_to_int, parse_authorships, string_to_bool
+
+    topic_info_d = get_topic_info(works)
+    inst_info_d = {'institution_name': {}, 'country_code': {}}
+    no_skip_ids = SortedIDSet()
+
+    if mode == 'columnar':
+        # the columnar path looks the names up in batch from the compiled lookups
+        lookups = dict(inst_lookup=CompiledLookup.from_dicts(inst_info_d, key='institution_id'),
+                       topic_lookup=CompiledLookup.from_dicts(topic_info_d, key='topic_id'))
+        buffers = {kind: F.get_table_buffer(json_filename=parq_filename, kind=kind, **lookups) for kind in KINDS}
+    else:
+        buffers = {kind: [] for kind in KINDS}
+
+    for work in works:
+        work_id = convert_openalex_id_to_int(work['id'])
+        year = work.get('publication_year')
+
+        for i, topic in enumerate(work.get('topics') or []):
+            topic_id = convert_topic_id_to_int(topic['id'])
+            values = [work_id, year, i == 0, topic['score'], topic_id, topic_info_d['topic_name'][topic_id]]
+            for genre in ['subfield', 'field', 'domain']:
+                values.extend([topic_info_d[f'{genre}_id'][topic_id], topic_info_d[f'{genre}_name'][topic_id]])
+            if mode == 'columnar':
+                buffers['topics'].append_values(*values[: 5])
+            else:
+                buffers['topics'].append(dict(zip(F.WORKS_SCHEMAS['topics'].names, values)))
+
+        for keyword_d in work.get('keywords') or []:
+            values = [work_id, year, keyword_d.get('display_name'), keyword_d.get('score')]
+            if mode == 'columnar':
+                buffers['keywords'].append_values(*values)
+            else:
+                buffers['keywords'].append(dict(zip(F.WORKS_SCHEMAS['keywords'].names, values)))
+
+        for concept in work.get('concepts') or []:
+            values = [work_id, year, concept.get('score'), convert_openalex_id_to_int(concept.get('id')),
+                      concept.get('display_name'), concept.get('level')]
+            if mode == 'columnar':
+                buffers['concepts'].append_values(*values)
+            else:
+                buffers['concepts'].append(dict(zip(F.WORKS_SCHEMAS['concepts'].names, values)))
+
+        authorship_rows, num_authors, has_complete_institution_info = parse_authorships(
+            authorships=work.get('authorships') or [], work_id=work_id, publication_year=year,
+            author_skip_ids=no_skip_ids, inst_skip_ids=no_skip_ids,
+            inst_info_d=inst_info_d if mode != 'columnar' else None,
+        )
+        buffers['authorships'].extend(authorship_rows)
+
+        work_row = {k: v for k, v in work.items() if k in F.DTYPES['works']}
+        work_row.update(work_id=work_id, num_authors=num_authors, num_references=len(work.get('referenced_works')),
+                        has_complete_institution_info=has_complete_institution_info,
+                        is_retracted=string_to_bool(work.get('is_retracted')),
+                        is_paratext=string_to_bool(work.get('is_paratext')))
+        buffers['works'].append(work_row)
+
+    tables = {}
+    for kind, rows in buffers.items():
+        if mode == 'columnar':
+            tables[kind] = rows.to_table()
+        else:
+            tables[kind] = F.rows_to_table(rows=rows, kind=kind, parq_filename=Path(parq_filename))
+    return tables
+
+
+def run(path, mode, limit):
+    works = load_works(path, limit=limit)
+    import flatten_openalex_files  # noqa: F401, keep the import time out of the measurement
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tic = perf_counter()
+    tables = build_tables(works, mode=mode, parq_filename=path)
+    toc = perf_counter()
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rows = sum(table.num_rows for table in tables.values())
+    return dict(mode=mode, works=len(works), rows=rows, seconds=toc - tic, rows_per_sec=rows / (toc - tic),
+                peak_rss_mb=rss_after / 1024, build_rss_mb=(rss_after - rss_before) / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='works JSON lines part file (.gz)')
+    parser.add_argument('--limit', type=int, default=None, help='only read the first LIMIT works')
+    parser.add_argument('--mode', choices=['pandas', 'columnar'], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:  # child process
+        print(json.dumps(run(path=args.path, mode=args.mode, limit=args.limit)))
+        return
+
+    print(f'{"mode":>10} {"works":>10} {"rows":>12} {"seconds":>9} {"rows/sec":>12} {"peak RSS MB":>12} '
+          f'{"build RSS MB":>13}')
+    for mode in ['pandas', 'columnar']:
+        cmd = [sys.executable, __file__, args.path, '--mode', mode]
+        if args.limit is not None:
+            cmd += ['--limit', str(args.limit)]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip().splitlines()[-1]
+        res = json.loads(out)
+        print(f'{res["mode"]:>10} {res["works"]:>10,} {res["rows"]:>12,} {res["seconds"]:>9.2f} '
+              f'{res["rows_per_sec"]:>12,.0f} {res["peak_rss_mb"]:>12,.0f} {res["build_rss_mb"]:>13,.0f}')
+    return
+
+
+if __name__ == '__main__':
+    main()
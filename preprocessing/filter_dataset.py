@@ -6,13 +6,23 @@ Filtering the entire dataset based on certain criteria
 
 Essentially, read the whole CSVs in chunks, filtering them, and writing them back out again
 """
+import multiprocessing
+import os
+import sys
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 from pathlib import Path
+from typing import Optional
 import pandas as pd
+import pyarrow.dataset as ds
 from tqdm.auto import tqdm
 
+sys.path.extend(['../', './'])
+from src.dense_ids import DenseIDMap
+from src.id_sets import SortedIDSet
+from src.semi_join import BATCH_ROWS, KEY_COLUMNS, WorkSet, semi_join_parquet
+
 # STRING_DTYPE = 'string[pyarrow]'  # use the more memory efficient PyArrow string datatype
 STRING_DTYPE = 'string[python]'
 if STRING_DTYPE == 'string[pyarrow]':
@@ -233,11 +243,64 @@ def write_other_filtered_tables(csv_path, parq_path, work_ids):
     return
 
 
-def write_other_filtered_tables_v2(whole_parq_path, filt_parq_path, work_ids):
+def get_filtered_work_ids(filt_parq_path, rebuild=False) -> SortedIDSet:
     """
-    Read tables CSVs in chunks
+    Work ids of the filtered works table (write_filtered_works_table_v2) as a SortedIDSet, kept in
+    filt_parq_path / 'work_ids.npy' so that it's read once and memory mapped by the pool workers
     """
-    kinds = ['authorships', 'concepts', 'referenced_works']
+    path = filt_parq_path / 'work_ids.npy'
+    if path.exists() and not rebuild:
+        return SortedIDSet(path=path)
+    work_ids = ds.dataset(filt_parq_path / 'works', format='parquet').to_table(columns=['work_id']).column('work_id')
+    return SortedIDSet.build(ids=work_ids.drop_null().to_numpy(), path=path)
+
+
+_WORKER_STATE = {}  # the WorkSet shared with the filtering pool workers
+
+
+def _init_filter_worker(state):
+    """
+    Pool initializer: with the fork start method the work set and its bitmaps are inherited copy-on-write, not pickled
+    """
+    _WORKER_STATE.update(state)
+    return
+
+
+def _filter_part_worker(chunked_path, parq_filename, kind, batch_rows=BATCH_ROWS):
+    """
+    Pool task for write_other_filtered_tables_v2: semi-join one part of a works table against the selected works.
+    The part is written to a temp file and renamed, so an interrupted run never leaves a part that looks finished
+    Returns the number of rows kept
+    """
+    table = semi_join_parquet(chunked_path, work_set=_WORKER_STATE['work_set'],
+                              key_columns=KEY_COLUMNS.get(kind, ['work_id']), batch_rows=batch_rows)
+    filt_df = table.to_pandas()
+    # the dtypes of the columns the table has, the flattened tables gained and lost a few over the snapshots
+    filt_df = filt_df.astype({column: dtype for column, dtype in dtypes.get(kind, {}).items()
+                              if column in filt_df.columns})
+    tmp_filename = parq_filename.with_name(f'.{parq_filename.name}.{os.getpid()}.tmp')
+    filt_df.to_parquet(tmp_filename, engine='pyarrow', index=False)
+    os.replace(tmp_filename, parq_filename)
+    return len(filt_df)
+
+
+def _star_filter_part_worker(args):
+    return _filter_part_worker(*args)
+
+
+def write_other_filtered_tables_v2(whole_parq_path, filt_parq_path, work_ids, threads=1,
+                                   kinds=('authorships', 'concepts', 'referenced_works'),
+                                   dense_ids: Optional[DenseIDMap] = None):
+    """
+    Filter the parts of the other works tables down to the selected works, in parallel over the parts.
+    work_ids: SortedIDSet of the selected works (get_filtered_work_ids), other iterables are sorted into one
+    dense_ids: DenseIDMap of the whole works table, for the kinds written in dense ids (referenced_works_dense)
+    Both ends of the edge tables are checked, see KEY_COLUMNS
+    """
+    work_ids = work_ids if isinstance(work_ids, SortedIDSet) else SortedIDSet(work_ids)
+    work_set = WorkSet(work_ids, dense_ids=dense_ids)
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+
     for kind in tqdm(kinds):
         print(f'{kind=}')
 
@@ -251,45 +314,27 @@ def write_other_filtered_tables_v2(whole_parq_path, filt_parq_path, work_ids):
 
         if len(existing_filtered_chunks_paths) == len(whole_table_chunks_paths):
             print(f'Complete filtered {kind!r} found at {str(final_parq_path)!r}')
-            return
-
-        row_counts = 0
+            continue
 
-        unfinished_chunks_paths = []
-        for whole_work_chunk_path in whole_table_chunks_paths:
-            stem = whole_work_chunk_path.stem
-            if (final_parq_path / f'{stem}.parquet').exists():
+        args = []
+        for chunked_path in whole_table_chunks_paths:
+            parq_filename = final_parq_path / f'{chunked_path.stem}.parquet'
+            if parq_filename.exists():
                 continue
-            unfinished_chunks_paths.append(whole_work_chunk_path)
-        # print(f'{len(unfinished_chunks_paths)=:,}')
-
-        with tqdm(total=len(unfinished_chunks_paths), colour='cyan', desc=f'{kind!r}') as pbar:
-            for i, chunked_path in enumerate(unfinished_chunks_paths):
-                chunked_df = pd.read_parquet(chunked_path, engine='pyarrow', filters=[[('work_id', 'in', work_ids)]])
-                # print(f'{len(chunked_df)=:,}\n')
-                parq_filename = final_parq_path / f'{chunked_path.stem}.parquet'
-                filt_df = (
-                    chunked_df
-                    [chunked_df.work_id.isin(work_ids)]
-                    .astype(dtypes[kind])
-                )
-
-                if kind == 'referenced_works':
-                    filt_df = (
-                        filt_df
-                        [filt_df.referenced_work_id.isin(work_ids)]
-                    )
-                # filt_df.info()
-                filt_df.to_parquet(parq_filename, engine='pyarrow')
-                row_counts += len(filt_df)
+            args.append((chunked_path, parq_filename, kind))
 
+        row_counts = 0
+        with multiprocessing.get_context(start_method).Pool(
+                processes=threads, initializer=_init_filter_worker, initargs=(dict(work_set=work_set),)) as pool, \
+                tqdm(total=len(args), colour='cyan', desc=f'{kind!r}') as pbar:
+            for num_rows in pool.imap_unordered(_star_filter_part_worker, args, chunksize=1):
+                row_counts += num_rows
                 pbar.update(1)
                 pbar.set_description(f'{kind!r} Rows: {row_counts:,}')
 
     return
 
 
-
 def get_concept_workids(concept_name):
     # get concept IDs
 
@@ -351,15 +396,10 @@ def main_v2():
     # step 1: fitler the works table
     write_filtered_works_table_v2(parq_path=filtered_parq_path, whole_works_parq_path=whole_parq_path / 'works')
 
-    work_ids = set(
-        pd.read_parquet(filtered_parq_path / 'works', engine='fastparquet',
-                        columns=['work_id'])  # read only the work id column
-        .index
-    )
-    print(next(iter(work_ids)))
+    work_ids = get_filtered_work_ids(filtered_parq_path)  # sorted array of the work ids, not a set
     print(f'{len(work_ids):,} work ids loaded')
     write_other_filtered_tables_v2(whole_parq_path=whole_parq_path, filt_parq_path=filtered_parq_path,
-                                   work_ids=work_ids)
+                                   work_ids=work_ids, threads=4)
     return
 
 
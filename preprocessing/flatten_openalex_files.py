@@ -5,52 +5,60 @@ Original script at https://github.com/ourresearch/openalex-documentation-scripts
 
 import csv
 import glob
-import gzip
 import json
+import multiprocessing
 import os
-import socket
+import shutil
 import sys
 import warnings
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from time import time
-from typing import Optional
-import orjson  # faster JSON library
+from typing import Callable, Optional
+import numpy as np
 import pandas as pd
 from tqdm.auto import tqdm
 import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
 sys.path.extend(['../', './'])
-from src.utils import convert_openalex_id_to_int, load_pickle, dump_pickle, reconstruct_abstract, read_manifest, \
-    parallel_async, string_to_bool, parse_authorships, convert_topic_id_to_int
+from src.abstracts import reconstruct_abstracts
+from src.authorships import AuthorshipBatch
+from src.citation_graph import BUCKET_BYTES, CitationGraph, build_citation_graph
+from src.citations import EdgeBuffer, extract_citation_edges
+from src.columnar import TableBuilder
+from src.compaction import MAX_FILE_ROWS, ROW_GROUP_ROWS, YEAR, bucket_part, bucket_sizes, compact_partition, \
+    get_year_lookup, get_year_work_ids, replace_dir, work_id_splits
+from src.config import FlattenConfig
+from src.dense_ids import DenseIDMap
+from src.entity_specs import ENTITY_SPECS, get_entity_scan
+from src.id_sets import SortedIDSet
+from src.ledger import Ledger, file_digest
+from src.incremental import carry_forward_part, diff_manifests, save_manifest_copy, saved_manifest_path, \
+    update_num_references
+from src.locator import WorkLocator
+from src.lookups import CompiledLookup, INSTITUTION_COLUMNS, TOPIC_COLUMNS, lookup_columns
+from src.projection import ProjectionDecoder, WorksPlan
+from src.readers import JSONLReader
+from src.scan import EntityScan, ScanBatch
+from src.schemas import AUTHORS_SCHEMAS, WORKS_SCHEMAS
+from src.utils import convert_openalex_id_to_int, read_manifest, \
+    string_to_bool, convert_topic_id_to_int, convert_openalex_ids_to_int
+from src.writers import CSVTableWriter, ParquetPartWriter, RowBuffer, RowCounter, PARQUET_WRITE_ARGS, csv_path
 
 warnings.simplefilter(action='ignore', category=FutureWarning)  # suppress pandas future warnings
-hostname = socket.gethostname()
-
-if 'quartz' in hostname:
-    BASEDIR = Path('/N/project/openalex/ssikdar')  # directory where you have downloaded the OpenAlex snapshots
-    # BASEDIR = Path('/N/scratch/ssikdar')  # directory where you have downloaded the OpenAlex snapshots
-elif hostname == 'yoda':
-    BASEDIR = Path('/data/shared/OpenAlex')
-else:
-    BASEDIR = Path('/home/ssikdar/data/shared/OpenAlex')
-
-print(f'{hostname=} {BASEDIR=}')
-
-SNAPSHOT_DIR = BASEDIR / 'openalex-snapshot'
-MONTH = 'may-2025'
-
-CSV_DIR = BASEDIR / 'processed-snapshots' / 'csv-files' / MONTH
-PARQ_DIR = BASEDIR / 'processed-snapshots' / 'parquet-files' / MONTH
-CSV_DIR.mkdir(parents=True, exist_ok=True)
-PARQ_DIR.mkdir(parents=True, exist_ok=True)
+# paths and lookups are resolved by the runtime config, nothing is read or created on import
+CONFIG = FlattenConfig()
 
 FILES_PER_ENTITY = int(os.environ.get('OPENALEX_DEMO_FILES_PER_ENTITY', '0'))
+CSV_BATCH_ROWS = 100_000  # rows converted and compressed at a time by the CSV writer
 
-csv_files = dict(
+CSV_FILE_SPECS = dict(  # names relative to the CSV directory, see get_csv_files
     institutions={
         "institutions": {
-            "name": os.path.join(CSV_DIR, "institutions.csv.gz"),
+            "name": "institutions.csv.gz",
             "columns": [
                 "institution_id",
                 "institution_name",
@@ -66,7 +74,7 @@ csv_files = dict(
             ],
         },
         "ids": {
-            "name": os.path.join(CSV_DIR, "institutions_ids.csv.gz"),
+            "name": "institutions_ids.csv.gz",
             "columns": [
                 "institution_id",
                 "institution_name",
@@ -79,7 +87,7 @@ csv_files = dict(
             ],
         },
         "geo": {
-            "name": os.path.join(CSV_DIR, "institutions_geo.csv.gz"),
+            "name": "institutions_geo.csv.gz",
             "columns": [
                 "institution_id",
                 "institution_name",
@@ -93,13 +101,11 @@ csv_files = dict(
             ],
         },
         "associated_institutions": {
-            "name": os.path.join(
-                CSV_DIR, "institutions_associated_institutions.csv.gz"
-            ),
+            "name": "institutions_associated_institutions.csv.gz",
             "columns": ["institution_id", "associated_institution_id", "relationship"],
         },
         "counts_by_year": {
-            "name": os.path.join(CSV_DIR, "institutions_counts_by_year.csv.gz"),
+            "name": "institutions_counts_by_year.csv.gz",
             "columns": [
                 "institution_id",
                 "institution_name",
@@ -112,7 +118,7 @@ csv_files = dict(
     },
     authors={
         "authors": {
-            "name": os.path.join(CSV_DIR, "authors.csv.gz"),
+            "name": "authors.csv.gz",
             "columns": [
                 "author_id",
                 "orcid",
@@ -125,7 +131,7 @@ csv_files = dict(
             ],
         },
         "ids": {
-            "name": os.path.join(CSV_DIR, "authors_ids.csv.gz"),
+            "name": "authors_ids.csv.gz",
             "columns": [
                 "author_id",
                 "author_name",
@@ -138,7 +144,7 @@ csv_files = dict(
             ],
         },
         "counts_by_year": {
-            "name": os.path.join(CSV_DIR, "authors_counts_by_year.csv.gz"),
+            "name": "authors_counts_by_year.csv.gz",
             "columns": [
                 "author_id",
                 "author_name",
@@ -148,7 +154,20 @@ csv_files = dict(
             ],
         },
         "concepts": {
-            "name": os.path.join(CSV_DIR, "authors_concepts.csv.gz"),
+            "name": "authors_concepts.csv.gz",
+            "columns": [
+                "author_id",
+                "author_name",
+                "works_count",
+                "cited_by_count",
+                "concept_id",
+                "concept_name",
+                "level",
+                "score",
+            ],
+        },
+        "concepts_zero": {
+            "name": "authors_concepts_zero.csv.gz",
             "columns": [
                 "author_id",
                 "author_name",
@@ -161,7 +180,7 @@ csv_files = dict(
             ],
         },
         "hints": {
-            "name": os.path.join(CSV_DIR, "authors_hints.csv.gz"),
+            "name": "authors_hints.csv.gz",
             "columns": [
                 "author_id",
                 "author_name",
@@ -173,7 +192,7 @@ csv_files = dict(
     },
     concepts={
         "concepts": {
-            "name": os.path.join(CSV_DIR, "concepts.csv.gz"),
+            "name": "concepts.csv.gz",
             "columns": [
                 "concept_id",
                 "concept_name",
@@ -186,11 +205,11 @@ csv_files = dict(
             ],
         },
         "ancestors": {
-            "name": os.path.join(CSV_DIR, "concepts_ancestors.csv.gz"),
+            "name": "concepts_ancestors.csv.gz",
             "columns": ["concept_id", "ancestor_id"],
         },
         "counts_by_year": {
-            "name": os.path.join(CSV_DIR, "concepts_counts_by_year.csv.gz"),
+            "name": "concepts_counts_by_year.csv.gz",
             "columns": [
                 "concept_id",
                 "concept_name",
@@ -201,7 +220,7 @@ csv_files = dict(
             ],
         },
         "ids": {
-            "name": os.path.join(CSV_DIR, "concepts_ids.csv.gz"),
+            "name": "concepts_ids.csv.gz",
             "columns": [
                 "concept_id",
                 "concept_name",
@@ -214,13 +233,13 @@ csv_files = dict(
             ],
         },
         "related_concepts": {
-            "name": os.path.join(CSV_DIR, "concepts_related_concepts.csv.gz"),
+            "name": "concepts_related_concepts.csv.gz",
             "columns": ["concept_id", "related_concept_id", "score"],
         },
     },
     venues={
         "venues": {
-            "name": os.path.join(CSV_DIR, "venues.csv.gz"),
+            "name": "venues.csv.gz",
             "columns": [
                 "venue_id",
                 "issn_l",
@@ -237,11 +256,11 @@ csv_files = dict(
             ],
         },
         "ids": {
-            "name": os.path.join(CSV_DIR, "venues_ids.csv.gz"),
+            "name": "venues_ids.csv.gz",
             "columns": ["venue_id", "venue_name", "openalex", "issn_l", "issn", "mag"],
         },
         "counts_by_year": {
-            "name": os.path.join(CSV_DIR, "venues_counts_by_year.csv.gz"),
+            "name": "venues_counts_by_year.csv.gz",
             "columns": [
                 "venue_id",
                 "venue_name",
@@ -253,7 +272,7 @@ csv_files = dict(
     },
     works={
         "works": {
-            "name": os.path.join(CSV_DIR, "works.csv.gz"),
+            "name": "works.csv.gz",
             "columns": [
                 "work_id",
                 "doi",
@@ -277,7 +296,7 @@ csv_files = dict(
             ],
         },
         "indexed_in": {
-            "name": os.path.join(CSV_DIR, "works_indexed_in.csv.gz"),
+            "name": "works_indexed_in.csv.gz",
             "columns": [
                 "work_id",
                 "publication_year",
@@ -285,7 +304,7 @@ csv_files = dict(
             ],
         },
         "topics": {
-            "name": os.path.join(CSV_DIR, "works_topics.csv.gz"),
+            "name": "works_topics.csv.gz",
             "columns": [
                 "work_id",
                 "publication_year",
@@ -302,7 +321,7 @@ csv_files = dict(
             ],
         },
         "keywords": {
-            "name": os.path.join(CSV_DIR, "works_keywords.csv.gz"),
+            "name": "works_keywords.csv.gz",
             "columns": [
                 "work_id",
                 "publication_year",
@@ -311,7 +330,7 @@ csv_files = dict(
             ],
         },
         "grants": {
-            "name": os.path.join(CSV_DIR, "works_grants.csv.gz"),
+            "name": "works_grants.csv.gz",
             "columns": [
                 "work_id",
                 "publication_year",
@@ -322,7 +341,7 @@ csv_files = dict(
         },
         # Satyaki addition: put abstracts in a different CSV, save some space
         "abstracts": {
-            "name": os.path.join(CSV_DIR, "works_abstracts.csv.gz"),
+            "name": "works_abstracts.csv.gz",
             "columns": [
                 "work_id",
                 "title",
@@ -331,7 +350,7 @@ csv_files = dict(
             ],
         },
         "primary_location": {
-            "name": os.path.join(CSV_DIR, "works_primary_location.csv.gz"),
+            "name": "works_primary_location.csv.gz",
             "columns": [
                 "work_id",
                 "publication_year",
@@ -348,7 +367,7 @@ csv_files = dict(
             ],
         },
         "locations": {
-            "name": os.path.join(CSV_DIR, "works_locations.csv.gz"),
+            "name": "works_locations.csv.gz",
             "columns": [
                 "work_id",
                 "publication_year",
@@ -365,7 +384,7 @@ csv_files = dict(
             ],
         },
         "authorships": {
-            "name": os.path.join(CSV_DIR, "works_authorships.csv.gz"),
+            "name": "works_authorships.csv.gz",
             "columns": [
                 "work_id",
                 "author_position",
@@ -383,11 +402,11 @@ csv_files = dict(
             ],
         },
         "biblio": {
-            "name": os.path.join(CSV_DIR, "works_biblio.csv.gz"),
+            "name": "works_biblio.csv.gz",
             "columns": ["work_id", "volume", "issue", "first_page", "last_page"],
         },
         "concepts": {
-            "name": os.path.join(CSV_DIR, "works_concepts.csv.gz"),
+            "name": "works_concepts.csv.gz",
             "columns": [
                 "work_id",
                 "publication_year",
@@ -398,11 +417,11 @@ csv_files = dict(
             ],
         },
         "ids": {
-            "name": os.path.join(CSV_DIR, "works_ids.csv.gz"),
+            "name": "works_ids.csv.gz",
             "columns": ["work_id", "openalex", "doi", "mag", "pmid", "pmcid"],
         },
         "mesh": {
-            "name": os.path.join(CSV_DIR, "works_mesh.csv.gz"),
+            "name": "works_mesh.csv.gz",
             "columns": [
                 "work_id",
                 "descriptor_ui",
@@ -413,7 +432,7 @@ csv_files = dict(
             ],
         },
         "open_access": {
-            "name": os.path.join(CSV_DIR, "works_open_access.csv.gz"),
+            "name": "works_open_access.csv.gz",
             "columns": [
                 "work_id",
                 "is_oa",
@@ -423,7 +442,7 @@ csv_files = dict(
             ],
         },
         "best_oa_location": {
-            "name": os.path.join(CSV_DIR, "works_best_oa_location.csv.gz"),
+            "name": "works_best_oa_location.csv.gz",
             "columns": [
                 "work_id",
                 "pdf_url",
@@ -436,17 +455,17 @@ csv_files = dict(
             ],
         },
         "referenced_works": {
-            "name": os.path.join(CSV_DIR, "works_referenced_works.csv.gz"),
+            "name": "works_referenced_works.csv.gz",
             "columns": ["work_id", "referenced_work_id"],
         },
         "related_works": {
-            "name": os.path.join(CSV_DIR, "works_related_works.csv.gz"),
+            "name": "works_related_works.csv.gz",
             "columns": ["work_id", "related_work_id"],
         },
     },
     publishers={
         "publishers": {
-            "name": os.path.join(CSV_DIR, "publishers.csv.gz"),
+            "name": "publishers.csv.gz",
             "columns": [
                 "publisher_id",
                 "publisher_name",
@@ -461,7 +480,7 @@ csv_files = dict(
             ],
         },
         "counts_by_year": {
-            "name": os.path.join(CSV_DIR, "publishers_counts_by_year.csv.gz"),
+            "name": "publishers_counts_by_year.csv.gz",
             "columns": [
                 "publisher_id",
                 "publisher_name",
@@ -472,7 +491,7 @@ csv_files = dict(
             ],
         },
         "ids": {
-            "name": os.path.join(CSV_DIR, "publishers_ids.csv.gz"),
+            "name": "publishers_ids.csv.gz",
             "columns": [
                 "publisher_id",
                 "publisher_name",
@@ -484,7 +503,7 @@ csv_files = dict(
     },
     sources={
         "sources": {
-            "name": os.path.join(CSV_DIR, "sources.csv.gz"),
+            "name": "sources.csv.gz",
             "columns": [
                 "source_id",
                 "source_name",
@@ -501,7 +520,7 @@ csv_files = dict(
             ],
         },
         "ids": {
-            "name": os.path.join(CSV_DIR, "sources_ids.csv.gz"),
+            "name": "sources_ids.csv.gz",
             "columns": [
                 "source_id",
                 "source_name",
@@ -514,7 +533,7 @@ csv_files = dict(
             ],
         },
         "counts_by_year": {
-            "name": os.path.join(CSV_DIR, "sources_counts_by_year.csv.gz"),
+            "name": "sources_counts_by_year.csv.gz",
             "columns": [
                 "source_id",
                 "source_name",
@@ -527,7 +546,7 @@ csv_files = dict(
     },
     topics={
         "topics": {
-            "name": os.path.join(CSV_DIR, "topics.csv.gz"),
+            "name": "topics.csv.gz",
             "columns": [
                 "topic_id",
                 "topic_name",
@@ -543,7 +562,7 @@ csv_files = dict(
             ],
         },
         "keywords": {
-            "name": os.path.join(CSV_DIR, "topics_keywords.csv.gz"),
+            "name": "topics_keywords.csv.gz",
             "columns": [
                 "topic_id",
                 "topic_name",
@@ -551,7 +570,7 @@ csv_files = dict(
             ],
         },
         "siblings": {
-            "name": os.path.join(CSV_DIR, "topics_siblings.csv.gz"),
+            "name": "topics_siblings.csv.gz",
             "columns": [
                 "topic_id",
                 "topic_name",
@@ -562,7 +581,7 @@ csv_files = dict(
     },
     funders={
         'funders': {
-            "name": os.path.join(CSV_DIR, "funders.csv.gz"),
+            "name": "funders.csv.gz",
             "columns": [
                 'funder_id',
                 'funder_name',
@@ -575,7 +594,7 @@ csv_files = dict(
             ],
         },
         'ids': {
-            'name': os.path.join(CSV_DIR, "funders_ids.csv.gz"),
+            'name': "funders_ids.csv.gz",
             'columns': [
                 'funder_id',
                 'funder_name',
@@ -586,7 +605,7 @@ csv_files = dict(
             ],
         },
         'alternate_titles': {
-            'name': os.path.join(CSV_DIR, "funders_alternate_titles.csv.gz"),
+            'name': "funders_alternate_titles.csv.gz",
             'columns': [
                 'funder_id',
                 'funder_name',
@@ -594,7 +613,7 @@ csv_files = dict(
             ]
         },
         'roles': {
-            'name': os.path.join(CSV_DIR, "funders_roles.csv.gz"),
+            'name': "funders_roles.csv.gz",
             'columns': [
                 'funder_id',
                 'funder_name',
@@ -604,7 +623,7 @@ csv_files = dict(
             ]
         },
         'summary_stats': {
-            'name': os.path.join(CSV_DIR, "funders_summary_stats.csv.gz"),
+            'name': "funders_summary_stats.csv.gz",
             'columns': [
                 'funder_id',
                 'funder_name',
@@ -619,7 +638,7 @@ csv_files = dict(
             ]
         },
         'counts_by_year': {
-            'name': os.path.join(CSV_DIR, "funders_counts_by_year.csv.gz"),
+            'name': "funders_counts_by_year.csv.gz",
             'columns': [
                 'funder_id',
                 'funder_name',
@@ -632,6 +651,15 @@ csv_files = dict(
     },
 )
 
+
+def get_csv_files(csv_dir: Path, compression: str = 'gzip') -> dict:
+    """
+    CSV_FILE_SPECS with the names as paths inside csv_dir, with the suffix of the compression (gzip or zstd)
+    """
+    return {entity: {kind: dict(spec, name=str(csv_path(os.path.join(csv_dir, spec['name']), compression)))
+                     for kind, spec in specs.items()}
+            for entity, specs in CSV_FILE_SPECS.items()}
+
 STRING_DTYPE = 'string[pyarrow]'  # use the more memory efficient PyArrow string datatype
 # STRING_DTYPE = 'string[python]'
 
@@ -642,33 +670,8 @@ if pd.__version__ < '2':
     raise NotImplementedError(f'Please use Pandas v2')
 
 if pd.__version__ >= '2.1':
-    print('Using PyArrow strings!')
     pd.options.future.infer_string = True
 
-inst_path = CSV_DIR / 'institutions.csv.gz'
-if inst_path.exists():
-    inst_info_d = (  # store the instittutions names and country codes in a dictionary
-        pd.read_csv(inst_path)
-        .set_index('institution_id')
-        [['institution_name', 'country_code']]
-        .to_dict()
-    )
-else:
-    print('Inst CSV not found!')
-
-topic_path = CSV_DIR / 'topics.csv.gz'
-if topic_path.exists():
-    topic_info_d = (  # store the topic info in a dictionary
-        pd.read_csv(topic_path)
-        .set_index('topic_id')
-        [['topic_name', 'subfield_id', 'subfield_name', 'field_id', 'field_name', 'domain_id', 'domain_name']]
-        .convert_dtypes()
-        .to_dict()
-    )
-else:
-    print('Topic CSV not found!')
-
-
 DTYPES = {
     "works": dict(
         work_id="int64",
@@ -834,13 +837,23 @@ def read_csvs(paths):
     return df
 
 
-def str_to_int(s):
-    return int(s[1:])
+def parquets_to_csv(parq_files, path, columns) -> int:
+    """
+    Concatenate the parquets into a compressed CSV with these columns (a header line only if there are none),
+    a record batch at a time through CSVTableWriter, with the compression of CONFIG
+    Returns the number of rows
+    """
+    with CSVTableWriter(path, columns=columns, compression=CONFIG.csv_compression,
+                        compression_level=CONFIG.csv_compression_level) as writer:
+        for parq_file in tqdm(parq_files, desc=f'Writing {writer.path.name}', unit='files', leave=False):
+            for batch in pq.ParquetFile(parq_file).iter_batches(columns=columns, batch_size=CSV_BATCH_ROWS):
+                writer.write(batch)
+    return writer.rows_written
 
 
 def merge_all_skip_ids(kind, overwrite):
-    merged_entries_path = SNAPSHOT_DIR / 'data' / 'merged_ids' / kind
-    merged_parq_path = PARQ_DIR / f'{kind}_combined_merged_ids.parquet'
+    merged_entries_path = CONFIG.snapshot_dir / 'data' / 'merged_ids' / kind
+    merged_parq_path = CONFIG.parq_dir / f'{kind}_combined_merged_ids.parquet'
 
     if not overwrite and merged_parq_path.exists():
         print(f'Merged parquet for {kind} exists! Skipping....')
@@ -853,873 +866,370 @@ def merge_all_skip_ids(kind, overwrite):
     merged_dfs = []
 
     for csv_file in tqdm(csvs, desc=f'{kind}'):
-        merged_df = pd.read_csv(
-            csv_file, engine='c', usecols=['id', 'merge_into_id'],
-            converters={'id': str_to_int, 'merge_into_id': str_to_int},
-            memory_map=True,
-        )
+        merged_table = pacsv.read_csv(csv_file, convert_options=pacsv.ConvertOptions(
+            include_columns=['id', 'merge_into_id'], column_types={'id': pa.utf8(), 'merge_into_id': pa.utf8()}
+        ))
+        merged_df = pd.DataFrame({
+            col: convert_openalex_ids_to_int(merged_table.column(col), as_arrow=True)[0].cast(pa.int64()).to_pandas()
+            for col in ['id', 'merge_into_id']
+        })
         merged_dfs.append(merged_df)
 
     combined_df = pd.concat(merged_dfs, ignore_index=True).drop_duplicates()
     print(f'Writing {len(combined_df):,} rows of merged skip ids for {kind!r} at {str(merged_entries_path)!r}')
     combined_df.to_parquet(merged_parq_path, engine='pyarrow')
+    get_skip_ids(kind)  # rebuild the memory-mapped skip id array from the new parquet
     return
 
 
 def get_skip_ids(kind):
     """
     Get the set of IDs that have been merged with other IDs to skip over them
+    The IDs are kept in a sorted uint64 array memory-mapped from CONFIG.parq_dir/{kind}_skip_ids.npy so that
+    pool workers share it instead of holding their own Python sets
     """
     DELETED_WORK_ID, DELETED_AUTHOR_ID, DELETED_INST_ID, DELETED_SOURCE_ID = 4285719527, 5317838346, 4389424196, 4317411217
     deleted_ids = {'works': DELETED_WORK_ID, 'authors': DELETED_AUTHOR_ID, 'institutions': DELETED_INST_ID,
                    'source': DELETED_SOURCE_ID}
+    extra_ids = [deleted_ids[kind]] if kind in deleted_ids else []  # add deleted ids for tables
 
-    merged_entries_path = SNAPSHOT_DIR / 'data' / 'merged_ids' / kind
+    merged_entries_path = CONFIG.snapshot_dir / 'data' / 'merged_ids' / kind
+    skip_ids_path = CONFIG.parq_dir / f'{kind}_skip_ids.npy'
     if merged_entries_path.exists():
         # check for merged parquet
-        merged_parq_path = PARQ_DIR / f'{kind}_combined_merged_ids.parquet'
+        merged_parq_path = CONFIG.parq_dir / f'{kind}_combined_merged_ids.parquet'
 
         if merged_parq_path.exists():
-            merged_df = pd.read_parquet(merged_parq_path, columns=['id'])
-            skip_ids = set(merged_df['id'])
+            if skip_ids_path.exists() and skip_ids_path.stat().st_mtime >= merged_parq_path.stat().st_mtime:
+                skip_ids = SortedIDSet(path=skip_ids_path)
+            else:
+                skip_ids = SortedIDSet.from_parquet(merged_parq_path, path=skip_ids_path, extra_ids=extra_ids)
         else:
             merged_df = read_csvs(merged_entries_path.glob('*.csv.gz'))
-            skip_ids = set(
-                merged_df
-                .id
-            )
-            skip_ids = {convert_openalex_id_to_int(id_) for id_ in skip_ids}
+            skip_ids, valid = convert_openalex_ids_to_int(merged_df.id.unique())
+            skip_ids = SortedIDSet(ids=np.concatenate([skip_ids[valid], np.asarray(extra_ids, dtype=np.uint64)]))
     else:
-        skip_ids = set()
-
-    if kind in deleted_ids:  # add deleted ids for tables
-        skip_ids.add(deleted_ids[kind])
+        skip_ids = SortedIDSet(ids=extra_ids)
 
     print(f'{kind!r} {len(skip_ids):,} merged {kind} IDs')
     return skip_ids
 
-def flatten_funders():
-    print(f'Flattening funders.....')
-    with gzip.open(csv_files['funders']['funders']['name'], 'wt', encoding='utf-8') as funders_csv, \
-            gzip.open(csv_files['funders']['counts_by_year']['name'], 'wt', encoding='utf-8') as counts_by_year_csv, \
-            gzip.open(csv_files['funders']['ids']['name'], 'wt', encoding='utf-8') as ids_csv, \
-            gzip.open(csv_files['funders']['alternate_titles']['name'], 'wt', encoding='utf-8') as alt_titles_csv,\
-            gzip.open(csv_files['funders']['roles']['name'], 'wt', encoding='utf-8') as roles_csv, \
-            gzip.open(csv_files['funders']['summary_stats']['name'], 'wt', encoding='utf-8') as stats_csv:
-
-        funders_writer = csv.DictWriter(
-            funders_csv, fieldnames=csv_files['funders']['funders']['columns'], extrasaction='ignore'
-        )
-        funders_writer.writeheader()
-
-        counts_by_year_writer = csv.DictWriter(counts_by_year_csv, extrasaction='ignore',
-                                               fieldnames=csv_files['funders']['counts_by_year']['columns'])
-        counts_by_year_writer.writeheader()
-
-        ids_writer = csv.DictWriter(ids_csv, extrasaction='ignore',
-                                    fieldnames=csv_files['funders']['ids']['columns'])
-        ids_writer.writeheader()
-
-        alternate_titles_writer = csv.DictWriter(alt_titles_csv, extrasaction='ignore',
-                                                 fieldnames=csv_files['funders']['alternate_titles']['columns'])
-        alternate_titles_writer.writeheader()
-
-        roles_writer = csv.DictWriter(roles_csv, extrasaction='ignore',
-                                      fieldnames=csv_files['funders']['roles']['columns'])
-        roles_writer.writeheader()
-
-        summary_stats_writer = csv.DictWriter(stats_csv, extrasaction='ignore',
-                                              fieldnames=csv_files['funders']['summary_stats']['columns'])
-        summary_stats_writer.writeheader()
-
-        seen_funder_ids = set()
-
-        files_done = 0
-        for jsonl_file_name in glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'funders', '*', '*.gz')):
-            # print(jsonl_file_name)
-            with gzip.open(jsonl_file_name, 'r') as funders_jsonl:
-                for funder_json in funders_jsonl:
-                    if not funder_json.strip():
-                        continue
-
-                    funder = json.loads(funder_json)
-
-                    if not (funder_id := funder.get('id')) or funder_id in seen_funder_ids:
-                        continue
-
-                    funder_id = convert_openalex_id_to_int(funder_id)
-                    seen_funder_ids.add(funder_id)
-
-                    funder['funder_id'] = funder_id
-                    funder['funder_name'] = funder['display_name']
-                    funders_writer.writerow(funder)
-
-
-                    # alternate titles
-                    if funder_alternate_titles := funder.get('alternate_titles'):
-                        for alt_title in funder_alternate_titles:
-                            row = {'funder_id': funder_id, 'funder_name': funder['funder_name'],
-                                   'alternate_title': alt_title}
-                            alternate_titles_writer.writerow(row)
-
-
-                    # ids
-                    if funder_ids := funder.get('ids'):
-                        funder_ids['funder_id'] = funder_id
-                        funder_ids['funder_name'] = funder['funder_name']
-                        ids_writer.writerow(funder_ids)
-
-                    # counts per year
-                    if counts_by_year := funder.get('counts_by_year'):
-                        for count_by_year in counts_by_year:
-                            count_by_year['funder_id'] = funder_id
-                            count_by_year['funder_name'] = funder['funder_name']
-                            counts_by_year_writer.writerow(count_by_year)
-
-                    # roles
-                    if roles := funder.get('roles'):
-                        for role in roles:
-                            role_row = {'funder_id': funder_id, 'funder_name': funder['funder_name'],
-                                        'role_type': role['role'], 'role_id': convert_openalex_id_to_int(role['id']),
-                                        'works_count': role['works_count']}
-                            roles_writer.writerow(role_row)
-
-                    # summary stats
-                    if summary_stats := funder.get('summary_stats'):
-                        summary_stats['funder_id'] = funder_id
-                        summary_stats['funder_name'] = funder['funder_name']
-                        summary_stats_writer.writerow(summary_stats)
-
-
-            files_done += 1
-            if FILES_PER_ENTITY and files_done >= FILES_PER_ENTITY:
-                break
-
-
-
-def flatten_publishers():
-    with gzip.open(csv_files['publishers']['publishers']['name'], 'wt', encoding='utf-8') as publishers_csv, \
-            gzip.open(csv_files['publishers']['counts_by_year']['name'], 'wt', encoding='utf-8') as counts_by_year_csv, \
-            gzip.open(csv_files['publishers']['ids']['name'], 'wt', encoding='utf-8') as ids_csv:
-
-        publishers_writer = csv.DictWriter(
-            publishers_csv, fieldnames=csv_files['publishers']['publishers']['columns'], extrasaction='ignore'
-        )
-        publishers_writer.writeheader()
-
-        counts_by_year_writer = csv.DictWriter(counts_by_year_csv,
-                                               fieldnames=csv_files['publishers']['counts_by_year']['columns'])
-        counts_by_year_writer.writeheader()
-
-        ids_writer = csv.DictWriter(ids_csv, fieldnames=csv_files['publishers']['ids']['columns'])
-        ids_writer.writeheader()
-
-        seen_publisher_ids = set()
-        skip_ids = get_skip_ids('publishers')
-
-        files_done = 0
-        for jsonl_file_name in glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'publishers', '*', '*.gz')):
-            # print(jsonl_file_name)
-            with gzip.open(jsonl_file_name, 'r') as concepts_jsonl:
-                for publisher_json in concepts_jsonl:
-                    if not publisher_json.strip():
-                        continue
-
-                    publisher = json.loads(publisher_json)
-
-                    if not (publisher_id := publisher.get('id')):
-                        continue
-
-                    publisher_id = convert_openalex_id_to_int(publisher_id)
-                    if publisher_id in seen_publisher_ids or publisher_id in skip_ids:
-                        continue
-
-                    publisher['publisher_id'] = publisher_id
-                    publisher['publisher_name'] = publisher['display_name']
-                    seen_publisher_ids.add(publisher_id)
-
-                    # publishers
-                    publisher['alternate_titles'] = json.dumps(publisher.get('alternate_titles'), ensure_ascii=False)
-                    publisher['country_codes'] = json.dumps(publisher.get('country_codes'), ensure_ascii=False)
-                    publishers_writer.writerow(publisher)
-
-                    if publisher_ids := publisher.get('ids'):
-                        publisher_ids['publisher_id'] = publisher_id
-                        publisher_ids['publisher_name'] = publisher['display_name']
-                        ids_writer.writerow(publisher_ids)
-
-                    if counts_by_year := publisher.get('counts_by_year'):
-                        for count_by_year in counts_by_year:
-                            count_by_year['publisher_id'] = publisher_id
-                            count_by_year['publisher_name'] = publisher['display_name']
-                            counts_by_year_writer.writerow(count_by_year)
-
-            files_done += 1
-            if FILES_PER_ENTITY and files_done >= FILES_PER_ENTITY:
-                break
-
-
-def flatten_sources():
-    with gzip.open(csv_files['sources']['sources']['name'], 'wt', encoding='utf-8') as sources_csv, \
-            gzip.open(csv_files['sources']['ids']['name'], 'wt', encoding='utf-8') as ids_csv, \
-            gzip.open(csv_files['sources']['counts_by_year']['name'], 'wt', encoding='utf-8') as counts_by_year_csv:
-
-        sources_writer = csv.DictWriter(
-            sources_csv, fieldnames=csv_files['sources']['sources']['columns'], extrasaction='ignore'
-        )
-        sources_writer.writeheader()
-
-        ids_writer = csv.DictWriter(ids_csv, fieldnames=csv_files['sources']['ids']['columns'])
-        ids_writer.writeheader()
-
-        counts_by_year_writer = csv.DictWriter(counts_by_year_csv,
-                                               fieldnames=csv_files['sources']['counts_by_year']['columns'])
-        counts_by_year_writer.writeheader()
-
-        seen_source_ids = set()
-        skip_ids = get_skip_ids('sources')
-
-        files_done = 0
-        for jsonl_file_name in glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'sources', '*', '*.gz')):
-            # print(jsonl_file_name)
-            with gzip.open(jsonl_file_name, 'r') as sources_jsonl:
-                for source_json in sources_jsonl:
-                    if not source_json.strip():
-                        continue
-
-                    source = json.loads(source_json)
-
-                    if not (source_id := source.get('id')):
-                        continue
-                    source_id = convert_openalex_id_to_int(source_id)
-                    if source_id in skip_ids or source_id in seen_source_ids:
-                        continue
-
-                    source['source_id'] = source_id
-                    source['source_name'] = source['display_name']
-
-                    seen_source_ids.add(source_id)
-
-                    source['issn'] = json.dumps(source.get('issn'))
-                    sources_writer.writerow(source)
-
-                    if source_ids := source.get('ids'):
-                        source_ids['source_id'] = source_id
-                        source_ids['source_name'] = source['source_name']
-                        source_ids['issn'] = json.dumps(source_ids.get('issn'))
-                        ids_writer.writerow(source_ids)
-
-                    if counts_by_year := source.get('counts_by_year'):
-                        for count_by_year in counts_by_year:
-                            count_by_year['source_name'] = source['source_name']
-                            count_by_year['source_id'] = source_id
-                            counts_by_year_writer.writerow(count_by_year)
-
-            files_done += 1
-            if FILES_PER_ENTITY and files_done >= FILES_PER_ENTITY:
-                break
-
-
-def flatten_topics():
-    print(f'Flattening topics.....')
-    with gzip.open(csv_files['topics']['topics']['name'], 'wt', encoding='utf-8') as topics_csv, \
-            gzip.open(csv_files['topics']['keywords']['name'], 'wt', encoding='utf-8') as keywords_csv, \
-            gzip.open(csv_files['topics']['siblings']['name'], 'wt', encoding='utf-8') as siblings_csv:
-
-        topics_writer = csv.DictWriter(
-            topics_csv, fieldnames=csv_files['topics']['topics']['columns'], extrasaction='ignore'
-        )
-        topics_writer.writeheader()
-
-        keywords_writer = csv.DictWriter(keywords_csv, fieldnames=csv_files['topics']['keywords']['columns'],
-                                         extrasaction='ignore')
-        keywords_writer.writeheader()
-
-        siblings_writer = csv.DictWriter(siblings_csv, fieldnames=csv_files['topics']['siblings']['columns'],
-                                         extrasaction='ignore')
-        siblings_writer.writeheader()
-
-        seen_topic_ids = set()
-
-        files_done = 0
-        for jsonl_file_name in glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'topics', '*', '*.gz')):
-            # print(jsonl_file_name)
-            with gzip.open(jsonl_file_name, 'r') as topics_jsonl:
-                for topic_json in topics_jsonl:
-                    if not topic_json.strip():
-                        continue
-
-                    topic = json.loads(topic_json)
-
-                    if not (topic_id := topic.get('id')):
-                        continue
-                    topic_id = convert_topic_id_to_int(topic_id)
-                    if topic_id in seen_topic_ids:
-                        continue
-
-                    topic['topic_id'] = topic_id
-                    topic['topic_name'] = topic['display_name']
-                    topic['num_works'] = topic['works_count']
-
-                    for genre in ['subfield', 'field', 'domain']:
-                        # print(f'\n---------\n{topic_id=}\n{=}\n{topic=}\n\n----------')
-                        topic[f'{genre}_id'] = convert_topic_id_to_int(topic[genre]['id'])
-                        topic[f'{genre}_name'] = topic[genre]['display_name']
-
-                    seen_topic_ids.add(topic_id)
-                    topics_writer.writerow(topic)
-
-                    if keywords := topic.get('keywords'):
-                        keywords_d = {}
-                        for keyword in keywords:
-                            keywords_d['topic_id'] = topic['topic_id']
-                            keywords_d['topic_name'] = topic['topic_name']
-                            keywords_d['keyword'] = keyword
-                            keywords_writer.writerow(keywords_d)
-
-                    # print(f'{str(jsonl_file_name)=} {topic_id=} {topic.keys()=}')
-
-                    if siblings := topic.get('siblings'):
-                        for sibling in siblings:
-                            sibling['topic_id'] = topic_id
-                            sibling['topic_name'] = topic['topic_name']
-                            sibling['sibling_topic_name'] = sibling['display_name']
-                            sibling['sibling_topic_id'] = convert_topic_id_to_int(sibling['id'])
-                            siblings_writer.writerow(sibling)
-
-            files_done += 1
-            if FILES_PER_ENTITY and files_done >= FILES_PER_ENTITY:
-                break
-
-
-def flatten_concepts():
-    # read the merged entries and skip over those entries
-    skip_ids = get_skip_ids('concepts')
-
-    with gzip.open(csv_files['concepts']['concepts']['name'], 'wt', encoding='utf-8') as concepts_csv, \
-            gzip.open(csv_files['concepts']['ancestors']['name'], 'wt', encoding='utf-8') as ancestors_csv, \
-            gzip.open(csv_files['concepts']['counts_by_year']['name'], 'wt', encoding='utf-8') as counts_by_year_csv, \
-            gzip.open(csv_files['concepts']['ids']['name'], 'wt', encoding='utf-8') as ids_csv, \
-            gzip.open(csv_files['concepts']['related_concepts']['name'], 'wt',
-                      encoding='utf-8') as related_concepts_csv:
-
-        concepts_writer = csv.DictWriter(
-            concepts_csv, fieldnames=csv_files['concepts']['concepts']['columns'], extrasaction='ignore'
-        )
-        concepts_writer.writeheader()
-
-        ancestors_writer = csv.DictWriter(ancestors_csv, fieldnames=csv_files['concepts']['ancestors']['columns'])
-        ancestors_writer.writeheader()
-
-        counts_by_year_writer = csv.DictWriter(counts_by_year_csv,
-                                               fieldnames=csv_files['concepts']['counts_by_year']['columns'])
-        counts_by_year_writer.writeheader()
-
-        ids_writer = csv.DictWriter(ids_csv, fieldnames=csv_files['concepts']['ids']['columns'])
-        ids_writer.writeheader()
 
-        related_concepts_writer = csv.DictWriter(related_concepts_csv,
-                                                 fieldnames=csv_files['concepts']['related_concepts']['columns'])
-        related_concepts_writer.writeheader()
-
-        seen_concept_ids = set()
-
-        files = list(glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'concepts', '*', '*.gz')))
-        for jsonl_file_name in tqdm(files, desc='Flattening concepts...', unit=' file'):
-            with gzip.open(jsonl_file_name, 'r') as concepts_jsonl:
-                for concept_json in concepts_jsonl:
-                    if not concept_json.strip():
-                        continue
+def get_entity_parquet_path(entity: str, table: str) -> Path:
+    """
+    Parquet of a table of a small entity in CONFIG.parq_dir, named like its CSV, eg: institutions_geo.parquet
+    """
+    return CONFIG.parq_dir / CSV_FILE_SPECS[entity][table]['name'].replace('.csv.gz', '.parquet')
 
-                    concept = json.loads(concept_json)
 
-                    if not (concept_id := concept.get('id')) or concept_id in seen_concept_ids:
-                        continue
+def get_small_entity_scan(entity: str, skip_ids=None) -> EntityScan:
+    """
+    EntityScan of the ENTITY_SPECS spec of entity, with the columns of CSV_FILE_SPECS
+    """
+    table_columns = {table: spec['columns'] for table, spec in CSV_FILE_SPECS[entity].items()}
+    return get_entity_scan(entity, table_columns=table_columns, skip_ids=skip_ids)
 
-                    concept_id = convert_openalex_id_to_int(concept_id)  # convert to int
-                    if concept_id in skip_ids:  # skip over already merged IDs
-                        continue
 
-                    concept_name = concept['display_name']
-                    seen_concept_ids.add(concept_id)
+def _flatten_entity_part_worker(entity: str, jsonl_filename: str) -> dict:
+    """
+    Pool task of flatten_entity: the tables of one part as Arrow tables, records repeated in the part are dropped
+    """
+    scan = get_small_entity_scan(entity, skip_ids=_WORKER_STATE['skip_ids'])
+    buffers = {table: scan.get_buffer(table) for table in scan.tables}
+    scan.scan_part(jsonl_filename, buffers)
+    return {table: buffer.to_table() for table, buffer in buffers.items()}
 
-                    concept['concept_id'] = concept_id
-                    concept['concept_name'] = concept_name
-                    concepts_writer.writerow(concept)
 
-                    if concept_ids := concept.get('ids'):
-                        concept_ids['concept_id'] = concept_id
-                        concept_ids['concept_name'] = concept_name
-                        concept_ids['umls_aui'] = json.dumps(concept_ids.get('umls_aui'), ensure_ascii=False)
-                        concept_ids['umls_cui'] = json.dumps(concept_ids.get('umls_cui'), ensure_ascii=False)
-                        ids_writer.writerow(concept_ids)
+def _star_flatten_entity_part_worker(args):
+    return _flatten_entity_part_worker(*args)
 
-                    if ancestors := concept.get('ancestors'):
-                        for ancestor in ancestors:
-                            if ancestor_id := ancestor.get('id'):
-                                ancestors_writer.writerow({
-                                    'concept_id': concept_id,
-                                    'ancestor_id': ancestor_id
-                                })
 
-                    if counts_by_year := concept.get('counts_by_year'):
-                        for count_by_year in counts_by_year:
-                            count_by_year['concept_id'] = concept_id
-                            count_by_year['concept_name'] = concept_name
-                            counts_by_year_writer.writerow(count_by_year)
-
-                    if related_concepts := concept.get('related_concepts'):
-                        for related_concept in related_concepts:
-                            if related_concept_id := related_concept.get('id'):
-                                related_concepts_writer.writerow({
-                                    'concept_id': concept_id,
-                                    'related_concept_id': related_concept_id,
-                                    'score': related_concept.get('score')
-                                })
+def flatten_entity(entity: str, threads=1, make_csvs=True):
+    """
+    Flatten a small entity (funders, publishers, sources, topics, concepts, institutions) with its spec in
+    src/entity_specs.py into one parquet per table in CONFIG.parq_dir, and the compressed CSVs of CSV_FILE_SPECS.
+    The parts are scanned in parallel, the records already seen in an earlier part are dropped in part order,
+    so the output is the same for any number of threads
+    """
+    skip_ids = get_skip_ids(entity)
+    spec = ENTITY_SPECS[entity]
+    # newest updated_date parts first, so that the latest version of a repeated record is the one kept
+    files = sorted(glob.glob(os.path.join(CONFIG.snapshot_dir, 'data', entity, '*', '*.gz')), reverse=True)
+    if FILES_PER_ENTITY:
+        files = files[: FILES_PER_ENTITY]
+
+    scan = get_small_entity_scan(entity)
+    writers = {table: ParquetPartWriter(path=get_entity_parquet_path(entity, table), buffer=scan.get_buffer(table),
+                                        coerce_timestamps='us')  # keep the microseconds of the updated dates
+               for table in scan.tables}
+    seen_ids = np.empty(0, dtype=np.uint64)
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    try:
+        with multiprocessing.get_context(start_method).Pool(
+                processes=threads, initializer=_init_works_worker, initargs=(dict(skip_ids=skip_ids),)) as pool, \
+                tqdm(desc=f'Flattening {entity}...', total=len(files), unit='files') as pbar:
+            for tables in pool.imap(_star_flatten_entity_part_worker, [(entity, f) for f in files], chunksize=1):
+                for table, rows in tables.items():
+                    if len(seen_ids) > 0:
+                        rows = rows.filter(pa.array(~np.isin(rows.column(spec.id_column).to_numpy(), seen_ids)))
+                    writers[table].append_table(rows)
+                    writers[table].maybe_flush()
+                seen_ids = np.union1d(seen_ids, tables[entity].column(spec.id_column).to_numpy().astype(np.uint64))
+                pbar.update(1)
+                pbar.set_postfix_str(f'{len(seen_ids):,} {entity}')
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    for writer in writers.values():
+        writer.close()
+
+    if make_csvs:
+        file_spec = get_csv_files(CONFIG.csv_dir, compression=CONFIG.csv_compression)[entity]
+        for table in scan.tables:
+            parq_path = get_entity_parquet_path(entity, table)
+            parquets_to_csv([parq_path] if parq_path.exists() else [], path=file_spec[table]['name'],
+                            columns=file_spec[table]['columns'])
     return
 
 
-def flatten_institutions():
-    skip_ids = get_skip_ids('institutions')
+def flatten_funders(threads=1):
+    return flatten_entity('funders', threads=threads)
 
-    file_spec = csv_files['institutions']
 
-    with gzip.open(file_spec['institutions']['name'], 'wt', encoding='utf-8') as institutions_csv, \
-            gzip.open(file_spec['ids']['name'], 'wt', encoding='utf-8') as ids_csv, \
-            gzip.open(file_spec['geo']['name'], 'wt', encoding='utf-8') as geo_csv, \
-            gzip.open(file_spec['associated_institutions']['name'], 'wt',
-                      encoding='utf-8') as associated_institutions_csv, \
-            gzip.open(file_spec['counts_by_year']['name'], 'wt', encoding='utf-8') as counts_by_year_csv:
+def flatten_publishers(threads=1):
+    return flatten_entity('publishers', threads=threads)
 
-        institutions_writer = csv.DictWriter(
-            institutions_csv, fieldnames=file_spec['institutions']['columns'], extrasaction='ignore'
-        )
-        institutions_writer.writeheader()
 
-        ids_writer = csv.DictWriter(ids_csv, fieldnames=file_spec['ids']['columns'])
-        ids_writer.writeheader()
+def flatten_sources(threads=1):
+    return flatten_entity('sources', threads=threads)
 
-        geo_writer = csv.DictWriter(geo_csv, fieldnames=file_spec['geo']['columns'])
-        geo_writer.writeheader()
 
-        associated_institutions_writer = csv.DictWriter(
-            associated_institutions_csv, fieldnames=file_spec['associated_institutions']['columns']
-        )
-        associated_institutions_writer.writeheader()
-
-        counts_by_year_writer = csv.DictWriter(counts_by_year_csv, fieldnames=file_spec['counts_by_year']['columns'])
-        counts_by_year_writer.writeheader()
-
-        seen_institution_ids = set()
-
-        files = list(glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'institutions', '*', '*.gz')))
-        for jsonl_file_name in tqdm(files, desc='Flattening Institutions...'):
-            with gzip.open(jsonl_file_name, 'r') as institutions_jsonl:
-                for institution_json in institutions_jsonl:
-                    if not institution_json.strip():
-                        continue
-
-                    institution = orjson.loads(institution_json)
-
-                    if not (institution_id := institution.get('id')) or institution_id in seen_institution_ids:
-                        continue
-
-                    institution_id = convert_openalex_id_to_int(institution_id)
-                    if institution_id in skip_ids:
-                        continue
-
-                    institution_name = institution['display_name']
-                    seen_institution_ids.add(institution_id)
-
-                    # institutions
-                    institution['institution_id'] = institution_id
-                    institution['institution_name'] = institution_name
-                    institution['display_name_acroynyms'] = json.dumps(institution.get('display_name_acroynyms'),
-                                                                       ensure_ascii=False)
-                    institution['display_name_alternatives'] = json.dumps(institution.get('display_name_alternatives'),
-                                                                          ensure_ascii=False)
-                    institutions_writer.writerow(institution)
-
-                    # ids
-                    if institution_ids := institution.get('ids'):
-                        institution_ids['institution_id'] = institution_id
-                        institution_ids['institution_name'] = institution_name
-                        ids_writer.writerow(institution_ids)
-
-                    # geo
-                    if institution_geo := institution.get('geo'):
-                        institution_geo['institution_id'] = institution_id
-                        institution_geo['institution_name'] = institution_name
-                        geo_writer.writerow(institution_geo)
-
-                    # associated_institutions
-                    if associated_institutions := institution.get(
-                            'associated_institutions', institution.get('associated_insitutions')  # typo in api
-                    ):
-                        for associated_institution in associated_institutions:
-                            if associated_institution_id := associated_institution.get('id'):
-                                associated_institutions_writer.writerow({
-                                    'institution_id': institution_id,
-                                    'associated_institution_id': convert_openalex_id_to_int(associated_institution_id),
-                                    'relationship': associated_institution.get('relationship'),
-                                })
+def flatten_topics(threads=1):
+    return flatten_entity('topics', threads=threads)
 
-                    # counts_by_year
-                    if counts_by_year := institution.get('counts_by_year'):
-                        for count_by_year in counts_by_year:
-                            count_by_year['institution_id'] = institution_id
-                            count_by_year['institution_name'] = institution_name
-                            counts_by_year_writer.writerow(count_by_year)
-    return
 
+def flatten_concepts(threads=1):
+    return flatten_entity('concepts', threads=threads)
 
-def flatten_authors(files_to_process: str | int = 'all'):
-    skip_ids = get_skip_ids('authors')
 
-    file_spec = csv_files['authors']
+def flatten_institutions(threads=1):
+    return flatten_entity('institutions', threads=threads)
 
-    authors_csv_exists = Path(file_spec['authors']['name']).exists()
-    ids_csv_exists = Path(file_spec['ids']['name']).exists()
-    counts_by_year_csv_exists = Path(file_spec['counts_by_year']['name']).exists()
-    authors_concepts_csv_exists = Path(file_spec['concepts']['name']).exists()
-    authors_hints_csv_exists = Path(file_spec['hints']['name']).exists()
 
-    with gzip.open(file_spec['authors']['name'], 'at', encoding='utf-8') as authors_csv, \
-            gzip.open(file_spec['ids']['name'], 'at', encoding='utf-8') as ids_csv, \
-            gzip.open(file_spec['counts_by_year']['name'], 'at', encoding='utf-8') as counts_by_year_csv, \
-            gzip.open(file_spec['concepts']['name'], 'at', encoding='utf-8') as authors_concepts_csv, \
-            gzip.open(file_spec['hints']['name'], 'at', encoding='utf-8') as authors_hints_csv:
+AUTHORS_TABLES = list(AUTHORS_SCHEMAS)  # authors, ids, counts_by_year, concepts, concepts_zero, hints
 
-        authors_writer = csv.DictWriter(
-            authors_csv, fieldnames=file_spec['authors']['columns'], extrasaction='ignore'
-        )
-        if not authors_csv_exists:
-            authors_writer.writeheader()
-
-        ids_writer = csv.DictWriter(ids_csv, fieldnames=file_spec['ids']['columns'])
-        if not ids_csv_exists:
-            ids_writer.writeheader()
-
-        counts_by_year_writer = csv.DictWriter(counts_by_year_csv, fieldnames=file_spec['counts_by_year']['columns'])
-        if not counts_by_year_csv_exists:
-            counts_by_year_writer.writeheader()
-
-        authors_concepts_writer = csv.DictWriter(
-            authors_concepts_csv, fieldnames=file_spec['concepts']['columns'], extrasaction='ignore'
-        )
-        if not authors_concepts_csv_exists:
-            authors_concepts_writer.writeheader()
 
-        authors_hints_writer = csv.DictWriter(
-            authors_hints_csv, fieldnames=file_spec['hints']['columns'], extrasaction='ignore'
-        )
-        if not authors_hints_csv_exists:
-            authors_hints_writer.writeheader()
-
-        print(f'This might take a while, like 6-7 hours..')
+def get_authors_ledger() -> Ledger:
+    """
+    Checkpoint ledger of the authors parquets, shared with the works tables in CONFIG.parq_dir
+    """
+    return Ledger(CONFIG.parq_dir / 'temp' / 'ledger.sqlite')
 
-        finished_files_pickle_path = CSV_DIR / 'temp' / 'finished_authors.pkl'
-        finished_files_pickle_path.parent.mkdir(exist_ok=True)  # make the temp directory if needed
 
-        if finished_files_pickle_path.exists():
-            finished_files = load_pickle(finished_files_pickle_path)  # load the pickle
-            print(f'{len(finished_files)} existing files found!')
-        else:
-            finished_files = set()
+def _concept_ids_to_arrow(concept_ids: list) -> pa.Array:
+    return convert_openalex_ids_to_int(concept_ids, as_arrow=True)[0]
 
-        authors_manifest = read_manifest(kind='authors', snapshot_dir=SNAPSHOT_DIR / 'data')
-        files = [str(entry.filename) for entry in authors_manifest.entries]
-        # files = map(str, glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'authors', '*', '*.gz')))
-        files = [f for f in files if f not in finished_files]
 
-        if files_to_process == 'all':
-            files_to_process = len(files)
+def _extract_authors(batch: ScanBatch, writer) -> None:
+    last_known_insts, _ = convert_openalex_ids_to_int(
+        [(author.get('last_known_institution') or {}).get('id') for author in batch.records], as_arrow=True)
+    for author, author_id, last_known_institution in zip(batch.records, batch.ids, last_known_insts.to_pylist()):
+        orcid = author.get('orcid')
+        orcid = orcid.replace('https://orcid.org/', '') if orcid is not None else None
+        writer.append_values(author_id, orcid, author['display_name'],
+                             json.dumps(author.get('display_name_alternatives'), ensure_ascii=False),
+                             author.get('works_count'), author.get('cited_by_count'), last_known_institution,
+                             author.get('updated_date'))
 
-        print(f'{files_to_process=}')
 
-        for i, jsonl_file_name in tqdm(enumerate(files), desc='Flattening authors...', unit=' file',
-                                       total=files_to_process):
-            if i > files_to_process:
-                break
+def _extract_authors_ids(batch: ScanBatch, writer) -> None:
+    for author, author_id in zip(batch.records, batch.ids):
+        if ids := author.get('ids'):
+            writer.append_values(author_id, author['display_name'], ids.get('openalex'), ids.get('orcid'),
+                                 ids.get('scopus'), ids.get('twitter'), ids.get('wikipedia'), ids.get('mag'))
 
-            with gzip.open(jsonl_file_name, 'r') as authors_jsonl:
-                authors_jsonls = authors_jsonl.readlines()
 
-            authors_rows, ids_rows, counts_by_year_rows, authors_concepts_rows, author_hints_rows = [], [], [], [], []
+def _extract_authors_counts_by_year(batch: ScanBatch, writer) -> None:
+    for author, author_id in zip(batch.records, batch.ids):
+        for count_by_year in author.get('counts_by_year') or []:
+            writer.append_values(author_id, author['display_name'], count_by_year.get('year'),
+                                 count_by_year.get('works_count'), count_by_year.get('cited_by_count'))
 
-            for author_json in tqdm(authors_jsonls, desc='Parsing JSONs', leave=False, unit=' line', unit_scale=True):
-                if not author_json.strip():
-                    continue
 
-                author = orjson.loads(author_json)
-
-                if not (author_id := author.get('id')):
-                    continue
-                author_id = convert_openalex_id_to_int(author_id)
-                if author_id in skip_ids:
+def _authors_concepts_extractor(max_level: Optional[int] = None) -> Callable[[ScanBatch, object], None]:
+    """
+    x_concepts of the authors, with the works and citation counts of the author. Only the concepts up to max_level
+    """
+    def _extract(batch: ScanBatch, writer) -> None:
+        for author, author_id in zip(batch.records, batch.ids):
+            for x_concept in author.get('x_concepts') or []:
+                if max_level is not None and (x_concept.get('level') is None or x_concept['level'] > max_level):
                     continue
+                writer.append_values(author_id, author['display_name'], author.get('works_count', 0),
+                                     author.get('cited_by_count', 0), x_concept.get('id'),
+                                     x_concept.get('display_name'), x_concept.get('level'), x_concept.get('score'))
+    return _extract
 
-                author_name = author['display_name']
-
-                # authors
-                author['author_id'] = author_id
-                author['author_name'] = author_name
-                author['display_name_alternatives'] = json.dumps(author.get('display_name_alternatives'),
-                                                                 ensure_ascii=False)
-                last_known_institution = (author.get('last_known_institution') or {}).get('id')
-                if last_known_institution is not None:
-                    last_known_institution = convert_openalex_id_to_int(last_known_institution)
-                author['last_known_institution'] = last_known_institution
-
-                orcid = author['orcid']
-                orcid = orcid.replace('https://orcid.org/', '') if orcid is not None else None
-                author['orcid'] = orcid
-
-                authors_rows.append(author)
-                # authors_writer.writerow(author)
-
-                # ids
-                if author_ids := author.get('ids'):
-                    author_ids['author_id'] = author_id
-                    author_ids['author_name'] = author_name
-                    # ids_writer.writerow(author_ids)
-                    ids_rows.append(author_ids)
-
-                # counts_by_year
-                if counts_by_year := author.get('counts_by_year'):
-                    for count_by_year in counts_by_year:
-                        count_by_year['author_id'] = author_id
-                        count_by_year['author_name'] = author_name
-                        counts_by_year_rows.append(count_by_year)
-                        # counts_by_year_writer.writerow(count_by_year)
-
-                # concepts
-                if x_concepts := author.get('x_concepts'):
-                    for x_concept in x_concepts:
-                        x_concept['author_id'] = author_id
-                        x_concept['author_name'] = author_name
-                        x_concept['concept_id'] = convert_openalex_id_to_int(x_concept['id'])
-                        x_concept['concept_name'] = x_concept['display_name']
-
-                        # authors_concepts_writer.writerow(x_concept)
-                        authors_concepts_rows.append(x_concept)
-
-                # hints
-                author_hints_row = {}
-                author_name = author['display_name']
-                author_hints_row['author_id'] = author_id
-                author_hints_row['author_name'] = author_name
-                author_hints_row['works_count'] = author.get('works_count', 0)
-                author_hints_row['cited_by_count'] = author.get('cited_by_count', 0)
-                author_hints_row['most_cited_work'] = author.get('most_cited_work', '')
-
-                # authors_hints_writer.writerow(author_hints_row)
-                author_hints_rows.append(author_hints_row)
-
-            ## write all the lines to the CSVs
-            authors_writer.writerows(authors_rows)
-            ids_writer.writerows(ids_rows)
-            counts_by_year_writer.writerows(counts_by_year_rows)
-            authors_concepts_writer.writerows(authors_concepts_rows)
-            authors_hints_writer.writerows(author_hints_rows)
-
-            finished_files.add(str(jsonl_file_name))
-            dump_pickle(obj=finished_files, path=finished_files_pickle_path)
-
-    return
-
-
-def flatten_authors_concepts(files_to_process: str | int = 'all'):
-    skip_ids = get_skip_ids('authors')
-    file_spec = csv_files['authors']
-    authors_concepts_zero_filename = CSV_DIR / 'authors_concepts_zero.csv.gz'
-
-    authors_concepts_csv_exists = Path(file_spec['concepts']['name']).exists()
-    authors_concepts_zero_csv_exists = authors_concepts_zero_filename.exists()
-
-    with gzip.open(file_spec['concepts']['name'], 'at', encoding='utf-8') as authors_concepts_csv, \
-            gzip.open(authors_concepts_zero_filename, 'at', encoding='utf-8') as authors_concepts_zero_csv:
-
-        authors_concepts_writer = csv.DictWriter(
-            authors_concepts_csv, fieldnames=file_spec['concepts']['columns'], extrasaction='ignore'
-        )
-        if not authors_concepts_csv_exists:
-            authors_concepts_writer.writeheader()
-
-        authors_concepts_zero_writer = csv.DictWriter(
-            authors_concepts_zero_csv, fieldnames=file_spec['concepts']['columns'], extrasaction='ignore'
-        )
-        if not authors_concepts_zero_csv_exists:
-            authors_concepts_zero_writer.writeheader()
-
-        print(f'This might take a while, like 6-7 hours..')
-
-        finished_files_pickle_path = CSV_DIR / 'temp' / 'finished_authors_concepts.pkl'
-        finished_files_pickle_path.parent.mkdir(exist_ok=True)  # make the temp directory if needed
-
-        if finished_files_pickle_path.exists():
-            finished_files = load_pickle(finished_files_pickle_path)  # load the pickle
-            print(f'{len(finished_files)} existing files found!')
-        else:
-            finished_files = set()
-
-        authors_manifest = read_manifest(kind='authors', snapshot_dir=SNAPSHOT_DIR / 'data')
-
-        files = [str(entry.filename) for entry in authors_manifest.entries]
-        # files = map(str, glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'authors', '*', '*.gz')))
-        files = [f for f in files if f not in finished_files]
 
-        if files_to_process == 'all':
-            files_to_process = len(files)
-        print(f'{files_to_process=}')
+def _extract_authors_hints(batch: ScanBatch, writer) -> None:
+    for author, author_id in zip(batch.records, batch.ids):
+        writer.append_values(author_id, author['display_name'], author.get('works_count', 0),
+                             author.get('cited_by_count', 0), author.get('most_cited_work', ''))
 
-        for i, jsonl_file_name in tqdm(enumerate(files), desc='Flattening author concepts...', unit=' file',
-                                       total=len(files)):
-            if i > files_to_process:
-                break
 
-            with gzip.open(jsonl_file_name, 'r') as authors_jsonl:
-                authors_jsonls = authors_jsonl.readlines()
-            author_concept_rows = []
-            author_concept_zero_rows = []
-
-            for author_json in tqdm(authors_jsonls, desc='Parsing JSONs', leave=False, unit=' line', unit_scale=True):
-                if not author_json.strip():
-                    continue
-
-                author = orjson.loads(author_json)
+def get_authors_scan(skip_ids=None) -> EntityScan:
+    """
+    Single pass scan of the authors parts with all the AUTHORS_TABLES
+    """
+    concept_ids = {'concept_id': _concept_ids_to_arrow}
+    return EntityScan('authors', skip_ids=skip_ids) \
+        .register('authors', AUTHORS_SCHEMAS['authors'], _extract_authors) \
+        .register('ids', AUTHORS_SCHEMAS['ids'], _extract_authors_ids) \
+        .register('counts_by_year', AUTHORS_SCHEMAS['counts_by_year'], _extract_authors_counts_by_year) \
+        .register('concepts', AUTHORS_SCHEMAS['concepts'], _authors_concepts_extractor(), transforms=concept_ids) \
+        .register('concepts_zero', AUTHORS_SCHEMAS['concepts_zero'], _authors_concepts_extractor(max_level=0),
+                  transforms=concept_ids) \
+        .register('hints', AUTHORS_SCHEMAS['hints'], _extract_authors_hints)
+
+
+def process_author_json(jsonl_filename, skip_ids, ledger: Ledger, flush_rows: Optional[int] = None,
+                        tables: Optional[list] = None) -> int:
+    """
+    Flatten one authors part into the parquets of the authors tables in a single pass, see get_authors_scan.
+    Every table streams row groups to its own parquet, so memory stays flat no matter the size of the part.
+    flush_rows: rows per row group, ParquetPartWriter's default if None
+    tables: the tables to write, all the AUTHORS_TABLES by default
+    Returns the number of authors
+    """
+    start_time = time()
+    tables = tables or AUTHORS_TABLES
+    writer_args = dict(flush_rows=flush_rows) if flush_rows is not None else {}
 
-                if not (author_id := author.get('id')):
-                    continue
-                author_id = convert_openalex_id_to_int(author_id)
-                if author_id in skip_ids:
-                    continue
+    def make_writer(table: str, buffer: TableBuilder) -> ParquetPartWriter:
+        return ParquetPartWriter(path=get_parquet_path(json_filename=jsonl_filename, kind=table, entity='authors'),
+                                 buffer=buffer, coerce_timestamps='us', **writer_args)
 
-                author_name = author['display_name']
-                if x_concepts := author.get('x_concepts'):
-                    for x_concept in x_concepts:
-                        x_concept['author_id'] = author_id
-                        x_concept['author_name'] = author_name
-                        x_concept['concept_id'] = convert_openalex_id_to_int(x_concept['id'])
-                        x_concept['concept_name'] = x_concept['display_name']
-                        x_concept['works_count'] = author.get('works_count', 0)
-                        x_concept['cited_by_count'] = author.get('cited_by_count', 0)
-                        author_concept_rows.append(x_concept)
+    num_authors = get_authors_scan(skip_ids).flatten_part(jsonl_filename, make_writer=make_writer, tables=tables)
+    ledger.record_many(get_works_record(jsonl_filename, kind=table, duration=time() - start_time, entity='authors')
+                       for table in tables)
+    return num_authors
 
-                        # authors_concepts_writer.writerow(x_concept)
 
-                        if x_concept['level'] == 0:  # store only level 0 concepts here
-                            # authors_concepts_zero_writer.writerow(x_concept)
-                            author_concept_zero_rows.append(x_concept)
+def _process_author_json_worker(jsonl_filename, ledger, flush_rows, tables):
+    return process_author_json(jsonl_filename=jsonl_filename, ledger=ledger, flush_rows=flush_rows, tables=tables,
+                               **_WORKER_STATE)
 
-            authors_concepts_writer.writerows(author_concept_rows)
-            authors_concepts_zero_writer.writerows(author_concept_zero_rows)
 
-            finished_files.add(str(jsonl_file_name))
-            dump_pickle(obj=finished_files, path=finished_files_pickle_path)
+def _star_process_author_json_worker(args):
+    return _process_author_json_worker(*args)
 
-    return
 
-
-def flatten_authors_hints(files_to_process: str | int = 'all'):
+def flatten_authors_v2(files_to_process: str | int = 'all', threads=1, flush_rows=None, overwrite=False,
+                       make_csvs=False, tables=None):
+    """
+    One pass over each authors part writes all the authors tables (AUTHORS_TABLES) to CONFIG.parq_dir/authors*/,
+    one parquet per part and table, with the AUTHORS_SCHEMAS schemas
+    threads > 1 flattens one part file per process
+    flush_rows: rows per row group of the streamed parquets
+    overwrite: redo the parts that are already in the ledger
+    make_csvs: concatenate the parquets into the compressed CSVs afterwards, see write_authors_csvs
+    tables: only write these tables
+    """
+    tables = tables or AUTHORS_TABLES
     skip_ids = get_skip_ids('authors')
-    file_spec = csv_files['authors']
-
-    authors_hints_csv_exists = Path(file_spec['hints']['name']).exists()
-
-    with gzip.open(file_spec['hints']['name'], 'at', encoding='utf-8') as authors_hints_csv:
-        authors_hints_writer = csv.DictWriter(
-            authors_hints_csv, fieldnames=file_spec['hints']['columns'], extrasaction='ignore'
-        )
-        if not authors_hints_csv_exists:
-            authors_hints_writer.writeheader()
-
-        print(f'This might take a while, like 6-7 hours..')
-
-        finished_files_pickle_path = CSV_DIR / 'temp' / 'finished_authors_hints.pkl'
-        finished_files_pickle_path.parent.mkdir(exist_ok=True)  # make the temp directory if needed
-
-        if finished_files_pickle_path.exists():
-            finished_files = load_pickle(finished_files_pickle_path)  # load the pickle
-            print(f'{len(finished_files)} existing files found!')
-        else:
-            finished_files = set()
-
-        authors_manifest = read_manifest(kind='authors', snapshot_dir=SNAPSHOT_DIR / 'data')
-
-        files = [str(entry.filename) for entry in authors_manifest.entries]
-        # files = map(str, glob.glob(os.path.join(SNAPSHOT_DIR, 'data', 'authors', '*', '*.gz')))
-        files = [f for f in files if f not in finished_files]
-
-        if files_to_process == 'all':
-            files_to_process = len(files)
-        print(f'{files_to_process=}')
+    ledger = get_authors_ledger()
+    finished_files = set() if overwrite else ledger.finished_parts('authors', tables=tables)
+    print(f'{len(finished_files)} existing files found!')
+
+    authors_manifest = read_manifest(kind='authors', snapshot_dir=CONFIG.snapshot_dir / 'data')
+    files = sorted(((str(entry.filename), entry.count) for entry in authors_manifest.entries
+                    if str(entry.filename) not in finished_files),
+                   key=lambda x: x[1], reverse=True)  # largest parts first
+    if files_to_process != 'all':
+        files = files[: files_to_process]
+    print(f'files_to_process={len(files)}')
+
+    args = [(jsonl_file_name, ledger, flush_rows, tables) for jsonl_file_name, _ in files]
+    total_authors = 0
+    # fork shares the skip ids with the workers without pickling them
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    with multiprocessing.get_context(start_method).Pool(
+            processes=threads, initializer=_init_works_worker, initargs=(dict(skip_ids=skip_ids),)) as pool, \
+            tqdm(desc='Flattening authors...', total=len(args), unit='files') as pbar:
+        for num_authors in pool.imap_unordered(_star_process_author_json_worker, args, chunksize=1):
+            total_authors += num_authors
+            pbar.update(1)
+            pbar.set_postfix_str(f'{total_authors:,} authors')
 
-        for i, jsonl_file_name in tqdm(enumerate(files), desc='Flattening author hints...', unit=' file',
-                                       total=len(files)):
-            if i > files_to_process:
-                break
+    if make_csvs:
+        write_authors_csvs(tables=tables)
+    return
 
-            with gzip.open(jsonl_file_name, 'r') as authors_jsonl:
-                authors_jsonls = authors_jsonl.readlines()
 
-            author_hints_rows = []
-            for author_json in tqdm(authors_jsonls, desc='Parsing JSONs', leave=False, unit=' line', unit_scale=True):
-                if not author_json.strip():
-                    continue
+def flatten_authors(files_to_process: str | int = 'all', threads=1):
+    """
+    All the authors CSVs, from a single pass of flatten_authors_v2
+    """
+    return flatten_authors_v2(files_to_process=files_to_process, threads=threads, make_csvs=True)
 
-                author = orjson.loads(author_json)
-                # print(f'{author=}')
-                # break
 
-                if not (author_id := author.get('id')):
-                    continue
-                author_id = convert_openalex_id_to_int(author_id)
-                if author_id in skip_ids:
-                    continue
+def flatten_authors_concepts(files_to_process: str | int = 'all', threads=1):
+    """
+    Only the authors concepts and level 0 concepts CSVs, use flatten_authors to get them along with the rest
+    """
+    return flatten_authors_v2(files_to_process=files_to_process, threads=threads, make_csvs=True,
+                              tables=['concepts', 'concepts_zero'])
 
-                author_hints_row = {}
-                author_name = author['display_name']
-                author_hints_row['author_id'] = author_id
-                author_hints_row['author_name'] = author_name
-                author_hints_row['works_count'] = author.get('works_count', 0)
-                author_hints_row['cited_by_count'] = author.get('cited_by_count', 0)
-                author_hints_row['most_cited_work'] = author.get('most_cited_work', '')
 
-                author_hints_rows.append(author_hints_row)
+def flatten_authors_hints(files_to_process: str | int = 'all', threads=1):
+    """
+    Only the authors hints CSV, use flatten_authors to get it along with the rest
+    """
+    return flatten_authors_v2(files_to_process=files_to_process, threads=threads, make_csvs=True, tables=['hints'])
 
-            authors_hints_writer.writerows(author_hints_rows)
-            finished_files.add(str(jsonl_file_name))
-            dump_pickle(obj=finished_files, path=finished_files_pickle_path)
 
+def write_authors_csvs(tables=None):
+    """
+    Optional post-step of flatten_authors_v2: concatenate the parquets of each authors table into its compressed CSV
+    in CONFIG.csv_dir, with the columns of CSV_FILE_SPECS. The CSVs are rewritten, not appended to
+    """
+    file_spec = get_csv_files(CONFIG.csv_dir, compression=CONFIG.csv_compression)['authors']
+    for table in tables or AUTHORS_TABLES:
+        parq_dir = get_parquet_path(json_filename='part_000.gz', kind=table, entity='authors').parent
+        parq_files = sorted(parq_dir.glob('*.parquet'))
+        parquets_to_csv(parq_files, path=file_spec[table]['name'], columns=file_spec[table]['columns'])
+        print(f'Wrote {len(parq_files):,} parquets to {file_spec[table]["name"]!r}')
     return
 
 
 def process_work_json_v2(skip_ids, author_skip_ids, inst_skip_ids, jsonl_filename, entry_count,
-                         finished_files_txt_path, inst_info_d,
-                         publ_skip_ids, source_skip_ids, topic_info_d, overwrite_existing=False, make_abstracts=False):
+                         ledger: Ledger, inst_lookup: CompiledLookup, publ_skip_ids, source_skip_ids,
+                         topic_lookup: CompiledLookup, overwrite_existing=False, make_abstracts=False, progress=True,
+                         flush_rows=None, recompute_tables=None):
     """
     Process each work JSON lines file in parallel
-    Skip over already processed tables
+    Skip over already processed tables, the written tables are recorded in the ledger
+    Only the extractors and JSON keys needed by the missing tables are run and decoded, see WorksPlan
+    progress: show the per-file progress bars, turned off inside pool workers so the bars don't collide
+    flush_rows: if set, stream each table to its parquet as row groups of about flush_rows rows
+        instead of holding every row of the part in memory until the end
+    recompute_tables: tables rebuilt even if their parquet exists
+    inst_lookup, topic_lookup: fill in the institution and topic names of the authorships and topics tables
     """
     jsonl_filename = Path(jsonl_filename)
-
-    work_rows, id_rows, primary_location_rows, location_rows, authorship_rows, biblio_rows = [], [], [], [], [], []
-    concept_rows, mesh_rows, oa_rows, best_oa_loc_rows, refs_rows, rels_rows, abstract_rows, grant_rows = [], [], [], [], [], [], [], []
-    keywords_rows, topics_rows, indexed_rows = [], [], []
+    recompute_tables = set(recompute_tables or [])
+    start_time = time()
 
     is_missing_rows = {}  # dictionary where keys are table names and values are True if the table is missing rows
 
     for kind in DTYPES:
-        kind_ = f'works_{kind}' if kind != 'works' else 'works'
-        parq_filename = PARQ_DIR / kind_ / (
-                '_'.join(jsonl_filename.parts[-2:]).replace('updated_date=', '').replace('.gz', '')
-                + '.parquet')
+        parq_filename = get_parquet_path(json_filename=jsonl_filename, kind=kind)
 
         # missing if parquet filename doesnt exist or overwrite flag is ON
-        missing = (not parq_filename.exists()) or overwrite_existing
+        missing = (not parq_filename.exists()) or overwrite_existing or kind in recompute_tables
         if kind == 'abstracts':
-            missing = make_abstracts and ((not parq_filename.exists()) or overwrite_existing)
+            missing = make_abstracts and missing
 
         if kind == 'related_works':
             missing = False
@@ -1732,340 +1242,411 @@ def process_work_json_v2(skip_ids, author_skip_ids, inst_skip_ids, jsonl_filenam
     desc = desc.replace('updated_date=', '')
     if not any(is_missing_rows.values()):
         print(f'All tables accounted for in {"/".join(jsonl_filename.parts[-2:])!r}')
+        ledger.record_many(get_works_record(jsonl_filename, kind=kind) for kind in get_works_tables(make_abstracts)
+                           if not ledger.is_done('works', str(jsonl_filename), kind))
         return 0
 
-    work_keep_cols = set(DTYPES['works'].keys())
+    kinds = ['works', 'ids', 'primary_location', 'locations', 'authorships', 'biblio', 'concepts', 'mesh',
+             'referenced_works', 'related_works', 'abstracts', 'grants', 'open_access', 'best_oa_location', 'keywords',
+             'topics', 'indexed_in', ]
 
-    ## streaming gzipped json one line at a time
-    with gzip.open(jsonl_filename, 'r') as works_jsonl:
-        for work_json in tqdm(works_jsonl, total=entry_count, desc=desc, unit=' line', unit_scale=True, colour='blue',
-                              leave=False):
-            if not work_json.strip():
-                continue
+    streaming = flush_rows is not None
+    lookups = dict(inst_lookup=inst_lookup, topic_lookup=topic_lookup)
+    table_rows = {}
+    for kind in kinds:
+        if streaming and is_missing_rows[kind]:
+            table_rows[kind] = get_part_writer(json_filename=jsonl_filename, kind=kind, flush_rows=flush_rows,
+                                               **lookups)
+        elif kind == 'works' and (streaming or not is_missing_rows[kind]):
+            table_rows[kind] = RowCounter()  # only the number of works is needed
+        else:
+            table_rows[kind] = get_table_buffer(json_filename=jsonl_filename, kind=kind, **lookups)
+    part_writers = {kind: rows for kind, rows in table_rows.items() if isinstance(rows, ParquetPartWriter)}
+
+    # only run the extractors and decode the top level keys needed by the missing tables
+    plan = WorksPlan(tables=[kind for kind, missing in is_missing_rows.items() if missing])
+    decode_work = ProjectionDecoder(keys=plan.keys)
+
+    (work_rows, id_rows, primary_location_rows, location_rows, authorship_rows, biblio_rows, concept_rows, mesh_rows,
+     refs_rows, rels_rows, abstract_rows, grant_rows, oa_rows, best_oa_loc_rows, keywords_rows, topics_rows,
+     indexed_rows) = (table_rows[kind] for kind in kinds)
+
+    # the works rows with authorships wait for the author counts of their batch, the others are added right away
+    authorship_batch = AuthorshipBatch(author_skip_ids=author_skip_ids, inst_skip_ids=inst_skip_ids)
+    authorship_works = []
+
+    def explode_authorships():
+        if len(authorship_batch) > 0:
+            # institution names and country codes are looked up from the ids at build time
+            new_authorship_rows, num_authors, has_complete_institution_info = authorship_batch.explode()
+            if plan.writes('authorships'):
+                authorship_rows.append_table(new_authorship_rows)
+            for work, count, complete in zip(authorship_works, num_authors.tolist(),
+                                             has_complete_institution_info.tolist()):
+                work['num_authors'] = count
+                work['has_complete_institution_info'] = complete
+                work_rows.append(work)
+            authorship_batch.clear()
+            authorship_works.clear()
+        return
 
-            work = orjson.loads(work_json)
+    ## streaming gzipped json one line at a time, inflated on a reader thread
+    try:
+        with JSONLReader(jsonl_filename) as works_jsonl:
+            for work_json in tqdm(works_jsonl, total=entry_count, desc=desc, unit=' line', unit_scale=True,
+                                  colour='blue', leave=False, disable=not progress):
+                if len(authorship_batch) >= AUTHORSHIPS_BATCH_SIZE:
+                    explode_authorships()
+                for writer in part_writers.values():  # flush between works so a work's rows stay together
+                    writer.maybe_flush()
+
+                if not work_json.strip():
+                    continue
 
-            if not (work_id := work.get('id')):
-                continue
+                work = decode_work(work_json)
 
-            # works
-            work_id = convert_openalex_id_to_int(work_id)
-            if work_id in skip_ids:
-                continue
+                if not (work_id := work.get('id')):
+                    continue
 
-            num_authors, num_references, num_locations = 0, 0, 0
-            type_crossref = work.get('type_crossref', pd.NA)
-            work['type_crossref'] = type_crossref
+                # works
+                work_id = convert_openalex_id_to_int(work_id)
+                if work_id in skip_ids:
+                    continue
 
-            work['is_retracted'] = string_to_bool(work['is_retracted'])
-            work['is_paratext'] = string_to_bool(work['is_paratext'])
+                num_references, num_locations = 0, 0
+                doi = work.get('doi')
+                doi = doi.replace('https://doi.org/', '') if doi is not None else None
+
+                title = work.get('title')
+                if title is not None:
+                    title = title.replace(r'\n', ' ')  # deleting stray \n's in title
+
+                if plan.runs('works'):
+                    type_crossref = work.get('type_crossref', pd.NA)
+                    work['type_crossref'] = type_crossref
+
+                    work['is_retracted'] = string_to_bool(work['is_retracted'])
+                    work['is_paratext'] = string_to_bool(work['is_paratext'])
+
+                    # if type_crossref is not None:
+                    #     print(f'{work_id=} {jsonl_file_name=} {type_crossref=}')
+                    work['work_id'] = work_id
+                    work['doi'] = doi
+                    work['title'] = title
+                    work['language'] = work.get('language', pd.NA)  # works languages
+
+                # works indexed in
+                if plan.runs('indexed_in'):
+                    if indexed_in := work.get('indexed_in'):
+                        for ix_source in indexed_in:
+                            indexed_rows.append(
+                                dict(work_id=work_id, publication_year=work.get('publication_year'),
+                                     indexed_source=ix_source)
+                            )
 
-            # if type_crossref is not None:
-            #     print(f'{work_id=} {jsonl_file_name=} {type_crossref=}')
-            work['work_id'] = work_id
-            doi = work['doi']
-            doi = doi.replace('https://doi.org/', '') if doi is not None else None
-            work['doi'] = doi
+                # works topics
+                if plan.runs('topics'):
+                    if topics := work.get('topics'):
+                        for i, topic in enumerate(topics):
+                            topic_id = convert_topic_id_to_int(topic['id'])
+                            # the names, subfield, field and domain are looked up from topic_id at build time
+                            topics_rows.append_values(
+                                work_id, work.get('publication_year'), i == 0, topic['score'], topic_id,
+                            )
 
-            if work['title'] is None:
-                title = None
-            else:
-                title = work['title'].replace(r'\n', ' ')  # deleting stray \n's in title
-            work['title'] = title
-
-            work['language'] = work.get('language', pd.NA)  # works languages
-
-            # works indexed in
-            if is_missing_rows['indexed_in']:
-                if indexed_in := work.get('indexed_in'):
-                    for ix_source in indexed_in:
-                        indexed_rows.append(
-                            dict(work_id=work_id, publication_year=work.get('publication_year'),
-                                 indexed_source=ix_source)
-                        )
-
-            # works topics
-            if is_missing_rows['topics']:
-                if topics := work.get('topics'):
-                    for i, topic in enumerate(topics):
-                        topic_id = convert_topic_id_to_int(topic['id'])
-                        d = dict(
-                            work_id=work_id, publication_year=work.get('publication_year'),
-                            is_primary_topic=True if i == 0 else False,
-                            score=topic['score'],
-                            topic_id=topic_id,
-                            topic_name=topic_info_d['topic_name'][topic_id],
-                        )
-                        for genre in ['subfield', 'field', 'domain']:
-                            # print(f'\n---------\n{work_id=}\n{topics=}\n{topic=}\n\n----------')
-                            d[f'{genre}_id'] = topic_info_d[f'{genre}_id'][topic_id]
-                            d[f'{genre}_name'] = topic_info_d[f'{genre}_name'][topic_id]
-
-                        topics_rows.append(d)
-
-            # works keywords
-            if is_missing_rows['keywords']:
-                has_keywords = False
-                if keywords := work.get('keywords'):
-                    for keyword_d in keywords:
+                # works keywords
+                if plan.runs('keywords'):
+                    has_keywords = False
+                    if keywords := work.get('keywords'):
                         has_keywords = True
-                        keywords_rows.append({
-                            'work_id': work_id,
-                            'publication_year': work.get('publication_year'),
-                            'keyword': keyword_d.get('display_name', pd.NA),
-                            'score': keyword_d.get('score', pd.NA),
-                        })
-            else:
-                has_keywords = pd.NA
-            work['has_keywords'] = has_keywords
-
-            # works grants
-            if is_missing_rows['grants']:
-                has_grant = False
-                if grants := work.get('grants'):
-                    for grant_d in grants:
+                        for keyword_d in keywords if plan.writes('keywords') else []:
+                            keywords_rows.append_values(
+                                work_id, work.get('publication_year'), keyword_d.get('display_name'),
+                                keyword_d.get('score'),
+                            )
+                else:
+                    has_keywords = pd.NA
+                work['has_keywords'] = has_keywords
+
+                # works grants
+                if plan.runs('grants'):
+                    has_grant = False
+                    if grants := work.get('grants'):
                         has_grant = True  # set the flag to True
-                        funder_id = convert_openalex_id_to_int(grant_d.get('funder'))
-                        funder_id = funder_id if funder_id is not None else pd.NA
-
-                        funder_name = grant_d.get('funder_display_name', pd.NA)
-                        funder_name = funder_name if funder_name != '' else pd.NA
-
-                        grant_rows.append(
-                            {
-                                "work_id": work_id,
-                                "publication_year": work.get("publication_year"),
-                                "funder_id": funder_id,
-                                "funder_name": funder_name,
-                                "award_id": grant_d.get("award_id", pd.NA),
-                            }
-                        )
-            else:
-                has_grant = pd.NA
-            work['has_grant_info'] = has_grant
-
-            # authorships
-            has_complete_institution_info = False
-            num_authors = 0
-            if authorships := work.get('authorships'):
-                new_authorship_rows, num_authors, has_complete_institution_info = parse_authorships(
-                    authorships=authorships, work_id=work_id, publication_year=work.get('publication_year'),
-                    author_skip_ids=author_skip_ids, inst_skip_ids=inst_skip_ids, inst_info_d=inst_info_d,
-                )
+                        for grant_d in grants if plan.writes('grants') else []:
+                            funder_id = convert_openalex_id_to_int(grant_d.get('funder'))
+                            funder_id = funder_id if funder_id is not None else pd.NA
+
+                            funder_name = grant_d.get('funder_display_name', pd.NA)
+                            funder_name = funder_name if funder_name != '' else pd.NA
 
-                if is_missing_rows['authorships']:
-                    authorship_rows.extend(new_authorship_rows)
-
-            work['num_authors'] = num_authors
-            work['has_complete_institution_info'] = has_complete_institution_info
-
-            # primary location
-            if is_missing_rows['primary_location']:
-                if primary_location := (work.get('primary_location') or {}):
-                    if primary_location.get('source') and primary_location.get('source').get('id'):
-                        primary_location_d = primary_location.get('source', {})
-
-                        source_id = convert_openalex_id_to_int(primary_location_d.get('id'))
-                        if source_id in source_skip_ids:  # skip if invalid source
-                            continue
-
-                        primary_location_rows.append({
-                            'work_id': work_id,
-                            'publication_year': work.get('publication_year'),
-                            'source_id': source_id,
-                            'source_name': primary_location_d.get('display_name'),
-                            'source_type': primary_location_d.get('type'),
-                            'version': primary_location.get('version'),
-                            'license': primary_location.get('license'),
-                            'landing_page_url': primary_location.get('landing_page_url'),
-                            'pdf_url': primary_location.get('pdf_url'),
-                            'is_oa': string_to_bool(primary_location.get('is_oa')),
-                            'is_accepted': string_to_bool(primary_location.get('is_accepted')),
-                            'is_published': string_to_bool(primary_location.get('is_published')),
-                        })
-
-            # locations
-            if is_missing_rows['locations']:
-                if locations := work.get('locations'):
-                    for location in locations:
-                        if location.get('source') and location.get('source').get('id'):
-                            location_d = location.get('source', {})
-
-                            source_id = convert_openalex_id_to_int(location_d.get('id'))
-                            if source_id in source_skip_ids:  # skip if invalid source
-                                continue
-
-                            num_locations += 1
-                            location_rows.append(
+                            grant_rows.append(
                                 {
                                     "work_id": work_id,
                                     "publication_year": work.get("publication_year"),
-                                    "source_id": source_id,
-                                    "source_name": location_d.get("display_name"),
-                                    "source_type": location_d.get("type"),
-                                    "version": location.get("version"),
-                                    "license": location.get("license"),
-                                    "landing_page_url": location.get(
-                                        "landing_page_url"
-                                    ),
-                                    "pdf_url": location.get("pdf_url"),
-                                    "is_oa": string_to_bool(location.get("is_oa")),
-                                    "is_accepted": string_to_bool(
-                                        location.get("is_accepted")
-                                    ),
-                                    "is_published": string_to_bool(
-                                        location.get("is_published")
-                                    ),
+                                    "funder_id": funder_id,
+                                    "funder_name": funder_name,
+                                    "award_id": grant_d.get("award_id", pd.NA),
                                 }
                             )
-            else:
-                num_locations = work.get('locations_count', 0)
-            work['num_locations'] = num_locations
-
-            # open access
-            if is_missing_rows['open_access']:
-                if oa := work.get('open_access'):
-                    oa['work_id'] = work_id
-                    oa['is_oa'] = string_to_bool(oa.get('is_oa'))
-                    oa['any_repository_has_fulltext'] = string_to_bool(oa.get('any_repository_has_fulltext'))
-                    oa_rows.append(oa)
-
-            # best oa location
-            if is_missing_rows['best_oa_location']:
-                if best_oa_location := work.get('best_oa_location'):
-                    if best_oa_location.get('source') and best_oa_location.get('source').get('id'):
-
-                        best_oa_location_d = best_oa_location.get('source', {})
-                        source_id = convert_openalex_id_to_int(best_oa_location_d.get('id'))
-                        if source_id in source_skip_ids:  # skip if invalid source
-                            continue
-
-                        best_oa_loc_rows.append({
-                            'work_id': work_id,
-                            'pdf_url': best_oa_location['pdf_url'],
-                            'is_oa': string_to_bool(best_oa_location.get('is_oa')),
-                            'is_accepted': string_to_bool(best_oa_location.get('is_accepted')),
-                            'is_published': string_to_bool(best_oa_location.get('is_published')),
-                            'source_id': source_id,
-                            'source_name': best_oa_location_d.get('display_name'),
-                            'source_type': best_oa_location_d.get('type'),
-                        })
-
-            # biblio
-            if is_missing_rows['biblio']:
-                if biblio := work.get('biblio'):
-                    biblio['work_id'] = work_id
-                    biblio_rows.append(biblio)
-
-            # concepts
-            if is_missing_rows['concepts']:
-                for concept in work.get('concepts'):
-                    if concept_id := concept.get('id'):
-                        concept_id = convert_openalex_id_to_int(concept_id)
-                        concept_name = concept.get('display_name')
-                        level = concept.get('level')
-
-                        concept_rows.append({
-                            'work_id': work_id,
-                            'publication_year': work.get('publication_year'),
-                            'concept_id': concept_id,
-                            'concept_name': concept_name,
-                            'level': level,
-                            'score': concept.get('score'),
-                        })
-
-            # ids
-            if is_missing_rows['ids']:
-                if ids := work.get('ids'):
-                    ids['work_id'] = work_id
-                    ids['doi'] = doi
-                    id_rows.append(ids)
-
-            # mesh
-            if is_missing_rows['mesh']:
-                for mesh in work.get('mesh'):
-                    mesh['work_id'] = work_id
-                    mesh_rows.append(mesh)
-
-            # referenced_works  -- make sure referenced works are not in skip_ids
-            num_references = 0
-            for referenced_work in work.get('referenced_works'):
-                if referenced_work:
-                    referenced_work = convert_openalex_id_to_int(referenced_work)
-                    if referenced_work in skip_ids:
-                        continue
-
-                    num_references += 1
-                    if is_missing_rows['referenced_works']:
-                        refs_rows.append({
-                            'work_id': work_id,
-                            'referenced_work_id': referenced_work
-                        })
-
-            work['num_references'] = num_references
-
-            filt_work = {k: v for k, v in work.items() if k in work_keep_cols}
-            work_rows.append(filt_work)  # after adding number of references and locations
-
-            # related_works
-            if is_missing_rows['related_works']:
-                for related_work in work.get('related_works'):
-                    if related_work:
-                        related_work = convert_openalex_id_to_int(related_work)
-                        if related_work in skip_ids:  # skip if related work has been deleted
-                            continue
-                        rels_rows.append({
-                            'work_id': work_id,
-                            'related_work_id': related_work
-                        })
-
-            # abstracts
-            if is_missing_rows['abstracts'] and make_abstracts:
-                if (abstract_inv_index := work.get('abstract_inverted_index')) is not None:
-                    if 'InvertedIndex' in abstract_inv_index:  # new format of nested abstract dictionaries
-                        abstract_inv_index = abstract_inv_index['InvertedIndex']
-                        # print(f'New format abstract', repr(abstract_inv_index)[: 50])
-                    try:
-                        abstract = reconstruct_abstract(abstract_inv_index)
-                    except orjson.JSONDecodeError as e:
-                        abstract = pd.NA
-
-                    abstract_row = {'work_id': work_id, 'title': title, 'abstract': abstract,
-                                    'publication_year': work.get('publication_year')}
-                    abstract_rows.append(abstract_row)
-
-    # write the batched parquets here
-    kinds = ['works', 'ids', 'primary_location', 'locations', 'authorships', 'biblio', 'concepts', 'mesh',
-             'referenced_works', 'related_works', 'abstracts', 'grants', 'open_access', 'best_oa_location', 'keywords',
-             'topics', 'indexed_in', ]
-    row_names = [work_rows, id_rows, primary_location_rows, location_rows, authorship_rows, biblio_rows,
-                 concept_rows, mesh_rows, refs_rows, rels_rows, abstract_rows, grant_rows, oa_rows, best_oa_loc_rows,
-                 keywords_rows, topics_rows, indexed_rows]
-
-    lines = []
-    with tqdm(total=len(kinds), desc='Writing CSVs and parquets', leave=False, colour='green') as pbar:
-        for kind, rows in zip(kinds, row_names):
-            if not is_missing_rows[kind]:  # skip over the non missing rows
-                continue
-            pbar.set_postfix_str(kind)
-            new_file = write_to_csv_and_parquet(json_filename=jsonl_filename, kind=kind, rows=rows)
-            if new_file:
-                lines.append(
-                    f'{datetime.now().strftime("%c").strip()},{str(jsonl_filename)},{kind},{len(work_rows)}\n')
-                ## write to csv file
-            pbar.update(1)
+                else:
+                    has_grant = pd.NA
+                work['has_grant_info'] = has_grant
+
+                # authorships, parsed for the author counts of the works table too
+                # collected in batches, the counts are filled in when the batch is exploded
+                work['num_authors'] = 0
+                work['has_complete_institution_info'] = False
+                waits_for_authors = False
+                if plan.runs('authorships') and (authorships := work.get('authorships')):
+                    authorship_batch.add(work_id, work.get('publication_year'), authorships)
+                    authorship_works.append(work)
+                    waits_for_authors = True
+
+                # primary location
+                if plan.runs('primary_location'):
+                    if primary_location := (work.get('primary_location') or {}):
+                        if primary_location.get('source') and primary_location.get('source').get('id'):
+                            primary_location_d = primary_location.get('source', {})
+
+                            source_id = convert_openalex_id_to_int(primary_location_d.get('id'))
+                            if source_id not in source_skip_ids:  # a merged source only drops the location row
+                                primary_location_rows.append({
+                                    'work_id': work_id,
+                                    'publication_year': work.get('publication_year'),
+                                    'source_id': source_id,
+                                    'source_name': primary_location_d.get('display_name'),
+                                    'source_type': primary_location_d.get('type'),
+                                    'version': primary_location.get('version'),
+                                    'license': primary_location.get('license'),
+                                    'landing_page_url': primary_location.get('landing_page_url'),
+                                    'pdf_url': primary_location.get('pdf_url'),
+                                    'is_oa': string_to_bool(primary_location.get('is_oa')),
+                                    'is_accepted': string_to_bool(primary_location.get('is_accepted')),
+                                    'is_published': string_to_bool(primary_location.get('is_published')),
+                                })
+
+                # locations
+                if plan.runs('locations'):
+                    if locations := work.get('locations'):
+                        for location in locations:
+                            if location.get('source') and location.get('source').get('id'):
+                                location_d = location.get('source', {})
+
+                                source_id = convert_openalex_id_to_int(location_d.get('id'))
+                                if source_id in source_skip_ids:  # skip if invalid source
+                                    continue
+
+                                num_locations += 1
+                                if not plan.writes('locations'):  # only counted for the works table
+                                    continue
+                                location_rows.append(
+                                    {
+                                        "work_id": work_id,
+                                        "publication_year": work.get("publication_year"),
+                                        "source_id": source_id,
+                                        "source_name": location_d.get("display_name"),
+                                        "source_type": location_d.get("type"),
+                                        "version": location.get("version"),
+                                        "license": location.get("license"),
+                                        "landing_page_url": location.get(
+                                            "landing_page_url"
+                                        ),
+                                        "pdf_url": location.get("pdf_url"),
+                                        "is_oa": string_to_bool(location.get("is_oa")),
+                                        "is_accepted": string_to_bool(
+                                            location.get("is_accepted")
+                                        ),
+                                        "is_published": string_to_bool(
+                                            location.get("is_published")
+                                        ),
+                                    }
+                                )
+                else:
+                    num_locations = work.get('locations_count', 0)
+                work['num_locations'] = num_locations
+
+                # open access
+                if plan.runs('open_access'):
+                    if oa := work.get('open_access'):
+                        oa['work_id'] = work_id
+                        oa['is_oa'] = string_to_bool(oa.get('is_oa'))
+                        oa['any_repository_has_fulltext'] = string_to_bool(oa.get('any_repository_has_fulltext'))
+                        oa_rows.append(oa)
+
+                # best oa location
+                if plan.runs('best_oa_location'):
+                    if best_oa_location := work.get('best_oa_location'):
+                        if best_oa_location.get('source') and best_oa_location.get('source').get('id'):
+
+                            best_oa_location_d = best_oa_location.get('source', {})
+                            source_id = convert_openalex_id_to_int(best_oa_location_d.get('id'))
+                            if source_id not in source_skip_ids:  # a merged source only drops the location row
+                                best_oa_loc_rows.append({
+                                    'work_id': work_id,
+                                    'pdf_url': best_oa_location['pdf_url'],
+                                    'is_oa': string_to_bool(best_oa_location.get('is_oa')),
+                                    'is_accepted': string_to_bool(best_oa_location.get('is_accepted')),
+                                    'is_published': string_to_bool(best_oa_location.get('is_published')),
+                                    'source_id': source_id,
+                                    'source_name': best_oa_location_d.get('display_name'),
+                                    'source_type': best_oa_location_d.get('type'),
+                                })
+
+                # biblio
+                if plan.runs('biblio'):
+                    if biblio := work.get('biblio'):
+                        biblio['work_id'] = work_id
+                        biblio_rows.append(biblio)
+
+                # concepts
+                if plan.runs('concepts'):
+                    for concept in work.get('concepts'):
+                        if concept_id := concept.get('id'):
+                            concept_id = convert_openalex_id_to_int(concept_id)
+                            concept_rows.append_values(  # in the column order of WORKS_SCHEMAS['concepts']
+                                work_id, work.get('publication_year'), concept.get('score'), concept_id,
+                                concept.get('display_name'), concept.get('level'),
+                            )
+
+                # ids
+                if plan.runs('ids'):
+                    if ids := work.get('ids'):
+                        ids['work_id'] = work_id
+                        ids['doi'] = doi
+                        id_rows.append(ids)
+
+                # mesh
+                if plan.runs('mesh'):
+                    for mesh in work.get('mesh'):
+                        mesh['work_id'] = work_id
+                        mesh_rows.append(mesh)
+
+                # referenced_works  -- the referenced works in skip_ids are dropped, the whole list checked at once
+                if plan.runs('referenced_works'):
+                    referenced_works = [convert_openalex_id_to_int(ref) for ref in work.get('referenced_works') if ref]
+                    referenced_works = np.array([ref for ref in referenced_works if ref is not None], dtype=np.uint64)
+                    referenced_works = referenced_works[~skip_ids.contains_many(referenced_works)]
+
+                    num_references = len(referenced_works)
+                    if plan.writes('referenced_works'):
+                        refs_rows.add_edges(work_id, referenced_works)
+
+                work['num_references'] = num_references
+
+                if not waits_for_authors:  # after adding number of references and locations
+                    work_rows.append(work)
+
+                # related_works
+                if plan.runs('related_works'):
+                    related_works = [convert_openalex_id_to_int(rel) for rel in work.get('related_works') if rel]
+                    related_works = np.array([rel for rel in related_works if rel is not None], dtype=np.uint64)
+                    related_works = related_works[~skip_ids.contains_many(related_works)]  # skip deleted related works
+                    rels_rows.add_edges(work_id, related_works)
+
+                # abstracts
+                if plan.runs('abstracts'):
+                    if (abstract_inv_index := work.get('abstract_inverted_index')) is not None:
+                        # in the column order of WORKS_SCHEMAS['abstracts'], the abstract is built by the table builder
+                        abstract_rows.append_values(work_id, title, work.get('publication_year'), abstract_inv_index)
+        explode_authorships()
+    except BaseException:
+        for writer in part_writers.values():  # don't leave half written parquets behind
+            writer.abort()
+        raise
+
+    # write the batched parquets here, or close out the streamed ones
+    written_kinds = []
+    if streaming:
+        for kind, writer in part_writers.items():
+            writer.close()
+            written_kinds.append(kind)
+    else:
+        with tqdm(total=len(kinds), desc='Writing CSVs and parquets', leave=False, colour='green',
+                  disable=not progress) as pbar:
+            for kind, rows in table_rows.items():
+                if not is_missing_rows[kind]:  # skip over the non missing rows
+                    continue
+                pbar.set_postfix_str(kind)
+                new_file = write_to_csv_and_parquet(json_filename=jsonl_filename, kind=kind, rows=rows, overwrite=True)
+                if new_file:
+                    written_kinds.append(kind)
+                pbar.update(1)
 
-    with open(finished_files_txt_path, 'a') as fp:
-        for line in lines:
-            fp.write(line)
+    # one transaction per part file
+    ledger.record_many(get_works_record(jsonl_filename, kind=kind, duration=time() - start_time)
+                       for kind in written_kinds)
 
     return len(work_rows)
 
 
+def get_works_tables(make_abstracts: bool = False) -> list:
+    """
+    Tables written by process_work_json_v2 for every part file, related works are not flattened
+    """
+    return [kind for kind in DTYPES if kind != 'related_works' and (make_abstracts or kind != 'abstracts')]
+
+
+def get_works_record(jsonl_filename, kind: str, duration: Optional[float] = None, entity: str = 'works') -> dict:
+    """
+    Ledger record of the parquet of table kind of one works (or authors) part file, tables without rows have no parquet
+    """
+    parq_filename = get_parquet_path(json_filename=jsonl_filename, kind=kind, entity=entity)
+    exists = parq_filename.exists()
+    return dict(entity=entity, part=str(jsonl_filename), table=kind, duration=duration,
+                path=parq_filename if exists else None, rows=pq.read_metadata(parq_filename).num_rows if exists else 0,
+                content_hash=file_digest(parq_filename) if exists else None)
+
+
+def get_works_ledger(parq_dir=None) -> Ledger:
+    """
+    Checkpoint ledger of the works tables in parq_dir (CONFIG.parq_dir by default).
+    The old finished_works.txt log is imported the first time
+    """
+    parq_dir = Path(parq_dir) if parq_dir is not None else CONFIG.parq_dir
+    ledger = Ledger(parq_dir / 'temp' / 'ledger.sqlite')
+    finished_files_txt_path = parq_dir / 'temp' / 'finished_works.txt'
+    if finished_files_txt_path.exists() and not ledger.has_entity('works'):
+        num_records = ledger.import_finished_works_txt(finished_files_txt_path, entity='works')
+        print(f'Imported {num_records:,} records from {str(finished_files_txt_path)!r} into the ledger')
+    return ledger
+
+
+_WORKER_STATE = {}  # skip ids and lookups shared with the works pool workers, set once per worker
+
+
+def _init_works_worker(state):
+    """
+    Pool initializer: stash the skip ids and lookup dicts in the worker globals.
+    With the fork start method the state is inherited copy-on-write, so nothing is pickled.
+    """
+    _WORKER_STATE.update(state)
+    return
+
+
+def _process_work_json_worker(jsonl_filename, entry_count, ledger, overwrite_existing, make_abstracts, flush_rows):
+    """
+    Pool task: only the per-file arguments travel with the task, everything else comes from _WORKER_STATE
+    """
+    records = process_work_json_v2(
+        jsonl_filename=jsonl_filename, entry_count=entry_count, ledger=ledger,
+        overwrite_existing=overwrite_existing, make_abstracts=make_abstracts, flush_rows=flush_rows, progress=False,
+        **_WORKER_STATE,
+    )
+    return records
+
+
+def _star_process_work_json_worker(args):
+    return _process_work_json_worker(*args)
+
+
 def flatten_works_v3(files_to_process: str | int = 'all', threads=1, make_abstracts=False, overwrite=False,
-                     recompute_tables=None):
+                     recompute_tables=None, flush_rows=None, only_files=None):
     """
     SKIP over creating tables that already exists to save on memory
+    threads > 1 flattens one part file per process, pick at most the number of physical cores
+    flush_rows: stream tables to parquet in row groups of this many rows to keep memory flat on large parts
+    only_files: restrict to these part file names, eg: the new and changed parts of an incremental update
     """
     skip_ids, author_skip_ids, inst_skip_ids, publ_skip_ids, source_skip_ids = get_skip_ids('works'), \
         get_skip_ids('authors'), get_skip_ids('institutions'), get_skip_ids('publishers'), get_skip_ids('sources')
@@ -2076,37 +1657,26 @@ def flatten_works_v3(files_to_process: str | int = 'all', threads=1, make_abstra
         # ensure directories exist
         if kind != 'works':
             kind = f'works_{kind}'
-        path = (PARQ_DIR / kind)
+        path = (CONFIG.parq_dir / kind)
         if not path.exists():
             print(f'Creating dir at {str(path)}')
             path.mkdir(parents=True)
 
-    finished_files_txt_path = PARQ_DIR / 'temp' / 'finished_works.txt'  # store finished paths in a text file
-    finished_files_txt_path.parent.mkdir(exist_ok=True)  # make the temp directory if needed
-
-    if finished_files_txt_path.exists():
-        # final_table_count = len(DTYPES) if make_abstracts else len(DTYPES) - 1
-        final_table_count = 15
-
-        print(f'\n------\n{final_table_count=}\n------\n')
-        finished_files = set(
-            pd.read_csv(finished_files_txt_path, engine='c', parse_dates=['timestamp'])  # load the pickle
-            .pipe(lambda df_: df_[~df_.table.isin(recompute_tables)])
-            .drop_duplicates(subset=['path', 'table'], keep='last')  # drop duplicates
-            .groupby('path', as_index=False)
-            .count()
-            .query('records==@final_table_count')  # finished files will have 14 tables
-            .path
-        )
-        print(f'{len(finished_files)} existing files found!')
-    else:
-        with open(finished_files_txt_path, 'w') as fp:
-            fp.write(f'timestamp,path,table,records\n')
-        finished_files = set()
+    ledger = get_works_ledger()
+    # tables in recompute_tables don't count as done
+    tables = set(get_works_tables(make_abstracts=make_abstracts))
+    finished_files = {part for part, done in ledger.done_tables('works').items()
+                      if tables <= done - set(recompute_tables or [])}
+    print(f'{len(finished_files)} existing files found!')
 
-    works_manifest = read_manifest(kind='works', snapshot_dir=SNAPSHOT_DIR / 'data')
+    works_manifest = read_manifest(kind='works', snapshot_dir=CONFIG.snapshot_dir / 'data')
+    # for incremental updates
+    save_manifest_copy(kind='works', snapshot_dir=CONFIG.snapshot_dir / 'data', parq_dir=CONFIG.parq_dir)
     files = [(str(entry.filename), entry.count) for entry in works_manifest.entries]
     files = [(f, c) for f, c in files if f not in finished_files]  # [:: -1]
+    if only_files is not None:
+        only_files = set(map(str, only_files))
+        files = [(f, c) for f, c in files if f in only_files]
 
     # files = [Path('/home/ssikdar/data/openalex-snapshot/data/works/updated_date=2023-11-26/part_000.gz')]
     # print(f'{files[: 2]}')
@@ -2117,65 +1687,356 @@ def flatten_works_v3(files_to_process: str | int = 'all', threads=1, make_abstra
         files_to_process = len(files)
     print(f'{files_to_process=}')
 
-    args = []
+    files = files[: files_to_process]
     total_works_count = 0
-    with tqdm(desc='Flattening works...', total=files_to_process, unit='files') as pbar:
-        for i, (jsonl_file_name, entry_count) in enumerate(files):
-            if i >= files_to_process:
-                break
-            if threads > 1:
-                args.append((skip_ids, author_skip_ids, inst_skip_ids, jsonl_file_name, finished_files_txt_path,
-                             inst_info_d, overwrite, make_abstracts))
-            else:
+
+    if threads > 1:
+        shared_state = dict(
+            skip_ids=skip_ids, author_skip_ids=author_skip_ids, inst_skip_ids=inst_skip_ids,
+            publ_skip_ids=publ_skip_ids, source_skip_ids=source_skip_ids, inst_lookup=CONFIG.inst_lookup,
+            topic_lookup=CONFIG.topic_lookup, recompute_tables=recompute_tables,
+        )
+        # largest parts first so that a big file picked up last doesn't hold up the whole pool
+        files = sorted(files, key=lambda x: x[1], reverse=True)
+        args = [(jsonl_file_name, entry_count, ledger, overwrite, make_abstracts, flush_rows)
+                for jsonl_file_name, entry_count in files]
+
+        # fork shares the skip ids and lookups with the workers without pickling them
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        print(f'Spinning up {threads} parallel processes ({start_method or "default"} start)')
+
+        with multiprocessing.get_context(start_method).Pool(
+                processes=threads, initializer=_init_works_worker, initargs=(shared_state,)) as pool, \
+                tqdm(desc='Flattening works...', total=len(files), unit='files') as pbar:
+            for records in pool.imap_unordered(_star_process_work_json_worker, args, chunksize=1):
+                total_works_count += records
+                pbar.update(1)
+                pbar.set_postfix_str(f'{total_works_count:,} works')
+    else:
+        with tqdm(desc='Flattening works...', total=len(files), unit='files') as pbar:
+            for jsonl_file_name, entry_count in files:
                 records = process_work_json_v2(
                     skip_ids=skip_ids, author_skip_ids=author_skip_ids, inst_skip_ids=inst_skip_ids,
                     publ_skip_ids=publ_skip_ids, source_skip_ids=source_skip_ids,
                     jsonl_filename=jsonl_file_name, entry_count=entry_count,
                     overwrite_existing=overwrite,
-                    finished_files_txt_path=finished_files_txt_path,
-                    make_abstracts=make_abstracts, inst_info_d=inst_info_d, topic_info_d=topic_info_d,
+                    ledger=ledger,
+                    make_abstracts=make_abstracts, inst_lookup=CONFIG.inst_lookup, topic_lookup=CONFIG.topic_lookup,
+                    flush_rows=flush_rows, recompute_tables=recompute_tables,
                 )
                 total_works_count += records
                 pbar.update(1)
                 pbar.set_postfix_str(f'{total_works_count:,} works')
 
-    if threads > 1:
-        print(f'Spinning up {threads} parallel threads')
-        parallel_async(func=process_work_json_v2, args=args, num_workers=threads)
+    return
+
 
+def _extract_citations_worker(jsonl_filename, overwrite, kind='referenced_works'):
+    """
+    Pool task for flatten_citations: write the referenced works parquet of one part file, in dense ids if the
+    worker has the works DenseIDMap (kind referenced_works_dense)
+    Returns the ledger record and the number of edges written
+    """
+    parq_filename = get_parquet_path(json_filename=jsonl_filename, kind=kind)
+    if parq_filename.exists() and not overwrite:
+        return None, 0
+
+    start_time = time()
+    dense_ids = _WORKER_STATE.get('dense_ids')
+    edges, num_works = extract_citation_edges(jsonl_filename, skip_ids=_WORKER_STATE['skip_ids'],
+                                              dense_ids=dense_ids)
+    num_edges = len(edges)
+    if dense_ids is None:
+        edges.schema = get_pandas_schema('referenced_works')
+    ParquetPartWriter(path=parq_filename, buffer=edges, **edges.parquet_args).close()
+    num_edges -= edges.num_dropped  # counted as the table is written
+    return get_works_record(jsonl_filename, kind=kind, duration=time() - start_time), num_edges
+
+
+def _star_extract_citations_worker(args):
+    return _extract_citations_worker(*args)
+
+
+def flatten_citations(files_to_process: str | int = 'all', threads=1, overwrite=False, dense=False):
+    """
+    Regenerate only the works_referenced_works table, without flattening the rest of the works.
+    Uses the citation edge fast path in src/citations.py, which only looks at the work id and the
+    referenced works of each line. flatten_works_v3 only drops a work if it's in the works skip ids (merged sources
+    drop location rows, not works), so both write the same table
+    dense: write works_referenced_works_dense instead, both ends as uint32 dense ids of the works (get_dense_ids),
+    half the size. Needs the works table, citations to works that aren't in it are dropped
+    """
+    skip_ids = get_skip_ids('works')
+    kind = 'referenced_works_dense' if dense else 'referenced_works'
+    dense_ids = get_dense_ids('works') if dense else None
+    get_works_table_dir(kind).mkdir(parents=True, exist_ok=True)
+
+    ledger = get_works_ledger()
+
+    works_manifest = read_manifest(kind='works', snapshot_dir=CONFIG.snapshot_dir / 'data')
+    files = sorted(works_manifest.entries, key=lambda entry: entry.count, reverse=True)  # largest parts first
+    if files_to_process != 'all':
+        files = files[: files_to_process]
+    args = [(str(entry.filename), overwrite, kind) for entry in files]
+
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    total_edges = 0
+    with multiprocessing.get_context(start_method).Pool(
+            processes=threads, initializer=_init_works_worker,
+            initargs=(dict(skip_ids=skip_ids, dense_ids=dense_ids),)) as pool, \
+            tqdm(desc='Flattening citations...', total=len(args), unit='files') as pbar:
+        for record, num_edges in pool.imap_unordered(_star_extract_citations_worker, args, chunksize=1):
+            if record is not None:
+                ledger.record_many([record])
+            total_edges += num_edges
+            pbar.update(1)
+            pbar.set_postfix_str(f'{total_edges:,} edges')
     return
 
 
-def write_to_csv_and_parquet(rows: list, kind: str, json_filename: str, debug: bool = False,
-                             csv_writer: Optional[csv.DictWriter] = None):
+def make_citation_graph(compacted: bool = False, dense: bool = False,
+                        bucket_bytes: int = BUCKET_BYTES) -> CitationGraph:
     """
-    Write rows to the CSV using the CSV writer
-    Also create a new file inside the respective parquet directory
-    return True or False based on whether the file is new
+    CSR citation graph of the works_referenced_works parquets in CONFIG.parq_dir / 'citation_graph', with the works
+    of the works table (get_dense_ids('works')) as the nodes (see src/citation_graph.py). Citations to works that
+    aren't in the works table are dropped. The memory used is about 3 x bucket_bytes on top of the work ids, whatever
+    the number of citations.
+    compacted: read the edges from the compacted table (compact_works_tables) instead of the per part parquets
+    dense: read the edges from works_referenced_works_dense (flatten_citations(dense=True)) instead
     """
-    if len(rows) == 0:
-        return True
+    kind = 'referenced_works_dense' if dense else 'referenced_works'
+    edges_dir = get_compacted_path(kind) if compacted else get_works_table_dir(kind)
+    graph = build_citation_graph(sorted(edges_dir.rglob('*.parquet')), nodes=get_dense_ids('works'),
+                                 out_dir=CONFIG.parq_dir / 'citation_graph', bucket_bytes=bucket_bytes)
+    print(f'{graph}, {graph.meta["dropped_edges"]:,} citations to works outside the snapshot dropped')
+    return graph
+
+
+def flatten_works_incremental(prev_parq_dir, threads=1, make_abstracts=False, flush_rows=None):
+    """
+    Update the works tables from the previous month's parquet directory instead of flattening from scratch
+    1. diff the saved manifest of prev_parq_dir against the current snapshot manifest
+    2. flatten only the new and changed updated_date parts into CONFIG.parq_dir (the delta layer)
+    3. compaction: carry the unchanged parts forward from prev_parq_dir, dropping the works that were merged or
+       deleted since (skip ids) or that show up again in the delta, and the citation edges pointing to merged works
+    """
+    prev_parq_dir = Path(prev_parq_dir)
+    prev_manifest_path = saved_manifest_path(prev_parq_dir, kind='works')
+    if not prev_manifest_path.exists():
+        raise FileNotFoundError(f'No saved works manifest at {str(prev_manifest_path)!r}, run flatten_works_v3 first')
+
+    old_manifest = read_manifest(kind='works', snapshot_dir=CONFIG.snapshot_dir / 'data',
+                                 manifest_path=prev_manifest_path)
+    new_manifest = read_manifest(kind='works', snapshot_dir=CONFIG.snapshot_dir / 'data')
+    diff = diff_manifests(old_manifest, new_manifest)
+
+    prev_ledger = get_works_ledger(prev_parq_dir)
+    prev_finished_parts = {  # updated_date part key -> (part, finished tables)
+        '_'.join(Path(part).parts[-2:]).replace('.gz', ''): (part, done)
+        for part, done in prev_ledger.done_tables('works').items() if set(get_works_tables()) <= done
+    }
+    # unchanged parts that weren't finished in the previous month are flattened again
+    carry_entries, delta_entries = [], diff.added + diff.changed
+    for entry in diff.unchanged:
+        if entry.updated_date in prev_finished_parts:
+            carry_entries.append(entry)
+        else:
+            delta_entries.append(entry)
+    print(f'{len(diff.added):,} new, {len(diff.changed):,} changed, {len(diff.removed):,} removed and '
+          f'{len(diff.unchanged):,} unchanged parts. Flattening {len(delta_entries):,} parts, '
+          f'carrying {len(carry_entries):,} forward from {str(prev_parq_dir)!r}')
+
+    # delta layer
+    flatten_works_v3(threads=threads, make_abstracts=make_abstracts, flush_rows=flush_rows,
+                     only_files=[entry.filename for entry in delta_entries])
+
+    # compaction
+    skip_ids = get_skip_ids('works')
+    delta_work_ids = [
+        pq.read_table(path, columns=['work_id']).column('work_id').drop_null().to_numpy()
+        for entry in delta_entries
+        if (path := get_parquet_path(json_filename=entry.filename, kind='works')).exists()
+    ]
+    drop_ids = SortedIDSet(ids=np.concatenate([skip_ids.ids, *delta_work_ids]).astype(np.uint64))
+    target_columns = {'referenced_works': 'referenced_work_id', 'related_works': 'related_work_id'}
+
+    ledger = get_works_ledger()
+    for entry in tqdm(carry_entries, desc='Carrying forward unchanged parts', unit=' part'):
+        records, dropped_references = [], False
+        prev_part, prev_tables = prev_finished_parts[entry.updated_date]
+        # works last, its num_references is recounted if citations to merged works were dropped
+        for table in sorted(prev_tables, key=lambda table_: table_ == 'works'):
+            start_time = time()
+            new_path = get_parquet_path(json_filename=entry.filename, kind=table)
+            old_path = prev_parq_dir / new_path.relative_to(CONFIG.parq_dir)
+            if old_path.exists() and not new_path.exists():  # tables without rows have no parquet
+                parquet_args = EdgeBuffer(schema=WORKS_SCHEMAS[table]).parquet_args if table in EDGE_KINDS else {}
+                num_rows, num_kept = carry_forward_part(
+                    old_path=old_path, new_path=new_path, drop_ids=drop_ids, target_column=target_columns.get(table),
+                    target_drop_ids=skip_ids, **parquet_args
+                )
+                if table == 'referenced_works' and num_kept < num_rows:
+                    dropped_references = True
+                if table == 'works' and dropped_references:
+                    update_num_references(works_path=new_path, referenced_works_path=get_parquet_path(
+                        json_filename=entry.filename, kind='referenced_works'))
+            records.append(get_works_record(entry.filename, kind=table, duration=time() - start_time))
+        ledger.record_many(records)
+    return diff
+
+
+def get_dense_id_sources() -> dict:
+    """
+    kind -> (parquet directory or file, id column) the dense ids of the kind are read from
+    """
+    sources = {'works': (get_works_table_dir('works'), 'work_id'),
+               'authors': (CONFIG.parq_dir / 'authors', 'author_id')}
+    sources.update({entity: (get_entity_parquet_path(entity, entity), spec.id_column)
+                    for entity, spec in ENTITY_SPECS.items() if entity != 'topics'})  # topic ids are small already
+    return sources
+
+
+def get_dense_ids(kind: str, rebuild: bool = False) -> DenseIDMap:
+    """
+    Dense id map (src/dense_ids.py) of works, authors, institutions, sources, ... built once per snapshot from the
+    flattened tables and kept in CONFIG.parq_dir / 'dense_ids'. rebuild after the tables change
+    """
+    path = CONFIG.parq_dir / 'dense_ids' / f'{kind}.npy'
+    if path.exists() and not rebuild:
+        return DenseIDMap(path=path)
+    source, column = get_dense_id_sources()[kind]
+    assert source.exists(), f'{kind} table not found at {str(source)!r}, flatten it first'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    dense_ids = DenseIDMap.from_parquets([source], column=column, path=path)
+    print(f'{kind} dense ids: {dense_ids}')
+    return dense_ids
+
+
+def get_compacted_path(kind: str) -> Path:
+    """
+    Directory of the Hive partitioned dataset of a works table, see compact_works_tables
+    """
+    return CONFIG.parq_dir / 'compacted' / (f'works_{kind}' if kind != 'works' else 'works')
+
+
+def get_works_table_dir(kind: str) -> Path:
+    """
+    Directory of the per part parquets of a works table
+    """
+    return CONFIG.parq_dir / (f'works_{kind}' if kind != 'works' else 'works')
 
-    if csv_writer is not None:
-        csv_writer.writerows(rows)
 
+def get_works_locator(kind: str = 'works', compacted: bool = False, update: bool = True) -> WorkLocator:
+    """
+    work_id locator index of a works table (or of its compacted dataset), kept in CONFIG.parq_dir / 'temp'.
+    update: index the parquets written since the last call first, eg: the parts that finished flattening
+    """
+    root = get_compacted_path(kind) if compacted else get_works_table_dir(kind)
+    index_dir = CONFIG.parq_dir / 'temp' / 'locators' / (f'compacted_{root.name}' if compacted else root.name)
+    locator = WorkLocator(root=root, index_dir=index_dir)
+    if update:
+        num_files = locator.update()
+        print(f'Indexed {num_files:,} new {kind} files: {locator}')
+    return locator
+
+
+def _bucket_part_worker(parq_file, bucket_dir):
+    return bucket_part(parq_file, bucket_dir=bucket_dir, year_lookup=_WORKER_STATE.get('year_lookup'),
+                       splits=_WORKER_STATE.get('splits'))
+
+
+def _star_bucket_part_worker(args):
+    return _bucket_part_worker(*args)
+
+
+def _compact_partition_worker(bucket_dir, out_dir, row_group_rows, max_file_rows):
+    return compact_partition(bucket_dir, out_dir=out_dir, row_group_rows=row_group_rows, max_file_rows=max_file_rows)
+
+
+def _star_compact_partition_worker(args):
+    return _compact_partition_worker(*args)
+
+
+def compact_works_tables(tables=None, threads=1, overwrite=False, row_group_rows=ROW_GROUP_ROWS,
+                         max_file_rows=MAX_FILE_ROWS):
+    """
+    Post-flatten step: rewrite each works table into a dataset partitioned by publication year under
+    CONFIG.parq_dir / 'compacted', sorted by work_id inside each year, with row group statistics and page indexes
+    (see src/compaction.py). Read them with open_compacted / read_compacted, or any Hive aware reader.
+    The parts are split by year and work id range in parallel into a temp directory, then each range is sorted and
+    written out in parallel. The ranges hold about max_file_rows rows, which bounds the memory of a worker.
+    tables: works tables to compact, all the flattened ones by default
+    overwrite: redo the tables that are already compacted
+    """
+    tables = tables or [kind for kind in WORKS_SCHEMAS if get_works_table_dir(kind).exists()]
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    year_lookup, year_work_ids = None, None
+    works_dir = get_works_table_dir('works')
+
+    for kind in tables:
+        out_dir = get_compacted_path(kind)
+        if out_dir.exists() and not overwrite:
+            print(f'Compacted {kind!r} exists at {str(out_dir)!r}')
+            continue
+        parq_files = sorted(get_works_table_dir(kind).glob('*.parquet'))
+        if YEAR not in WORKS_SCHEMAS[kind].names and year_lookup is None:  # the year of every work, once
+            year_lookup = get_year_lookup(works_dir)
+        if year_work_ids is None:  # the ranges cut the works of each year, scaled by the rows per work of the table
+            year_work_ids = get_year_work_ids(works_dir)
+        num_works = sum(len(work_ids) for work_ids in year_work_ids.values())
+        num_table_rows = sum(pq.read_metadata(parq_file).num_rows for parq_file in parq_files)
+        splits = work_id_splits(year_work_ids, rows_per_work=num_table_rows / max(num_works, 1),
+                                max_file_rows=max_file_rows)
+
+        tmp_dir = out_dir.with_name(f'.{out_dir.name}.tmp')
+        bucket_dir = tmp_dir.with_name(f'.{out_dir.name}.buckets')
+        for path in (tmp_dir, bucket_dir):
+            shutil.rmtree(path, ignore_errors=True)
+
+        with multiprocessing.get_context(start_method).Pool(
+                processes=threads, initializer=_init_works_worker,
+                initargs=(dict(year_lookup=year_lookup, splits=splits),)) as pool:
+            num_rows = 0
+            args = [(parq_file, bucket_dir) for parq_file in parq_files]
+            with tqdm(desc=f'Splitting {kind} by year', total=len(args), unit='files') as pbar:
+                for rows in pool.imap_unordered(_star_bucket_part_worker, args, chunksize=1):
+                    num_rows += rows
+                    pbar.update(1)
+
+            # biggest ranges first, so that a big one picked up last doesn't hold up the pool
+            range_dirs = sorted(bucket_sizes(bucket_dir).items(), key=lambda x: x[1], reverse=True) \
+                if bucket_dir.exists() else []
+            args = [(range_dir, tmp_dir / range_dir.parent.name, row_group_rows, max_file_rows)
+                    for range_dir, _ in range_dirs]
+            with tqdm(desc=f'Sorting {kind} by work id', total=len(args), unit='ranges') as pbar:
+                for _ in pool.imap_unordered(_star_compact_partition_worker, args, chunksize=1):
+                    pbar.update(1)
+
+        tmp_dir.mkdir(parents=True, exist_ok=True)  # tables without rows are an empty dataset
+        replace_dir(tmp_dir, out_dir)
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+        num_years = len({range_dir.parent.name for range_dir, _ in range_dirs})
+        print(f'Compacted {num_rows:,} {kind} rows into {num_years} years at {str(out_dir)!r}')
+    return
+
+
+def get_parquet_path(json_filename, kind: str, entity: str = 'works') -> Path:
+    """
+    Path of the parquet for table kind generated from the JSON lines part json_filename of entity (works or authors)
+    """
     json_filename = Path(json_filename)
-    kind_ = f'works_{kind}' if kind != 'works' else 'works'
-    parq_filename = PARQ_DIR / kind_ / (
+    kind_ = f'{entity}_{kind}' if kind != entity else entity
+    parq_filename = CONFIG.parq_dir / kind_ / (
             '_'.join(json_filename.parts[-2:]).replace('updated_date=', '').replace('.gz', '')
             + '.parquet')
+    return parq_filename
 
-    if parq_filename.exists():
-        # print(f'Parquet already exists {str(parq_filename.parts[-2:])}')
-        return False
-
-    if not parq_filename.parent.exists():
-        parq_filename.parent.mkdir(exist_ok=True, parents=True)
-
-    if debug:
-        print(f'{kind=} {parq_filename=} {len(rows)=:,}')
 
-    keep_cols = csv_files['works'][kind]['columns']
+def rows_to_table(rows: list, kind: str, parq_filename: Path, debug: bool = False) -> pa.Table:
+    """
+    Convert the list of row dictionaries of a works table to an Arrow table with the schema from WORKS_SCHEMAS
+    """
+    keep_cols = CSV_FILE_SPECS['works'][kind]['columns']
 
     df = (
         pd.DataFrame(rows)
@@ -2196,31 +2057,7 @@ def write_to_csv_and_parquet(rows: list, kind: str, json_filename: str, debug: b
     else:
         args = dict(format='ISO8601')
 
-    write_args = dict()
     if kind == 'works':
-        schema = pa.schema([
-            ('work_id', pa.int64()),
-            ('doi', pa.utf8()),
-            ('title', pa.utf8()),
-            ('publication_year', pa.int16()),
-            ('publication_date', pa.timestamp('ms')),
-            ('type', pa.dictionary(pa.int8(), pa.utf8())),
-            ('type_crossref', pa.dictionary(pa.int8(), pa.utf8())),
-            ('cited_by_count', pa.uint32()),
-            ('num_authors', pa.uint16()),
-            ('num_locations', pa.uint16()),
-            ('num_references', pa.uint16()),
-            ('language', pa.dictionary(pa.int8(), pa.utf8())),
-            ('has_complete_institution_info', pa.bool_()),
-            ('has_grant_info', pa.bool_()),
-            ('has_keywords', pa.bool_()),
-            ('is_retracted', pa.bool_()),
-            ('is_paratext', pa.bool_()),
-            ('created_date', pa.timestamp('ns')),
-            ('gz_path', pa.dictionary(pa.int16(), pa.utf8())),
-            # ('updated_date', pa.timestamp('ns')),
-        ])
-        write_args = dict(schema=schema)
         df = (
             df
             .assign(
@@ -2238,22 +2075,6 @@ def write_to_csv_and_parquet(rows: list, kind: str, json_filename: str, debug: b
         # df.sort_values(by='work_id', inplace=True)  # helps with setting the index later
 
     elif kind == 'authorships':
-        schema = pa.schema([
-            ('work_id', pa.int64()),
-            ('author_position', pa.dictionary(pa.int8(), pa.utf8())),
-            ('author_id', pa.int64()),
-            ('author_name', pa.utf8()),
-            ('raw_author_name', pa.utf8()),
-            ('institution_lineage_level', pa.int8()),
-            ('assigned_institution', pa.bool_()),
-            ('institution_id', pa.int64()),
-            ('institution_name', pa.dictionary(pa.int32(), pa.utf8())),
-            ('country_code', pa.dictionary(pa.int16(), pa.utf8())),
-            ('raw_affiliation_string', pa.utf8()),
-            ('publication_year', pa.int16()),
-            ('is_corresponding', pa.bool_()),
-        ])
-        write_args = dict(schema=schema)
         df.drop_duplicates(inplace=True)  # weird bug causes authorships table to have repeated rows sometimes
 
         if debug:
@@ -2266,69 +2087,109 @@ def write_to_csv_and_parquet(rows: list, kind: str, json_filename: str, debug: b
                 sub_df.to_csv('../data/sub_df.csv', index=False, mode='a', header=False, quoting=csv.QUOTE_ALL)
 
     elif kind == 'topics':
-        schema = pa.schema([
-            ('work_id', pa.int64()),
-            ('publication_year', pa.int16()),
-            ('is_primary_topic', pa.bool_()),
-            ('score', pa.float32()),
-            ('topic_id', pa.uint32()),
-            ('topic_name', pa.dictionary(pa.int16(), pa.utf8())),
-            ('subfield_id', pa.uint32()),
-            ('subfield_name', pa.dictionary(pa.int16(), pa.utf8())),
-            ('field_id', pa.uint32()),
-            ('field_name', pa.dictionary(pa.int16(), pa.utf8())),
-            ('domain_id', pa.uint32()),
-            ('domain_name', pa.dictionary(pa.int8(), pa.utf8())),
-        ])
-        write_args = dict(schema=schema)
         df.drop_duplicates(inplace=True)  # weird bug causes authorships table to have repeated rows sometimes
-    elif kind == 'keywords':
-        schema = pa.schema(
-            [
-                ("work_id", pa.int64()),
-                ("publication_year", pa.int16()),
-                ("keyword", pa.dictionary(pa.int32(), pa.utf8())),
-                ("score", pa.float32()),
-            ]
-        )
-        write_args = dict(schema=schema)
-    elif kind == 'concepts':
-        schema = pa.schema(
-            [
-                ("work_id", pa.int64()),
-                ("publication_year", pa.int16()),
-                ("score", pa.float32()),
-                ("concept_id", pa.int64()),
-                ("concept_name", pa.dictionary(pa.int32(), pa.utf8())),
-                ("level", pa.int8()),
-            ]
-        )
-        write_args = dict(schema=schema)
     # if kind == 'topics':
-    #     print(f'Writing {kind=} {parq_filename.stem}\n{df.info()}\n'); df.to_csv(PARQ_DIR / 'temp' / f'{parq_filename.stem}.csv')
+    #     print(f'Writing {kind=} {parq_filename.stem}\n{df.info()}\n')
+    #     df.to_csv(CONFIG.parq_dir / 'temp' / f'{parq_filename.stem}.csv')
 
-    write_args['compression'] = 'brotli'
+    return pa.Table.from_pandas(df, schema=WORKS_SCHEMAS[kind], preserve_index=False)
 
-    df.to_parquet(parq_filename, engine='pyarrow', coerce_timestamps='ms', allow_truncated_timestamps=True,
-                  **write_args)
-    return True
 
+AUTHORSHIPS_BATCH_SIZE = 2_000  # works whose authorships are exploded together
+COLUMNAR_KINDS = ['works', 'authorships', 'topics', 'keywords', 'concepts', 'abstracts']  # tables built without pandas
+EDGE_KINDS = ['referenced_works', 'related_works']  # (work_id, work_id) edge lists kept in int64 buffers
 
-def init_dict_writer(csv_file, file_spec, **kwargs):
-    writer = csv.DictWriter(
-        csv_file, fieldnames=file_spec['columns'], **kwargs
-    )
 
-    if os.stat(file_spec['name']).st_size == 0:  # write header only if file is empty
-        writer.writeheader()
-    return writer
+@lru_cache
+def get_pandas_schema(kind: str) -> pa.Schema:
+    """
+    Schema of the works table with the pandas metadata for its DTYPES attached,
+    so that pd.read_parquet restores eg: nullable Int64 columns for tables written without pandas
+    """
+    schema = WORKS_SCHEMAS[kind]
+    empty_df = pd.DataFrame({
+        field.name: pd.Series(dtype='datetime64[ns]' if pa.types.is_timestamp(field.type)
+                              else DTYPES[kind].get(field.name, 'object'))
+        for field in schema
+    })
+    return pa.Table.from_pandas(empty_df, schema=schema, preserve_index=False).schema
+
+
+def get_table_buffer(json_filename, kind: str, inst_lookup: Optional[CompiledLookup] = None,
+                     topic_lookup: Optional[CompiledLookup] = None):
+    """
+    Row buffer for one works table of one JSON lines part.
+    The big tables are accumulated column-wise by a TableBuilder, the rest as row dicts converted by rows_to_table
+    inst_lookup, topic_lookup: the names of the authorships and topics tables are filled in from the ids by these
+    """
+    parq_filename = get_parquet_path(json_filename=json_filename, kind=kind)
+    if kind in EDGE_KINDS:
+        return EdgeBuffer(schema=get_pandas_schema(kind))
+    if kind in COLUMNAR_KINDS:
+        constants = {'gz_path': parq_filename.stem} if kind == 'works' else None
+        # weird bug causes authorships and topics tables to have repeated rows sometimes
+        # abstracts are reconstructed from the inverted indexes in batches
+        transforms = {'abstract': reconstruct_abstracts} if kind == 'abstracts' else None
+        # names are looked up in batch from the ids, as dictionary columns built from the codes
+        if kind == 'authorships':
+            derived = lookup_columns(inst_lookup, key='institution_id', columns=INSTITUTION_COLUMNS)
+        elif kind == 'topics':
+            derived = lookup_columns(topic_lookup, key='topic_id', columns=TOPIC_COLUMNS)
+        else:
+            derived = None
+        return TableBuilder(schema=get_pandas_schema(kind), dedupe=kind in ('authorships', 'topics'),
+                            constants=constants, transforms=transforms, derived=derived)
+    return RowBuffer(to_table=lambda rows: rows_to_table(rows=rows, kind=kind, parq_filename=parq_filename))
+
+
+def get_part_writer(json_filename, kind: str, flush_rows: int, **lookups) -> ParquetPartWriter:
+    """
+    Streaming writer for one works table of one JSON lines part, flushes a row group every flush_rows rows
+    """
+    buffer = get_table_buffer(json_filename=json_filename, kind=kind, **lookups)
+    return ParquetPartWriter(path=get_parquet_path(json_filename=json_filename, kind=kind), flush_rows=flush_rows,
+                             buffer=buffer, **getattr(buffer, 'parquet_args', {}))
+
+
+def write_to_csv_and_parquet(rows, kind: str, json_filename: str, debug: bool = False, overwrite: bool = False):
+    """
+    Create a new file inside the respective parquet directory, the CSVs are made from the parquets (parquets_to_csv)
+    rows is either a list of row dicts or a buffer from get_table_buffer
+    overwrite: replace an existing parquet (and remove it if there are no rows), for recomputed tables
+    return True or False based on whether the file is new
+    """
+    parq_filename = get_parquet_path(json_filename=json_filename, kind=kind)
+
+    if len(rows) == 0:
+        if overwrite and parq_filename.exists():  # stale
+            parq_filename.unlink()
+        return True
+
+    if parq_filename.exists() and not overwrite:
+        # print(f'Parquet already exists {str(parq_filename.parts[-2:])}')
+        return False
+
+    if not parq_filename.parent.exists():
+        parq_filename.parent.mkdir(exist_ok=True, parents=True)
+
+    if debug:
+        print(f'{kind=} {parq_filename=} {len(rows)=:,}')
+
+    if hasattr(rows, 'to_table'):
+        table = rows.to_table()
+    else:
+        table = rows_to_table(rows=rows, kind=kind, parq_filename=parq_filename, debug=debug)
+    tmp_filename = parq_filename.with_name(f'.{parq_filename.name}.tmp')  # rename when done, never half written
+    pq.write_table(table, tmp_filename, **{**PARQUET_WRITE_ARGS, **getattr(rows, 'parquet_args', {})})
+    os.replace(tmp_filename, parq_filename)
+    return True
 
 
 def flatten_merged_entries(overwrite=False):
     """
     Flatten all merged entries into a single parquet file
     """
-    merged_entries_path = SNAPSHOT_DIR / 'data' / 'merged_ids'
+    merged_entries_path = CONFIG.snapshot_dir / 'data' / 'merged_ids'
     kinds = list(map(lambda s: s.stem, merged_entries_path.glob('*')))
     for kind in tqdm(kinds, desc=f'Flattening merged entries'):
         print(f'{kind=}')
@@ -2337,7 +2198,7 @@ def flatten_merged_entries(overwrite=False):
 
 if __name__ == '__main__':
     start_time = time()
-    print(f'Starting at {datetime.now().strftime("%c").strip()}')
+    print(f'Starting at {datetime.now().strftime("%c").strip()} {CONFIG}')
 
     # flatten_merged_entries()  # merges all skip_ids into a single parquet - RUN before flattening works
 
@@ -2357,9 +2218,7 @@ if __name__ == '__main__':
     #
     # abstracts, overwrite = False, False
     #
-    # # flatten_authors(files_to_process=files_to_process)  # takes 6-7 hours for the whole thing! ~3 mins per file
-    # # flatten_authors_concepts(files_to_process=files_to_process)
-    # # flatten_authors_hints(files_to_process=files_to_process)
+    # # flatten_authors(files_to_process=files_to_process, threads=threads)  # all the authors tables in one pass
 
     ### UNCOMMENT THE BLOCK below to flatten works ###
     # flatten_works_v3(
@@ -2368,4 +2227,9 @@ if __name__ == '__main__':
     # )  # takes about 20 hours  ~6 mins per file
     #######
 
+    # compact_works_tables(threads=threads)  # works tables partitioned by year and sorted by work id, after flattening
+    # get_works_locator('works')  # index of the rows by work id, lookup_many(work_ids) reads them back
+    # make_citation_graph()  # memory mapped CSR citation graph, CitationGraph(path).references / .citations
+    # flatten_citations(threads=threads, dense=True)  # citations as uint32 dense ids, see get_dense_ids
+
     print(f'End time: {datetime.now().strftime("%c").strip()}...', f'Time taken: {time() - start_time:.2f} seconds')
@@ -0,0 +1,213 @@
+"""
+Dictionary encoded store of the work abstracts
+One vocabulary shared by every part (vocabulary.parquet, token id = row number), the abstracts of each part as
+list<uint32> token ids sorted by work id, and an index of work id -> (part, row) for random access.
+Built from the works_abstracts text parquets: the text is split on single spaces, which the decoder joins back,
+so the round trip is exact. The vocabulary only ever grows, so adding parts never invalidates the old ones.
+"""
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tqdm.auto import tqdm
+
+from src.abstracts import Vocabulary, decode_token_ids
+from src.globals import path_type
+
+STORE_SCHEMA = pa.schema([('work_id', pa.int64()), ('publication_year', pa.int16()),
+                          ('token_ids', pa.list_(pa.uint32()))])
+STORE_PARQUET_ARGS = dict(compression='zstd', row_group_size=10_000)  # small row groups for the random access reads
+
+VOCABULARY_NAME, INDEX_NAME = 'vocabulary.parquet', 'index.parquet'
+
+
+def _write_table(table: pa.Table, path: Path, **parquet_args) -> None:
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    pq.write_table(table, tmp_path, **parquet_args)
+    os.replace(tmp_path, path)
+    return
+
+
+def load_vocabulary(store_dir: path_type) -> Vocabulary:
+    path = Path(store_dir) / VOCABULARY_NAME
+    if not path.exists():
+        return Vocabulary()
+    return Vocabulary(tokens=pq.read_table(path).column('token').to_pylist())
+
+
+def save_vocabulary(vocab: Vocabulary, store_dir: path_type) -> None:
+    _write_table(pa.table({'token': vocab.to_arrow()}), Path(store_dir) / VOCABULARY_NAME, compression='zstd')
+    return
+
+
+def encode_abstracts(abstracts: pa.Array, vocab: Vocabulary) -> pa.Array:
+    """
+    Split abstract strings on spaces into lists of token ids of vocab, extending it with the new tokens.
+    Null abstracts stay null
+    """
+    tokens = pc.split_pattern(abstracts, ' ')
+    if isinstance(tokens, pa.ChunkedArray):
+        tokens = tokens.combine_chunks()
+    encoded = tokens.flatten().dictionary_encode()
+
+    # only the distinct tokens of the batch go through the vocabulary
+    batch_ids = np.fromiter((vocab.ids.setdefault(token, len(vocab)) for token in encoded.dictionary.to_pylist()),
+                            dtype=np.uint32, count=len(encoded.dictionary))
+    token_ids = batch_ids[encoded.indices.to_numpy(zero_copy_only=False)]
+    offsets = pc.subtract(tokens.offsets, tokens.offsets[0])
+    return pa.ListArray.from_arrays(offsets, pa.array(token_ids, type=pa.uint32()), mask=tokens.is_null())
+
+
+def build_abstract_store(abstracts_dir: path_type, store_dir: path_type, overwrite: bool = False) -> int:
+    """
+    Encode every part of the works_abstracts directory into the store, parts already in the store are skipped
+    unless overwrite. The vocabulary is saved before each part that grew it, the index at the end.
+    Returns the number of parts encoded
+    """
+    abstracts_dir, store_dir = Path(abstracts_dir), Path(store_dir)
+    (store_dir / 'parts').mkdir(parents=True, exist_ok=True)
+    vocab = load_vocabulary(store_dir)
+    saved_tokens = len(vocab)
+
+    parts = sorted(abstracts_dir.glob('*.parquet'))
+    if not overwrite:
+        parts = [part for part in parts if not (store_dir / 'parts' / part.name).exists()]
+
+    for part in tqdm(parts, desc='Encoding abstracts', unit=' part'):
+        table = pq.read_table(part, columns=['work_id', 'publication_year', 'abstract'])
+        table = table.sort_by('work_id')
+        token_ids = encode_abstracts(table.column('abstract'), vocab=vocab)
+        encoded = pa.Table.from_arrays([table.column('work_id'), table.column('publication_year'), token_ids],
+                                       schema=STORE_SCHEMA)
+        # the vocabulary only appends, so saving it before the part is renamed into place means a finished part
+        # never holds token ids missing from the saved vocabulary, even if the build dies before the next part
+        if len(vocab) > saved_tokens:
+            save_vocabulary(vocab, store_dir)
+            saved_tokens = len(vocab)
+        _write_table(encoded, store_dir / 'parts' / part.name, **STORE_PARQUET_ARGS)
+
+    if len(vocab) > saved_tokens or not (store_dir / VOCABULARY_NAME).exists():
+        save_vocabulary(vocab, store_dir)
+    write_index(store_dir)
+    return len(parts)
+
+
+def write_index(store_dir: path_type) -> None:
+    """
+    work_id -> (part number, row in part) of every abstract of the store, sorted by work id
+    """
+    store_dir = Path(store_dir)
+    part_paths = sorted((store_dir / 'parts').glob('*.parquet'))
+    tables = []
+    for part_num, path in enumerate(part_paths):
+        work_ids = pq.read_table(path, columns=['work_id']).column('work_id')
+        tables.append(pa.table({
+            'work_id': work_ids,
+            'part': pa.array(np.full(len(work_ids), part_num, dtype=np.uint32)),
+            'row': pa.array(np.arange(len(work_ids), dtype=np.uint32)),
+        }))
+    index = pa.concat_tables(tables).sort_by('work_id') if tables else \
+        pa.table({'work_id': pa.array([], pa.int64()), 'part': pa.array([], pa.uint32()),
+                  'row': pa.array([], pa.uint32())})
+    index = index.replace_schema_metadata({'parts': '\n'.join(path.name for path in part_paths)})
+    _write_table(index, store_dir / INDEX_NAME, compression='zstd')
+    return
+
+
+class AbstractStore:
+    """
+    Random access reader of an abstract store: decode the abstracts of any list of work ids on demand,
+    reading only the row groups that hold them
+    """
+
+    def __init__(self, store_dir: path_type):
+        self.store_dir = Path(store_dir)
+        index = pq.read_table(self.store_dir / INDEX_NAME)
+        self.part_paths = [self.store_dir / 'parts' / name
+                           for name in index.schema.metadata[b'parts'].decode().split('\n') if name]
+        self.work_ids = index.column('work_id').to_numpy()
+        self.parts = index.column('part').to_numpy()
+        self.rows = index.column('row').to_numpy()
+        self.vocabulary = pq.read_table(self.store_dir / VOCABULARY_NAME).column('token').combine_chunks()
+        self._files: Dict[int, pq.ParquetFile] = {}
+        return
+
+    def __len__(self) -> int:
+        return len(self.work_ids)
+
+    def __contains__(self, work_id: int) -> bool:
+        pos = np.searchsorted(self.work_ids, work_id)
+        return pos < len(self.work_ids) and self.work_ids[pos] == work_id
+
+    def _file(self, part: int) -> pq.ParquetFile:
+        if part not in self._files:
+            self._files[part] = pq.ParquetFile(self.part_paths[part])
+        return self._files[part]
+
+    def _read_rows(self, part: int, rows: np.ndarray) -> pa.ListArray:
+        """
+        The token ids at rows of one part, only reading the row groups they fall in
+        """
+        file = self._file(part)
+        group_sizes = np.array([file.metadata.row_group(i).num_rows for i in range(file.num_row_groups)])
+        group_ends = np.cumsum(group_sizes)
+        row_groups = np.searchsorted(group_ends, rows, side='right')
+        groups = np.unique(row_groups)
+        table = file.read_row_groups(groups.tolist(), columns=['token_ids'])
+
+        # position of every row inside the concatenation of the row groups read
+        read_starts = np.concatenate([[0], np.cumsum(group_sizes[groups])[:-1]])
+        local_rows = rows - (group_ends - group_sizes)[row_groups] + read_starts[np.searchsorted(groups, row_groups)]
+        return table.column('token_ids').take(pa.array(local_rows)).combine_chunks()
+
+    def get_token_ids(self, work_ids: Iterable[int]) -> pa.Table:
+        """
+        work_id and token_ids of the requested works that have an abstract, in the requested order
+        """
+        work_ids = np.asarray(list(work_ids) if not isinstance(work_ids, np.ndarray) else work_ids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.work_ids, work_ids), max(len(self.work_ids) - 1, 0))
+        found = (self.work_ids[pos] == work_ids) if len(self.work_ids) > 0 else np.zeros(len(work_ids), dtype=bool)
+        work_ids, pos = work_ids[found], pos[found]
+
+        chunks: List[pa.Table] = []
+        for part in np.unique(self.parts[pos]):
+            in_part = np.flatnonzero(self.parts[pos] == part)
+            token_ids = self._read_rows(int(part), self.rows[pos[in_part]])
+            chunks.append(pa.table({'order': pa.array(in_part), 'token_ids': token_ids}))
+        if not chunks:
+            return pa.table({'work_id': pa.array([], pa.int64()), 'token_ids': pa.array([], STORE_SCHEMA.field(
+                'token_ids').type)})
+
+        table = pa.concat_tables(chunks).sort_by('order')
+        return pa.table({'work_id': pa.array(work_ids), 'token_ids': table.column('token_ids')})
+
+    def get(self, work_ids: Iterable[int]) -> pa.Table:
+        """
+        work_id and abstract text of the requested works that have an abstract, in the requested order
+        """
+        table = self.get_token_ids(work_ids)
+        return pa.table({'work_id': table.column('work_id'), 'abstract': self.decode(table.column('token_ids'))})
+
+    def decode(self, token_ids) -> pa.Array:
+        """
+        Abstract strings from lists of token ids
+        """
+        if isinstance(token_ids, pa.ChunkedArray):
+            token_ids = token_ids.combine_chunks()
+        return decode_token_ids(token_ids, self.vocabulary)
+
+    def read_part(self, part: int, columns: Optional[List[str]] = None) -> pa.Table:
+        """
+        One whole part with the abstracts decoded, for sequential scans
+        """
+        table = self._file(part).read(columns=['work_id', 'publication_year', 'token_ids'])
+        table = table.append_column('abstract', self.decode(table.column('token_ids'))).drop_columns(['token_ids'])
+        return table.select(columns) if columns is not None else table
+
+    def __repr__(self) -> str:
+        return f'<AbstractStore {str(self.store_dir)!r} {len(self):,} abstracts, {len(self.part_paths):,} parts, ' \
+               f'{len(self.vocabulary):,} tokens>'
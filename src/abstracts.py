@@ -0,0 +1,155 @@
+"""
+Batch reconstruction of the work abstracts from their inverted indexes (word -> list of positions)
+Instead of inverting the index of every work into a position dictionary and sorting it, the indexes of a whole batch
+of works are flattened into (work, position, token id) arrays, sorted once and the tokens are joined with Arrow.
+"""
+from itertools import chain
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+class Vocabulary:
+    """
+    token -> id mapping that grows as new tokens are seen, ids are in the order of first appearance
+    """
+
+    def __init__(self, tokens: Sequence[str] = ()):
+        self.ids: Dict[str, int] = {}
+        for token in tokens:
+            self.ids.setdefault(token, len(self.ids))
+        return
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.ids
+
+    def to_arrow(self) -> pa.Array:
+        """
+        The tokens as a string array indexed by token id
+        """
+        return pa.array(list(self.ids), type=pa.utf8())
+
+    def __repr__(self) -> str:
+        return f'<Vocabulary {len(self):,} tokens>'
+
+
+def load_inverted_index(inv_abstract) -> Optional[Dict]:
+    """
+    The inverted index of one work as a dictionary, from either format of the snapshot (with or without the
+    IndexLength / InvertedIndex nesting) or from its JSON string. None if there is no abstract or it isn't valid JSON
+    """
+    if inv_abstract is None:
+        return None
+    if isinstance(inv_abstract, (str, bytes)):
+        if len(inv_abstract) == 0:
+            return None
+        try:
+            inv_abstract = orjson.loads(inv_abstract)
+        except orjson.JSONDecodeError:
+            return None
+    if not isinstance(inv_abstract, dict):
+        return None
+    if 'InvertedIndex' in inv_abstract:  # new format of nested abstract dictionaries
+        inv_abstract = inv_abstract['InvertedIndex']
+    return inv_abstract
+
+
+def flatten_inverted_indexes(batch: Sequence, vocab: Optional[Vocabulary] = None) -> Tuple[np.ndarray, np.ndarray,
+                                                                                          Optional[pa.Array]]:
+    """
+    Flatten the inverted indexes of a batch of works into the token ids of every work in reading order.
+    A position claimed by several words keeps the last one, like inverting the index into a dictionary does.
+    Token ids point into vocab, which is extended with the new words, or into the words of the batch if vocab is None.
+    Returns the token ids (uint32), the number of tokens of each work (-1 for works without an abstract)
+    and the words of the batch in token id order (a string array) if vocab is None
+    """
+    inv_abstracts = [load_inverted_index(inv_abstract) for inv_abstract in batch]
+    valid = np.fromiter((inv_abstract is not None for inv_abstract in inv_abstracts), dtype=bool, count=len(batch))
+    inv_abstracts = [inv_abstract for inv_abstract in inv_abstracts if inv_abstract is not None]
+
+    # python only loops over the works and the distinct words, the words and positions are converted by Arrow
+    words = pa.array(list(chain.from_iterable(inv_abstracts)), type=pa.utf8()).dictionary_encode()
+    locs = pa.array(list(chain.from_iterable(map(dict.values, inv_abstracts))), type=pa.list_(pa.int64()))
+    num_locs = np.diff(locs.offsets.to_numpy())
+    positions = locs.flatten().to_numpy()
+
+    word_ids = words.indices.to_numpy().astype(np.uint32)
+    if vocab is None:
+        batch_words = words.dictionary
+    else:
+        batch_ids = np.fromiter((vocab.ids.setdefault(word, len(vocab.ids)) for word in words.dictionary.to_pylist()),
+                                dtype=np.uint32, count=len(words.dictionary))
+        word_ids = batch_ids[word_ids]
+        batch_words = None
+    token_ids = np.repeat(word_ids, num_locs)
+
+    # number of positions of every work, from the number of words of every work
+    num_words = np.fromiter(map(len, inv_abstracts), dtype=np.int64, count=len(inv_abstracts))
+    locs_end = np.concatenate([[0], np.cumsum(num_locs)])[np.cumsum(num_words)]
+    num_positions = np.diff(locs_end, prepend=0)
+    works = np.repeat(np.arange(len(inv_abstracts), dtype=np.int64), num_positions)
+
+    # one stable sort of the whole batch by (work, position), on a single int64 key when it fits
+    if len(positions) > 0:
+        low, span = int(positions.min()), int(positions.max() - positions.min()) + 1
+    else:
+        low, span = 0, 1
+    if len(inv_abstracts) * span < 2 ** 62:
+        order = np.argsort(works * span + (positions - low), kind='stable')
+    else:
+        order = np.lexsort((positions, works))
+    works, positions = works[order], positions[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (works[1:] != works[:-1]) | (positions[1:] != positions[:-1])
+
+    counts = np.full(len(batch), -1, dtype=np.int64)
+    counts[valid] = np.bincount(works[last], minlength=len(inv_abstracts))
+    return token_ids[order[last]], counts, batch_words
+
+
+def join_tokens(token_ids: np.ndarray, counts: np.ndarray, vocab_tokens: pa.Array) -> pa.Array:
+    """
+    Join the tokens of every work with spaces, counts is the number of tokens of each work, works without tokens
+    are null. The tokens are looked up in the vocabulary and joined by Arrow kernels
+    """
+    offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    np.cumsum(np.maximum(counts, 0), out=offsets[1:])
+    tokens = vocab_tokens.take(pa.array(token_ids, type=pa.uint32()))
+    if isinstance(tokens, pa.ChunkedArray):
+        tokens = tokens.combine_chunks()
+    return pc.binary_join(pa.ListArray.from_arrays(pa.array(offsets), tokens, mask=pa.array(counts <= 0)), ' ')
+
+
+def reconstruct_abstracts(batch: Sequence) -> pa.Array:
+    """
+    Abstracts of a batch of works from their inverted indexes (dictionaries or JSON strings), as an Arrow string
+    array with nulls for the works without an abstract. Batch version of reconstruct_abstract
+    """
+    token_ids, counts, batch_words = flatten_inverted_indexes(batch)
+    return join_tokens(token_ids, counts, batch_words)
+
+
+def abstract_token_ids(batch: Sequence, vocab: Vocabulary) -> pa.ListArray:
+    """
+    Abstracts of a batch of works as lists of token ids into vocab, which is extended with the new tokens.
+    Far smaller than the text once the vocabulary is shared across parts
+    """
+    token_ids, counts, _ = flatten_inverted_indexes(batch, vocab=vocab)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    np.cumsum(np.maximum(counts, 0), out=offsets[1:])
+    return pa.ListArray.from_arrays(pa.array(offsets), pa.array(token_ids, type=pa.uint32()),
+                                    mask=pa.array(counts <= 0))
+
+
+def decode_token_ids(token_ids: pa.ListArray, vocab_tokens: pa.Array) -> pa.Array:
+    """
+    Turn lists of token ids back into abstract strings, given the tokens of the vocabulary as a string array
+    """
+    counts = pc.list_value_length(token_ids).fill_null(0).to_numpy()
+    return join_tokens(token_ids.flatten().to_numpy(), counts, vocab_tokens)
@@ -0,0 +1,237 @@
+"""
+Batched parsing of the work authorships into the rows of the authorships table, one row per
+(author, institution, lineage level) like parse_authorships.
+The authorships of a batch of works are converted to Arrow in one go, then the IDs are parsed, the skip ids
+filtered and the institution lineages exploded with numpy and Arrow kernels instead of nested python loops.
+The institution names and country codes are left to the lookups of the table builder.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.columnar import to_arrow_array
+from src.utils import convert_openalex_ids_to_int, parse_authorships
+
+INSTITUTION_TYPE = pa.struct([
+    ('id', pa.utf8()),
+    ('display_name', pa.utf8()),
+    ('country_code', pa.utf8()),
+    ('lineage', pa.list_(pa.utf8())),
+])
+AUTHORSHIP_TYPE = pa.struct([  # only the keys read, the others are ignored by the conversion
+    ('author_position', pa.utf8()),
+    ('author', pa.struct([('id', pa.utf8()), ('display_name', pa.utf8())])),
+    ('raw_author_name', pa.utf8()),
+    ('is_corresponding', pa.bool_()),
+    ('institutions', pa.list_(INSTITUTION_TYPE)),
+    ('raw_affiliation_string', pa.utf8()),
+    ('raw_affiliation_strings', pa.list_(pa.utf8())),
+])
+
+# the authorships table without the institution names and country codes
+AUTHORSHIP_SCHEMA = pa.schema([
+    ('work_id', pa.int64()),
+    ('author_position', pa.utf8()),
+    ('author_id', pa.int64()),
+    ('author_name', pa.utf8()),
+    ('raw_author_name', pa.utf8()),
+    ('institution_lineage_level', pa.int64()),
+    ('assigned_institution', pa.bool_()),
+    ('institution_id', pa.int64()),
+    ('raw_affiliation_string', pa.utf8()),
+    ('publication_year', pa.int64()),
+    ('is_corresponding', pa.bool_()),
+])
+
+
+def _is_truthy(strings: pa.Array) -> np.ndarray:
+    """
+    Non null, non empty strings
+    """
+    return pc.fill_null(pc.greater(pc.binary_length(strings), 0), False).to_numpy(zero_copy_only=False)
+
+
+def _contains_many(skip_ids, ids: np.ndarray) -> np.ndarray:
+    if hasattr(skip_ids, 'contains_many'):  # SortedIDSet
+        return skip_ids.contains_many(ids)
+    return np.fromiter((int(id_) in skip_ids for id_ in ids), dtype=bool, count=len(ids))
+
+
+def _starts(counts: np.ndarray) -> np.ndarray:
+    return np.cumsum(counts) - counts
+
+
+def _nth(mask: np.ndarray, owners: np.ndarray, num_owners: int, pair_owners: np.ndarray,
+         pair_k: np.ndarray) -> np.ndarray:
+    """
+    Among the elements where mask is True, grouped by their (sorted) owners: the position of the k-th one of the
+    owner of every pair, -1 if the owner has k or fewer
+    """
+    positions = np.flatnonzero(mask)
+    counts = np.bincount(owners[positions], minlength=num_owners)
+    found = pair_k < counts[pair_owners]
+    nth = np.full(len(pair_owners), -1, dtype=np.int64)
+    nth[found] = positions[_starts(counts)[pair_owners[found]] + pair_k[found]]
+    return nth
+
+
+def _counts(mask: np.ndarray, owners: np.ndarray, num_owners: int) -> np.ndarray:
+    return np.bincount(owners[mask], minlength=num_owners)
+
+
+def _scalar_authorships(work_ids, publication_years, authorships, author_skip_ids,
+                        inst_skip_ids) -> Tuple[pa.Table, np.ndarray, np.ndarray]:
+    """
+    Fallback through parse_authorships for batches Arrow can't convert, eg: odd types in the JSON
+    """
+    rows, num_authors, has_complete = [], [], []
+    for work_id, publication_year, work_authorships in zip(work_ids, publication_years, authorships):
+        work_rows, count, complete = parse_authorships(
+            work_id=work_id, publication_year=publication_year, authorships=work_authorships,
+            author_skip_ids=author_skip_ids, inst_skip_ids=inst_skip_ids)
+        rows.extend(work_rows)
+        num_authors.append(count)
+        has_complete.append(complete)
+    table = pa.table({field.name: to_arrow_array([row[field.name] for row in rows], field.type)
+                      for field in AUTHORSHIP_SCHEMA}, schema=AUTHORSHIP_SCHEMA)
+    return table, np.array(num_authors, dtype=np.int64), np.array(has_complete, dtype=bool)
+
+
+class AuthorshipBatch:
+    """
+    Collects the authorships of works with add, explode turns the whole batch into authorship rows.
+    Same rows, author counts and has_complete_institution_info flags as parse_authorships on every work
+    """
+
+    def __init__(self, author_skip_ids, inst_skip_ids):
+        self.author_skip_ids = author_skip_ids
+        self.inst_skip_ids = inst_skip_ids
+        self.work_ids: List[int] = []
+        self.publication_years: List[Optional[int]] = []
+        self.authorships: List[list] = []
+        return
+
+    def add(self, work_id: int, publication_year: Optional[int], authorships: list) -> None:
+        self.work_ids.append(work_id)
+        self.publication_years.append(publication_year)
+        self.authorships.append(authorships)
+
+    def __len__(self) -> int:
+        return len(self.work_ids)
+
+    def clear(self) -> None:
+        self.work_ids, self.publication_years, self.authorships = [], [], []
+
+    def explode(self) -> Tuple[pa.Table, np.ndarray, np.ndarray]:
+        """
+        Returns the authorship rows of the batch (AUTHORSHIP_SCHEMA), and the number of authors and the
+        has_complete_institution_info flag of every work, in the order they were added
+        """
+        try:
+            works = pa.array(self.authorships, type=pa.list_(AUTHORSHIP_TYPE))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            return _scalar_authorships(self.work_ids, self.publication_years, self.authorships,
+                                       author_skip_ids=self.author_skip_ids, inst_skip_ids=self.inst_skip_ids)
+        num_works = len(works)
+
+        # authors without an id are dropped, and the ones in the skip ids
+        authors = works.flatten()
+        author_works = pc.list_parent_indices(works).to_numpy()
+        author_d = authors.field('author')
+        author_ids, author_valid = convert_openalex_ids_to_int(author_d.field('id'))
+        counted = _is_truthy(author_d.field('id'))
+        counted[author_valid] &= ~_contains_many(self.author_skip_ids, author_ids[author_valid])
+        counted_idx = np.flatnonzero(counted)
+        num_counted = len(counted_idx)
+        num_authors = np.bincount(author_works[counted_idx], minlength=num_works)
+
+        # institutions of the counted authors, without the ones in the skip ids
+        institution_lists = authors.field('institutions').take(pa.array(counted_idx, type=pa.int64()))
+        institutions = institution_lists.flatten()
+        inst_authors = pc.list_parent_indices(institution_lists).to_numpy()
+        inst_ids, inst_valid = convert_openalex_ids_to_int(institutions.field('id'))
+        kept = np.ones(len(institutions), dtype=bool)
+        kept[inst_valid] = ~_contains_many(self.inst_skip_ids, inst_ids[inst_valid])
+        institutions = institutions.filter(pa.array(kept))
+        inst_authors, inst_ids, inst_valid = inst_authors[kept], inst_ids[kept], inst_valid[kept]
+
+        # parse_authorships filters the ids, names, country codes and lineages separately and then zips them:
+        # the k-th valid id goes with the k-th non empty lineage, up to the shortest of the four lists
+        lineages = institutions.field('lineage')
+        lineage_lengths = pc.fill_null(pc.list_value_length(lineages), 1).to_numpy()  # a missing lineage is [None]
+        has_inst_id = inst_valid & (inst_ids != 0)
+        has_lineage = lineage_lengths > 0
+        id_counts = _counts(has_inst_id, inst_authors, num_counted)
+        num_pairs = np.maximum(id_counts, 1)
+        for mask in (_is_truthy(institutions.field('display_name')), _is_truthy(institutions.field('country_code')),
+                     has_lineage):
+            num_pairs = np.minimum(num_pairs, np.maximum(_counts(mask, inst_authors, num_counted), 1))
+
+        incomplete_works = author_works[counted_idx[id_counts == 0]]
+        has_complete = (pc.fill_null(pc.list_value_length(works), 0).to_numpy() > 0) & \
+            (np.bincount(incomplete_works, minlength=num_works) == 0)
+
+        pair_authors = np.repeat(np.arange(num_counted), num_pairs)
+        pair_k = np.arange(len(pair_authors)) - np.repeat(_starts(num_pairs), num_pairs)
+        pair_id_insts = _nth(has_inst_id, inst_authors, num_counted, pair_authors, pair_k)
+        pair_lineages = _nth(has_lineage, inst_authors, num_counted, pair_authors, pair_k)
+
+        # explode the lineages, pairs without one get a single null institution at level 0
+        lineage_ids, lineage_valid = convert_openalex_ids_to_int(lineages.flatten())
+        lineage_starts = _starts(pc.fill_null(pc.list_value_length(lineages), 0).to_numpy())
+        lineage_present = lineages.is_valid().to_numpy(zero_copy_only=False)
+        pair_has_lineage = pair_lineages >= 0
+        pair_lengths = np.ones(len(pair_lineages), dtype=lineage_lengths.dtype)  # no institution has a lineage if empty
+        pair_lengths[pair_has_lineage] = lineage_lengths[pair_lineages[pair_has_lineage]]
+        row_pairs = np.repeat(np.arange(len(pair_authors)), pair_lengths)
+        levels = np.arange(len(row_pairs)) - np.repeat(_starts(pair_lengths), pair_lengths)
+
+        row_lineages = pair_lineages[row_pairs]
+        row_in_lineage = row_lineages >= 0
+        row_in_lineage[row_in_lineage] = lineage_present[row_lineages[row_in_lineage]]
+        value_idx = lineage_starts[row_lineages[row_in_lineage]] + levels[row_in_lineage]
+        row_inst_ids = np.zeros(len(row_pairs), dtype=np.uint64)
+        row_inst_valid = np.zeros(len(row_pairs), dtype=bool)
+        row_inst_ids[row_in_lineage] = lineage_ids[value_idx]
+        row_inst_valid[row_in_lineage] = lineage_valid[value_idx]
+
+        # lineage institutions in the skip ids are dropped, the levels of the rest stay as they were
+        keep = np.ones(len(row_pairs), dtype=bool)
+        keep[row_inst_valid] = ~_contains_many(self.inst_skip_ids, row_inst_ids[row_inst_valid])
+        row_pairs, levels = row_pairs[keep], levels[keep]
+        row_inst_ids, row_inst_valid = row_inst_ids[keep], row_inst_valid[keep]
+
+        institution_ids = pa.array(row_inst_ids.astype(np.int64), mask=~row_inst_valid)
+        row_id_insts = pair_id_insts[row_pairs]
+        assigned_ids = np.zeros(len(row_pairs), dtype=np.int64)
+        assigned_ids[row_id_insts >= 0] = inst_ids[row_id_insts[row_id_insts >= 0]]
+        assigned_ids = pa.array(assigned_ids, mask=row_id_insts < 0)
+        # None == None in parse_authorships, so an author without institutions is assigned to the null one
+        assigned = pc.fill_null(pc.or_kleene(pc.equal(assigned_ids, institution_ids),
+                                       pc.and_(pc.is_null(assigned_ids), pc.is_null(institution_ids))), False)
+
+        # the author level columns, taken for every row
+        row_authors = counted_idx[pair_authors[row_pairs]]
+        take = pa.array(row_authors, type=pa.int64())
+        raw_affiliations = pc.fill_null(pc.binary_join(authors.field('raw_affiliation_strings'), ';'), '')
+        old_raw_affiliation = authors.field('raw_affiliation_string')
+        old_raw_affiliation = pc.if_else(pc.equal(old_raw_affiliation, ''), pa.scalar(None, pa.utf8()),
+                                         old_raw_affiliation)
+        raw_affiliations = pc.if_else(pc.equal(raw_affiliations, ''), old_raw_affiliation, raw_affiliations)
+        row_works = author_works[row_authors]
+
+        return pa.Table.from_arrays([
+            pa.array(np.asarray(self.work_ids, dtype=np.int64)[row_works]),
+            authors.field('author_position').take(take),
+            pa.array(author_ids[row_authors].astype(np.int64), mask=~author_valid[row_authors]),
+            author_d.field('display_name').take(take),
+            authors.field('raw_author_name').take(take),
+            pa.array(levels, type=pa.int64()),
+            assigned,
+            institution_ids,
+            raw_affiliations.take(take),
+            pa.array(self.publication_years, type=pa.int64(), from_pandas=True).take(pa.array(row_works)),
+            authors.field('is_corresponding').take(take),
+        ], schema=AUTHORSHIP_SCHEMA), num_authors, has_complete
@@ -0,0 +1,208 @@
+"""
+Citation graph in compressed sparse row (CSR) form, built out of core from the works_referenced_works parquets
+The works are numbered 0 .. n-1 in the order of their sorted work ids (nodes.npy, a DenseIDMap), and the graph is
+stored twice as memory mapped .npy arrays: forward (out_indptr, out_indices: the works a work cites) and reverse
+(in_indptr, in_indices: the works citing it). The neighbours of node i are indices[indptr[i]: indptr[i + 1]], so
+they come back in O(degree) without loading the graph.
+Building reads the edge parquets once, a record batch at a time, and spills the densified edges into buckets of
+consecutive nodes on disk, one set for each direction. Each bucket is then sorted in memory and written to its slice
+of the arrays, so the memory used is set by the bucket size and not by the number of edges.
+"""
+import json
+import math
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm.auto import tqdm
+
+from src.dense_ids import DENSE_DTYPE, DenseIDMap
+from src.globals import path_type
+from src.id_sets import SortedIDSet
+
+NODE_DTYPE = DENSE_DTYPE  # dense node numbers, up to 4B works
+BATCH_ROWS = 1_000_000  # edges read and densified at a time
+BUCKET_BYTES = 1 << 30  # edges of a bucket sorted in memory at a time, about 3x this is used at the peak
+MAX_BUCKETS = 512  # a spill file is open for each bucket and direction
+
+
+class _BucketSpill:
+    """
+    Edges (key node, other node) appended to one raw file per range of bucket_nodes consecutive key nodes
+    """
+
+    def __init__(self, spill_dir: Path, num_buckets: int, bucket_nodes: int):
+        spill_dir.mkdir(parents=True, exist_ok=True)
+        self.paths = [spill_dir / f'bucket_{i:05d}.bin' for i in range(num_buckets)]
+        self.files = [open(path, 'wb') for path in self.paths]
+        self.bucket_nodes = bucket_nodes
+        return
+
+    def add(self, keys: np.ndarray, others: np.ndarray) -> None:
+        buckets = keys // self.bucket_nodes
+        order = np.argsort(buckets, kind='stable')
+        keys, others, buckets = keys[order], others[order], buckets[order]
+        unique_buckets, starts = np.unique(buckets, return_index=True)
+        ends = np.append(starts[1:], len(buckets))
+        for bucket, start, end in zip(unique_buckets.tolist(), starts.tolist(), ends.tolist()):
+            pairs = np.empty((end - start, 2), dtype=NODE_DTYPE)
+            pairs[:, 0], pairs[:, 1] = keys[start: end], others[start: end]
+            pairs.tofile(self.files[bucket])
+        return
+
+    def close(self) -> None:
+        for fp in self.files:
+            fp.close()
+
+    def read(self, bucket: int) -> np.ndarray:
+        return np.fromfile(self.paths[bucket], dtype=NODE_DTYPE).reshape(-1, 2)
+
+    def num_edges(self) -> int:
+        return sum(path.stat().st_size for path in self.paths) // (2 * np.dtype(NODE_DTYPE).itemsize)
+
+
+def _write_csr(spill: _BucketSpill, num_nodes: int, indptr_path: Path, indices_path: Path, desc: str) -> None:
+    """
+    Sort the buckets one at a time into the indptr (int64, num_nodes + 1) and indices arrays.
+    The neighbours of a node are sorted
+    """
+    num_edges = spill.num_edges()
+    indptr = np.lib.format.open_memmap(indptr_path, mode='w+', dtype=np.int64, shape=(num_nodes + 1,))
+    indices = np.lib.format.open_memmap(indices_path, mode='w+', dtype=NODE_DTYPE, shape=(num_edges,))
+    indptr[0], offset = 0, 0
+    for bucket in tqdm(range(len(spill.paths)), desc=desc, unit='buckets', leave=False):
+        lo, hi = bucket * spill.bucket_nodes, min((bucket + 1) * spill.bucket_nodes, num_nodes)
+        pairs = spill.read(bucket)
+        # sorting the pairs packed as (key << 32 | other) is much faster than a lexsort of the two columns
+        packed = pairs[:, 0].astype(np.uint64) << np.uint64(32) | pairs[:, 1]
+        del pairs
+        packed.sort()
+        counts = np.bincount((packed >> np.uint64(32)).astype(np.int64) - lo, minlength=hi - lo)
+        indptr[lo + 1: hi + 1] = offset + np.cumsum(counts)
+        indices[offset: offset + len(packed)] = packed & np.uint64(0xFFFFFFFF)
+        offset += len(packed)
+    indptr.flush(), indices.flush()
+    del indptr, indices
+    return
+
+
+def build_citation_graph(edge_files: Iterable[path_type], nodes: SortedIDSet, out_dir: path_type,
+                         source: str = 'work_id', target: str = 'referenced_work_id',
+                         bucket_bytes: int = BUCKET_BYTES, batch_rows: int = BATCH_ROWS) -> 'CitationGraph':
+    """
+    Build the forward and reverse CSR arrays of the edges in edge_files into out_dir (nodes.npy is a copy of nodes).
+    Edges with an end that isn't a node (eg: citations to works missing from the snapshot) are dropped and counted.
+    Edge tables in dense ids (uint32 columns, flatten_citations(dense=True)) are taken as numbered by nodes.
+    bucket_bytes: the size of the edges of a bucket (8 bytes an edge), sets the memory used
+    """
+    out_dir, edge_files = Path(out_dir), [Path(f) for f in edge_files]
+    tmp_dir = out_dir.with_name(f'.{out_dir.name}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    nodes = DenseIDMap.build(nodes.ids, tmp_dir / 'nodes.npy')
+    num_nodes = len(nodes)
+    assert num_nodes < np.iinfo(NODE_DTYPE).max, f'{num_nodes:,} works do not fit in {NODE_DTYPE.__name__}'
+
+    # buckets of consecutive nodes holding about bucket_bytes of edges each, from the row counts of the footers
+    max_edges = sum(pq.ParquetFile(f).metadata.num_rows for f in edge_files)
+    num_buckets = min(MAX_BUCKETS, max(1, math.ceil(max_edges * 2 * np.dtype(NODE_DTYPE).itemsize / bucket_bytes)))
+    bucket_nodes = max(1, math.ceil(num_nodes / num_buckets))
+    num_buckets = max(1, math.ceil(num_nodes / bucket_nodes))
+
+    forward = _BucketSpill(tmp_dir / 'spill_out', num_buckets=num_buckets, bucket_nodes=bucket_nodes)
+    reverse = _BucketSpill(tmp_dir / 'spill_in', num_buckets=num_buckets, bucket_nodes=bucket_nodes)
+    num_read, num_dropped = 0, 0
+    try:
+        for edge_file in tqdm(edge_files, desc='Spilling citation edges', unit='files'):
+            for batch in pq.ParquetFile(edge_file).iter_batches(batch_size=batch_rows, columns=[source, target]):
+                if batch.schema.field(source).type == pa.from_numpy_dtype(NODE_DTYPE):  # already dense
+                    sources, targets = (batch.column(i).to_numpy() for i in range(2))
+                    found = (sources < num_nodes) & (targets < num_nodes)
+                else:
+                    (sources, found_sources), (targets, found_targets) = map(nodes.to_dense, batch.columns)
+                    found = found_sources & found_targets
+                num_read += len(found)
+                num_dropped += len(found) - int(found.sum())
+                sources, targets = sources[found], targets[found]
+                forward.add(sources, targets)
+                reverse.add(targets, sources)
+    finally:
+        forward.close(), reverse.close()
+
+    _write_csr(forward, num_nodes, tmp_dir / 'out_indptr.npy', tmp_dir / 'out_indices.npy', desc='Forward CSR')
+    _write_csr(reverse, num_nodes, tmp_dir / 'in_indptr.npy', tmp_dir / 'in_indices.npy', desc='Reverse CSR')
+    shutil.rmtree(tmp_dir / 'spill_out'), shutil.rmtree(tmp_dir / 'spill_in')
+
+    meta = dict(num_nodes=num_nodes, num_edges=num_read - num_dropped, dropped_edges=num_dropped,
+                edge_files=len(edge_files))
+    (tmp_dir / 'meta.json').write_text(json.dumps(meta, indent=2))
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return CitationGraph(out_dir)
+
+
+class CitationGraph:
+    """
+    Memory mapped CSR citation graph written by build_citation_graph.
+    The node level methods take and return dense node numbers, the others OpenAlex work ids
+    """
+
+    def __init__(self, path: path_type):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / 'meta.json').read_text())
+        self.nodes = DenseIDMap(path=self.path / 'nodes.npy')
+        # asarray drops the np.memmap subclass, like SortedIDSet
+        self.out_indptr, self.out_indices, self.in_indptr, self.in_indices = (
+            np.asarray(np.load(self.path / f'{name}.npy', mmap_mode='r'))
+            for name in ['out_indptr', 'out_indices', 'in_indptr', 'in_indices']
+        )
+        return
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.out_indptr) - 1
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.out_indices)
+
+    def __repr__(self) -> str:
+        return f'<CitationGraph {str(self.path)!r} {self.num_nodes:,} works {self.num_edges:,} citations>'
+
+    def node(self, work_id: int) -> Optional[int]:
+        """
+        Dense node number of a work, None if it isn't in the graph
+        """
+        nodes, found = self.nodes.to_dense([work_id])
+        return int(nodes[0]) if found[0] else None
+
+    def successors(self, node: int) -> np.ndarray:
+        return self.out_indices[self.out_indptr[node]: self.out_indptr[node + 1]]
+
+    def predecessors(self, node: int) -> np.ndarray:
+        return self.in_indices[self.in_indptr[node]: self.in_indptr[node + 1]]
+
+    def out_degrees(self) -> np.ndarray:
+        return np.diff(self.out_indptr)
+
+    def in_degrees(self) -> np.ndarray:
+        return np.diff(self.in_indptr)
+
+    def references(self, work_id: int) -> np.ndarray:
+        """
+        Work ids of the works cited by work_id (empty if it isn't in the graph)
+        """
+        node = self.node(work_id)
+        return self.nodes.to_openalex(self.successors(node)) if node is not None else np.empty(0, dtype=np.uint64)
+
+    def citations(self, work_id: int) -> np.ndarray:
+        """
+        Work ids of the works citing work_id (empty if it isn't in the graph)
+        """
+        node = self.node(work_id)
+        return self.nodes.to_openalex(self.predecessors(node)) if node is not None else np.empty(0, dtype=np.uint64)
@@ -0,0 +1,167 @@
+"""
+Fast path for the citation edges (work_id, referenced_work_id) of the works snapshot
+The edges are by far the largest works table, so they skip the per-row dicts and the full JSON parse:
+edges go into preallocated int64 buffers, are filtered against the skip ids in bulk and written
+sorted, with delta encoding, one parquet per part file
+"""
+import re
+from typing import Optional
+
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.dense_ids import DenseIDMap
+from src.globals import path_type
+from src.id_sets import SortedIDSet
+from src.readers import JSONLReader
+from src.utils import convert_openalex_id_to_int, convert_openalex_ids_to_int
+
+# sorted int64 columns compress much better with delta encoding than with dictionaries
+EDGE_PARQUET_ARGS = dict(use_dictionary=False, sorting_columns=[pq.SortingColumn(0), pq.SortingColumn(1)])
+
+EDGE_SCHEMA = pa.schema([('work_id', pa.int64()), ('referenced_work_id', pa.int64())])
+
+
+def dense_edge_schema(schema: pa.Schema = EDGE_SCHEMA) -> pa.Schema:
+    """
+    The edge schema with both ends as uint32 dense ids (see src/dense_ids.py)
+    """
+    return pa.schema([field.with_type(pa.uint32()) for field in schema])
+
+
+# the top level work id and referenced works list can be cut out of the raw line without parsing the whole work:
+# keys in the raw JSON are never inside a string value (quotes in values are escaped)
+_WORK_ID_RE = re.compile(rb'^\{\s*"id"\s*:\s*"(?:https://openalex\.org/)?W(\d+)"')
+_REFERENCED_WORKS_RE = re.compile(rb'"referenced_works"\s*:\s*(\[[^\]]*\])')
+
+
+class EdgeBuffer:
+    """
+    Two preallocated int64 columns of (source, target) edges that grow by doubling.
+    Works as a row buffer for ParquetPartWriter / write_to_csv_and_parquet: to_table drops the edges
+    pointing into skip_ids and sorts the rest by (source, target).
+    With dense_ids, both ends are written as uint32 dense ids and the edges with an end missing from the map are
+    dropped (counted in num_dropped)
+    """
+
+    def __init__(self, schema: pa.Schema = EDGE_SCHEMA, skip_ids: Optional[SortedIDSet] = None,
+                 capacity: int = 1 << 16, dense_ids: Optional[DenseIDMap] = None):
+        self.schema = dense_edge_schema(schema) if dense_ids is not None else schema
+        self.skip_ids = skip_ids
+        self.dense_ids = dense_ids
+        self.num_dropped = 0
+        self.parquet_args = {
+            **EDGE_PARQUET_ARGS, 'column_encoding': {name: 'DELTA_BINARY_PACKED' for name in schema.names},
+        }
+        self.sources = np.empty(capacity, dtype=np.int64)
+        self.targets = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+        return
+
+    def _reserve(self, n: int) -> None:
+        if self.size + n <= len(self.sources):
+            return
+        capacity = max(2 * len(self.sources), self.size + n)
+        self.sources = np.resize(self.sources, capacity)
+        self.targets = np.resize(self.targets, capacity)
+
+    def add_edges(self, sources, targets) -> None:
+        """
+        Append arrays of edges, sources can be a single id shared by all the targets
+        """
+        targets = np.asarray(targets, dtype=np.int64)
+        n = len(targets)
+        self._reserve(n)
+        self.sources[self.size: self.size + n] = sources
+        self.targets[self.size: self.size + n] = targets
+        self.size += n
+
+    def append_values(self, source: int, target: int) -> None:
+        self._reserve(1)
+        self.sources[self.size] = source
+        self.targets[self.size] = target
+        self.size += 1
+
+    def append(self, row) -> None:
+        source_name, target_name = self.schema.names
+        self.append_values(row[source_name], row[target_name])
+
+    def extend(self, rows) -> None:
+        for row in rows:
+            self.append(row)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def clear(self) -> None:
+        self.size = 0
+
+    def to_table(self) -> pa.Table:
+        sources, targets = self.sources[: self.size], self.targets[: self.size]
+        if self.skip_ids is not None and len(self.skip_ids) > 0:
+            keep = ~self.skip_ids.contains_many(targets)
+            sources, targets = sources[keep], targets[keep]
+        if self.dense_ids is not None:  # the numbering keeps the order of the ids, so the sort is the same
+            (sources, found_sources), (targets, found_targets) = map(self.dense_ids.to_dense, (sources, targets))
+            keep = found_sources & found_targets
+            self.num_dropped += len(keep) - int(keep.sum())
+            sources, targets = sources[keep], targets[keep]
+        order = np.lexsort((targets, sources))
+        table = pa.Table.from_arrays([pa.array(sources[order]), pa.array(targets[order])], names=self.schema.names)
+        return table.cast(self.schema)
+
+
+def parse_citation_edges(line: bytes):
+    """
+    Pull the work id and the referenced works (as OpenAlex URL strings) out of one works JSON line.
+    Falls back to a full JSON parse when the line doesn't look like the snapshot layout.
+    Returns (None, []) for blank lines and works without an id
+    """
+    id_match = _WORK_ID_RE.match(line)
+    refs_match = _REFERENCED_WORKS_RE.search(line) if id_match is not None else None
+    if refs_match is not None:
+        return int(id_match.group(1)), orjson.loads(refs_match.group(1))
+
+    if not line.strip():
+        return None, []
+    work = orjson.loads(line)
+    return convert_openalex_id_to_int(work.get('id')), work.get('referenced_works') or []
+
+
+def extract_citation_edges(jsonl_filename: path_type, skip_ids: Optional[SortedIDSet] = None,
+                           chunk_works: int = 50_000, dense_ids: Optional[DenseIDMap] = None):
+    """
+    Collect the citation edges of one works part file.
+    Works in skip_ids are dropped, and so are the edges to works in skip_ids, the same edges as process_work_json_v2
+    The referenced work ids are converted chunk_works works at a time with the batch ID parser
+    dense_ids: the edges come out as uint32 dense ids of this map, see EdgeBuffer
+    Returns the EdgeBuffer and the number of works read
+    """
+    edges = EdgeBuffer(skip_ids=skip_ids, dense_ids=dense_ids)
+    work_ids, counts, refs = [], [], []
+    num_works = 0
+
+    def flush_chunk():
+        ref_ids, valid = convert_openalex_ids_to_int(refs)
+        sources = np.repeat(np.asarray(work_ids, dtype=np.int64), counts)
+        edges.add_edges(sources[valid], ref_ids[valid])
+        work_ids.clear(), counts.clear(), refs.clear()
+
+    with JSONLReader(jsonl_filename) as works_jsonl:
+        for work_json in works_jsonl:
+            work_id, referenced_works = parse_citation_edges(work_json)
+            if work_id is None or (skip_ids is not None and work_id in skip_ids):
+                continue
+            num_works += 1
+            referenced_works = [ref for ref in referenced_works if ref]
+            work_ids.append(work_id)
+            counts.append(len(referenced_works))
+            refs.extend(referenced_works)
+
+            if len(work_ids) >= chunk_works:
+                flush_chunk()
+    if work_ids:
+        flush_chunk()
+    return edges, num_works
@@ -0,0 +1,166 @@
+"""
+Typed column accumulators that build Arrow tables without going through per-table pandas DataFrames
+"""
+from typing import Callable, Dict, Iterable, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def to_arrow_array(values: list, type_: pa.DataType) -> pa.Array:
+    """
+    Convert a list of python values into an Arrow array of type type_
+    None, NaN and pd.NA become nulls, timestamps are parsed from ISO 8601 strings and unparseable dates are
+    set to null (like pd.to_datetime(errors='coerce'))
+    """
+    if pa.types.is_timestamp(type_):
+        strings = pa.array(values, type=pa.utf8(), from_pandas=True)
+        try:
+            return strings.cast(type_)
+        except pa.ArrowInvalid:  # bad dates, parse the date part and null out the rest
+            return pc.strptime(pc.utf8_slice_codeunits(strings, 0, 10), format='%Y-%m-%d', unit=type_.unit,
+                               error_is_null=True).cast(type_)
+    try:
+        return pa.array(values, type=type_, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    if pa.types.is_dictionary(type_):
+        return to_arrow_array(values, type_.value_type).dictionary_encode().cast(type_)
+    if pa.types.is_string(type_) or pa.types.is_large_string(type_):  # mixed types, stringify the odd ones out
+        return pa.array([v if isinstance(v, str) or v is None else str(v) for v in values], type=type_,
+                        from_pandas=True)
+    return pa.array(values, from_pandas=True).cast(type_, safe=False)  # eg: numeric strings, overflowing ints
+
+
+class TransformedColumn:
+    """
+    Column of raw values turned into Arrow by a batch function (eg: inverted indexes to abstracts),
+    batch_size values at a time as they come in so that the raw values don't pile up
+    """
+
+    def __init__(self, transform: Callable[[list], pa.Array], batch_size: int = 10_000):
+        self.transform = transform
+        self.batch_size = batch_size
+        self.pending: list = []
+        self.chunks: list = []
+        self._num_converted = 0
+        return
+
+    def _convert(self) -> None:
+        if self.pending:
+            self.chunks.append(self.transform(self.pending))
+            self._num_converted += len(self.pending)
+            self.pending = []
+
+    def append(self, value) -> None:
+        self.pending.append(value)
+        if len(self.pending) >= self.batch_size:
+            self._convert()
+
+    def __len__(self) -> int:
+        return self._num_converted + len(self.pending)
+
+    def clear(self) -> None:
+        self.pending, self.chunks, self._num_converted = [], [], 0
+
+    def to_arrow(self, type_: pa.DataType) -> pa.ChunkedArray:
+        self._convert()
+        return pa.chunked_array([chunk.cast(type_) for chunk in self.chunks], type=type_)
+
+
+class TableBuilder:
+    """
+    Accumulates the rows of one table column-wise, one python list per field of an Arrow schema,
+    and turns them straight into a pa.Table.
+    append_values takes the values positionally in schema order and is the fast path,
+    append takes a row dictionary and picks the schema fields out of it (missing fields are null),
+    append_table takes a batch of rows already in Arrow.
+    """
+
+    def __init__(self, schema: pa.Schema, dedupe: bool = False, constants: Optional[Dict] = None,
+                 transforms: Optional[Dict[str, Callable[[list], pa.Array]]] = None,
+                 derived: Optional[Dict[str, Callable[[pa.Table], pa.Array]]] = None):
+        """
+        dedupe: drop repeated rows when building the table
+        constants: fields that have the same value for every row, filled in at build time
+        transforms: fields whose appended values are converted in batches by a function returning an Arrow array
+        derived: fields computed at build time from the table of the other fields (after the dedupe),
+            eg: names looked up from ids. They aren't appended
+        """
+        self.schema = schema
+        self.dedupe = dedupe
+        self.constants = constants or {}
+        self.derived = derived or {}
+        transforms = transforms or {}
+        self.names = [name for name in schema.names if name not in self.constants and name not in self.derived]
+        self.columns: Dict[str, list] = {name: TransformedColumn(transforms[name]) if name in transforms else []
+                                         for name in self.names}
+        self._appenders = [self.columns[name].append for name in self.names]
+        self.tables: list = []  # batches from append_table
+        return
+
+    def append_values(self, *values) -> None:
+        for append, value in zip(self._appenders, values):
+            append(value)
+
+    def append(self, row: Dict) -> None:
+        for name, append in zip(self.names, self._appenders):
+            append(row.get(name))
+
+    def extend(self, rows: Iterable[Dict]) -> None:
+        for row in rows:
+            self.append(row)
+
+    def append_table(self, table: pa.Table) -> None:
+        """
+        Append a batch of rows with a column for every appended field (not the constant or derived ones)
+        """
+        if table.num_rows > 0:
+            self.tables.append(table)
+
+    def __len__(self) -> int:
+        return len(self.columns[self.names[0]]) + sum(table.num_rows for table in self.tables)
+
+    def clear(self) -> None:
+        for values in self.columns.values():
+            values.clear()
+        self.tables = []
+
+    def to_table(self) -> pa.Table:
+        num_rows = len(self.columns[self.names[0]])
+        arrays = []
+        base_schema = pa.schema([field for field in self.schema if field.name not in self.derived])
+        # dictionary encoding waits until after the dedupe, group by works on the plain values
+        types = [field.type.value_type if self.dedupe and pa.types.is_dictionary(field.type) else field.type
+                 for field in base_schema]
+        for field, type_ in zip(base_schema, types):
+            if field.name in self.constants:
+                values = [self.constants[field.name]] * num_rows
+            else:
+                values = self.columns[field.name]
+            if isinstance(values, TransformedColumn):
+                arrays.append(values.to_arrow(type_))
+            else:
+                arrays.append(to_arrow_array(values, type_))
+        table = pa.Table.from_arrays(arrays, names=base_schema.names)
+
+        if self.tables:
+            batches = [pa.Table.from_arrays([
+                pa.array([self.constants[field.name]] * batch.num_rows, type=type_) if field.name in self.constants
+                else batch.column(field.name).cast(type_) for field, type_ in zip(base_schema, types)],
+                names=base_schema.names) for batch in self.tables]
+            table = pa.concat_tables([table.cast(pa.schema(list(zip(base_schema.names, types))))] + batches)
+
+        if self.dedupe:
+            # the first of each set of duplicates, in the order of the rows like drop_duplicates, group by alone
+            # doesn't keep the order and the rows of a work would no longer be together
+            row_numbers = table.append_column('_row_number', pa.array(np.arange(table.num_rows, dtype=np.int64)))
+            first_rows = row_numbers.group_by(base_schema.names, use_threads=False) \
+                .aggregate([('_row_number', 'min')]).column('_row_number_min')
+            table = table.take(first_rows.take(pc.sort_indices(first_rows))).cast(base_schema)
+        if self.derived:
+            table = pa.Table.from_arrays([table.column(field.name) if field.name not in self.derived
+                                          else self.derived[field.name](table).cast(field.type)
+                                          for field in self.schema], schema=self.schema)
+        return table.replace_schema_metadata(self.schema.metadata)
@@ -0,0 +1,221 @@
+"""
+Query ready layout of the flattened works tables
+flatten_works_v3 writes one parquet per snapshot part for every table, in the order of the part and without any
+partitioning, so a filter on the publication year or on a range of work ids has to read every file.
+Compaction rewrites a table into a Hive partitioned dataset, a publication_year=YYYY directory per year, with the
+rows of a year sorted by work_id and cut into files of consecutive work id ranges. The files have row groups of a
+fixed number of rows, column statistics and page indexes, so that year filters skip directories and work id filters
+skip files, row groups and pages from their min / max.
+It is done in two steps that both run a part (or a work id range) at a time: bucket_part splits the parquet of a part
+by year and work id range into a temporary directory, then compact_partition sorts and writes out the buckets of one
+range. The ranges (work_id_splits) cut the works of a year into runs of about MAX_FILE_ROWS rows of the table, so that
+a sort never holds a whole recent year of an edge table in memory.
+The tables without a publication_year column (ids, biblio, referenced_works, ...) get it from the works table.
+"""
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.globals import path_type
+from src.lookups import CompiledLookup
+from src.writers import PARQUET_WRITE_ARGS
+
+YEAR = 'publication_year'
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'  # directory of the rows without a year, read back as nulls
+
+RANGE = 'range'  # sub directory of the buckets of a work id range inside a year
+
+PARTITIONING = ds.partitioning(pa.schema([(YEAR, pa.int16())]), flavor='hive')
+
+ROW_GROUP_ROWS = 1_000_000  # big enough for good compression, small enough for the id ranges to prune
+MAX_FILE_ROWS = 20_000_000  # rows of a year are cut into files of consecutive work ids of at most this many rows
+
+COMPACT_PARQUET_ARGS = dict(PARQUET_WRITE_ARGS, write_statistics=True, write_page_index=True)
+BUCKET_PARQUET_ARGS = dict(compression='lz4', coerce_timestamps='ms', allow_truncated_timestamps=True)
+
+
+def partition_name(year: Optional[int]) -> str:
+    return f'{YEAR}={NULL_PARTITION if year is None else int(year)}'
+
+
+def range_name(i: int) -> str:
+    return f'{RANGE}={i:05d}'
+
+
+def get_year_lookup(works_dir: path_type) -> CompiledLookup:
+    """
+    work_id -> publication_year from the parquets of the works table
+    """
+    dataset = ds.dataset(works_dir, format='parquet')
+    return CompiledLookup.from_table(dataset.to_table(columns=['work_id', YEAR]), key='work_id', columns=[YEAR])
+
+
+def get_year_work_ids(works_dir: path_type) -> dict:
+    """
+    Sorted work ids of each publication year from the parquets of the works table, -1 for the works without a year
+    """
+    table = ds.dataset(works_dir, format='parquet').to_table(columns=['work_id', YEAR])
+    years = table.column(YEAR).cast(pa.int32()).fill_null(-1).to_numpy()
+    work_ids = table.column('work_id').cast(pa.int64()).to_numpy()
+    order = np.lexsort((work_ids, years))
+    years, work_ids = years[order], work_ids[order]
+    unique_years, starts = np.unique(years, return_index=True)
+    ends = np.append(starts[1:], len(years))
+    return {year: work_ids[start: end]
+            for year, start, end in zip(unique_years.tolist(), starts.tolist(), ends.tolist())}
+
+
+def work_id_splits(year_work_ids: dict, rows_per_work: float = 1, max_file_rows: int = MAX_FILE_ROWS) -> dict:
+    """
+    Work ids at which the buckets of each year are cut into ranges, for a table of rows_per_work rows per work on
+    average: every range of a year holds about max_file_rows rows.
+    year_work_ids: sorted work ids of each year (see get_year_work_ids)
+    """
+    works_per_range = max(int(max_file_rows / max(rows_per_work, 1e-9)), 1)
+    return {year: work_ids[works_per_range:: works_per_range] for year, work_ids in year_work_ids.items()}
+
+
+def bucket_part(parq_file: path_type, bucket_dir: path_type, year_lookup: Optional[CompiledLookup] = None,
+                splits: Optional[dict] = None) -> int:
+    """
+    Split the parquet of one part by year and work id range: a <bucket_dir>/publication_year=YYYY/range=NNNNN/<part>
+    .parquet for each of them, without the year column. The year is looked up by work id if the table doesn't have it.
+    splits: work ids cutting each year into ranges (see work_id_splits), a single range per year without them
+    Returns the number of rows
+    """
+    parq_file, bucket_dir = Path(parq_file), Path(bucket_dir)
+    table = pq.read_table(parq_file)
+    table = table.replace_schema_metadata(None)  # the pandas metadata of the part would list the year column
+    if table.num_rows == 0:
+        return 0
+    if YEAR in table.column_names:
+        years = table.column(YEAR)
+        table = table.drop_columns([YEAR])
+    else:
+        assert year_lookup is not None, f'{str(parq_file)!r} has no {YEAR} column and there is no year lookup'
+        years = year_lookup.take(YEAR, keys=table.column('work_id'), type_=pa.int16())
+
+    # stable sorts by year, then by range inside each year, keep the order of the part inside each bucket
+    years = years.cast(pa.int32()).fill_null(-1).to_numpy()  # -1 for the nulls
+    order = np.argsort(years, kind='stable')
+    years = years[order]
+    ranges = np.zeros(len(years), dtype=np.int64)
+    if splits:
+        work_ids = table.column('work_id').cast(pa.int64()).fill_null(-1).to_numpy()[order]
+        unique_years, starts = np.unique(years, return_index=True)
+        for year, start, end in zip(unique_years.tolist(), starts.tolist(), np.append(starts[1:], len(years)).tolist()):
+            if len(splits.get(year, [])) > 0:
+                ranges[start: end] = np.searchsorted(splits[year], work_ids[start: end], side='right')
+        range_order = np.lexsort((ranges, years))
+        order, years, ranges = order[range_order], years[range_order], ranges[range_order]
+    table = table.take(pa.array(order))
+    starts = np.flatnonzero(np.concatenate([[True], (years[1:] != years[:-1]) | (ranges[1:] != ranges[:-1])]))
+    ends = np.append(starts[1:], len(years))
+
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        year, range_ = int(years[start]), int(ranges[start])
+        path = bucket_dir / partition_name(None if year == -1 else year) / range_name(range_) / \
+            f'{parq_file.stem}.parquet'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table.slice(start, end - start), path, **BUCKET_PARQUET_ARGS)
+    return table.num_rows
+
+
+def sort_by_work_id(table: pa.Table) -> pa.Table:
+    """
+    Stable sort by work_id: the rows of a work stay in the order of the part, eg: the sorted citation edges
+    """
+    table = table.unify_dictionaries()
+    return table.take(pc.sort_indices(table, sort_keys=[('work_id', 'ascending')]))
+
+
+def write_sorted_files(table: pa.Table, out_dir: path_type, row_group_rows: int = ROW_GROUP_ROWS,
+                       max_file_rows: int = MAX_FILE_ROWS, prefix: str = 'part') -> List[Path]:
+    """
+    Write a table sorted by work_id into <prefix>-00000.parquet, <prefix>-00001.parquet, .. of at most max_file_rows
+    rows. Files are written to temp files and renamed
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sorting_columns = [pq.SortingColumn(table.column_names.index('work_id'))]
+
+    paths = []
+    for i, start in enumerate(range(0, max(table.num_rows, 1), max_file_rows)):
+        path = out_dir / f'{prefix}-{i:05d}.parquet'
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        with pq.ParquetWriter(tmp_path, table.schema, sorting_columns=sorting_columns,
+                              **COMPACT_PARQUET_ARGS) as writer:
+            writer.write_table(table.slice(start, max_file_rows), row_group_size=row_group_rows)
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def compact_partition(bucket_dir: path_type, out_dir: path_type, row_group_rows: int = ROW_GROUP_ROWS,
+                      max_file_rows: int = MAX_FILE_ROWS) -> int:
+    """
+    Sort the buckets of one work id range (a publication_year=YYYY/range=NNNNN directory of bucket_part) by work_id
+    into out_dir, the directory of the year, as part-NNNNN-00000.parquet, .. so that the file names of a year follow
+    the order of the work ids.
+    Returns the number of rows
+    """
+    bucket_dir = Path(bucket_dir)
+    files = sorted(bucket_dir.glob('*.parquet'))
+    table = pa.concat_tables([pq.read_table(f) for f in files], promote_options='permissive')
+    write_sorted_files(sort_by_work_id(table), out_dir=out_dir, row_group_rows=row_group_rows,
+                       max_file_rows=max_file_rows, prefix=f'part-{bucket_dir.name.split("=")[-1]}')
+    return table.num_rows
+
+
+def bucket_sizes(bucket_dir: path_type) -> dict:
+    """
+    Bytes of the buckets of each work id range directory (inside the year directories), to schedule the biggest first
+    """
+    return {range_dir: sum(f.stat().st_size for f in range_dir.glob('*.parquet'))
+            for range_dir in Path(bucket_dir).glob(f'{YEAR}=*/{RANGE}=*') if range_dir.is_dir()}
+
+
+def replace_dir(tmp_dir: path_type, path: path_type) -> None:
+    """
+    Swap a finished directory in place of path, removing the old one
+    """
+    tmp_dir, path = Path(tmp_dir), Path(path)
+    if path.exists():
+        old_dir = path.with_name(f'.{path.name}.old')
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(path, old_dir)
+        os.replace(tmp_dir, path)
+        shutil.rmtree(old_dir)
+    else:
+        os.replace(tmp_dir, path)
+    return
+
+
+def open_compacted(path: path_type) -> ds.Dataset:
+    """
+    Dataset of a compacted table, with publication_year (int16) read from the directory names
+    """
+    return ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+
+
+def read_compacted(path: path_type, columns: Optional[Iterable[str]] = None, years: Optional[tuple] = None,
+                   work_ids: Optional[tuple] = None) -> pa.Table:
+    """
+    Read a compacted table, only touching the files and row groups that can match
+    years: (first, last) publication years, both included
+    work_ids: (min, max) work ids, both included
+    """
+    expression = None
+    for column, bounds in [(YEAR, years), ('work_id', work_ids)]:
+        if bounds is None:
+            continue
+        condition = (ds.field(column) >= bounds[0]) & (ds.field(column) <= bounds[1])
+        expression = condition if expression is None else expression & condition
+    return open_compacted(path).to_table(columns=list(columns) if columns is not None else None, filter=expression)
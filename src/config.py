@@ -0,0 +1,86 @@
+"""
+Runtime configuration of the flattening: the snapshot, CSV and parquet directories and the institution and topic
+lookups read from the CSVs.
+Nothing is read or created when the config is made, the output directories are created the first time they're used
+and the lookups are loaded (and compiled if needed) the first time they're asked for, then cached.
+"""
+import socket
+from functools import cached_property
+from pathlib import Path
+from typing import Optional
+
+from src.globals import path_type
+from src.lookups import CompiledLookup, load_institution_lookup, load_topic_lookup
+
+MONTH = 'may-2025'
+
+
+def get_basedir(hostname: Optional[str] = None) -> Path:
+    """
+    Directory where the OpenAlex snapshots are downloaded, by machine
+    """
+    hostname = hostname or socket.gethostname()
+    if 'quartz' in hostname:
+        return Path('/N/project/openalex/ssikdar')
+        # return Path('/N/scratch/ssikdar')
+    elif hostname == 'yoda':
+        return Path('/data/shared/OpenAlex')
+    return Path('/home/ssikdar/data/shared/OpenAlex')
+
+
+class FlattenConfig:
+    """
+    Directories default to the ones under the base directory of the machine (see get_basedir), any of them can be
+    given explicitly. The CSVs are written with csv_compression, gzip or zstd, at csv_compression_level.
+    The lookups can also be set directly, eg: config.inst_lookup = CompiledLookup.from_dicts(...)
+    """
+
+    def __init__(self, basedir: Optional[path_type] = None, month: str = MONTH,
+                 snapshot_dir: Optional[path_type] = None, csv_dir: Optional[path_type] = None,
+                 parq_dir: Optional[path_type] = None, csv_compression: str = 'gzip',
+                 csv_compression_level: Optional[int] = None):
+        basedir = Path(basedir) if basedir is not None else get_basedir()
+        self.basedir = basedir
+        self.month = month
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir is not None else basedir / 'openalex-snapshot'
+        self._csv_dir = Path(csv_dir) if csv_dir is not None else \
+            basedir / 'processed-snapshots' / 'csv-files' / month
+        self._parq_dir = Path(parq_dir) if parq_dir is not None else \
+            basedir / 'processed-snapshots' / 'parquet-files' / month
+        self.csv_compression = csv_compression  # gzip (.csv.gz) or zstd (.csv.zst)
+        self.csv_compression_level = csv_compression_level  # the codec default if None
+        return
+
+    @cached_property
+    def csv_dir(self) -> Path:
+        self._csv_dir.mkdir(parents=True, exist_ok=True)
+        return self._csv_dir
+
+    @cached_property
+    def parq_dir(self) -> Path:
+        self._parq_dir.mkdir(parents=True, exist_ok=True)
+        return self._parq_dir
+
+    @cached_property
+    def inst_lookup(self) -> Optional[CompiledLookup]:
+        """
+        institution id -> name, country code, from institutions.csv.gz
+        """
+        lookup = load_institution_lookup(self._csv_dir, compression=self.csv_compression)
+        if lookup is None:
+            print('Inst CSV not found!')
+        return lookup
+
+    @cached_property
+    def topic_lookup(self) -> Optional[CompiledLookup]:
+        """
+        topic id -> name, subfield, field and domain, from topics.csv.gz
+        """
+        lookup = load_topic_lookup(self._csv_dir, compression=self.csv_compression)
+        if lookup is None:
+            print('Topic CSV not found!')
+        return lookup
+
+    def __repr__(self) -> str:
+        return f'<FlattenConfig snapshot_dir={str(self.snapshot_dir)!r} csv_dir={str(self._csv_dir)!r} ' \
+               f'parq_dir={str(self._parq_dir)!r}>'
@@ -0,0 +1,60 @@
+"""
+Dense numbering of the OpenAlex ids of an entity kind (works, authors, institutions, sources, ...)
+OpenAlex ids are sparse integers (works are around 4.3e9), so every graph or matrix built from the tables needs the
+ids renumbered 0 .. n-1 first. A DenseIDMap is the sorted array of the ids of a snapshot, saved once as a .npy file
+and memory mapped: the dense id of an id is its position in the array (to_dense, a binary search) and the id of a
+dense id is the value at that position (to_openalex, a take). Dense ids fit in uint32, half the size of the int64
+ids in the edge tables.
+"""
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from src.globals import path_type
+from src.id_sets import SortedIDSet
+
+DENSE_DTYPE = np.uint32
+
+
+class DenseIDMap(SortedIDSet):
+    """
+    Sorted, de-duplicated uint64 ids (a SortedIDSet) read as a mapping id <-> position
+    """
+
+    @classmethod
+    def from_parquets(cls, parquet_paths: Iterable[path_type], column: str, path: path_type) -> 'DenseIDMap':
+        """
+        Build the map of the ids of a column of parquet files or directories (eg: the works or authors tables)
+        """
+        files = []
+        for parquet_path in map(Path, parquet_paths):  # directories are read whole, eg: <parq_dir>/works
+            files.extend(sorted(parquet_path.rglob('*.parquet')) if parquet_path.is_dir() else [parquet_path])
+        dataset = ds.dataset([str(f) for f in files], format='parquet')
+        ids = dataset.to_table(columns=[column]).column(column).drop_null().to_numpy()
+        return cls.build(ids=ids, path=path)
+
+    def to_dense(self, ids):
+        """
+        (dense ids as uint32, found) of an array of ids, the dense id of an id not in the map is 0 and not found
+        """
+        if isinstance(ids, (pa.Array, pa.ChunkedArray)):
+            ids = ids.cast(pa.int64()).fill_null(-1).to_numpy()  # a null is an id that isn't in the map
+        ids = np.asarray(ids).astype(np.uint64, copy=False)
+        if len(self.ids) == 0:
+            return np.zeros(len(ids), dtype=DENSE_DTYPE), np.zeros(len(ids), dtype=bool)
+        pos = np.minimum(self.ids.searchsorted(ids), len(self.ids) - 1)
+        return pos.astype(DENSE_DTYPE), self.ids[pos] == ids
+
+    def to_openalex(self, dense_ids) -> np.ndarray:
+        """
+        OpenAlex ids (uint64) of an array of dense ids
+        """
+        if isinstance(dense_ids, (pa.Array, pa.ChunkedArray)):
+            dense_ids = dense_ids.to_numpy()
+        return self.ids.take(np.asarray(dense_ids, dtype=np.int64))
+
+    def __repr__(self) -> str:
+        return f'<DenseIDMap {len(self):,} ids{f" at {str(self.path)!r}" if self.path is not None else ""}>'
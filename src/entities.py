@@ -3,9 +3,9 @@ Make individual classes
 """
 import abc
 import gc
-import gzip
 import os
 from pathlib import Path
+from time import time
 from typing import List, Dict
 
 import pandas as pd
@@ -15,6 +15,8 @@ from joblib import Parallel, delayed
 from tqdm.auto import tqdm
 
 from src.globals import path_type
+from src.ledger import Ledger, file_digest
+from src.readers import JSONLReader
 from src.utils import Paths, read_manifest, ensure_dir
 
 
@@ -29,10 +31,10 @@ class Entities:
         self.paths = paths
         self.parquet_path: Path = self.paths.processed_dir / f'{self.kind}.parquet'
         self.manifest = read_manifest(kind=self.kind, paths=self.paths)
-        self.finished_files_path = self.paths.temp_dir / f'{self.kind}.txt'
-        self.finished_files: List[path_type] = self.get_finished_files()  # stores the list of finished entities
+        self.ledger = Ledger(self.paths.temp_dir / 'ledger.sqlite')  # finished (entry, table) outputs
         self.dtypes = {}  # dtype dictionary
         self.init_dtype_dicts()
+        self.finished_files: List[path_type] = self.get_finished_files()  # stores the list of finished entities
         return
 
     @abc.abstractmethod
@@ -61,7 +63,7 @@ class Entities:
         :return:
         """
 
-        if str(entry.updated_date) in self.get_finished_files():
+        if all(self.ledger.is_done(self.kind, str(entry.updated_date), table_name) for table_name in self.dtypes):
             # tqdm.write(f'Skipping {self.kind!r} {entry.updated_date!r}!')
             return
 
@@ -70,7 +72,7 @@ class Entities:
 
         with tqdm(total=entry.count, ncols=100, colour='green', unit='line', leave=True,
                   ascii=True) as pbar:
-            with gzip.open(entry.filename) as fp:
+            with JSONLReader(entry.filename) as fp:
                 for line in fp:
                     try:
                         json_line = json.loads(line)
@@ -254,7 +256,19 @@ class Entities:
         return schema[self.kind]
 
     def get_finished_files(self) -> List[path_type]:
-        finished_files = [file.stem for file in (self.paths.processed_dir / self.kind).glob('*.parquet')]
+        """
+        Entries with every table recorded in the ledger.
+        The first time around, the parquets already on disk are recorded (they used to be found by a glob)
+        """
+        if not self.ledger.has_entity(self.kind):
+            records = [
+                dict(entity=self.kind, part=file.stem, table=table_name, path=path)
+                for file in (self.paths.processed_dir / self.kind).glob('*.parquet')
+                for table_name in self.dtypes
+                if (path := self.paths.processed_dir / table_name / file.name).exists()
+            ]
+            self.ledger.record_many(records)
+        finished_files = sorted(self.ledger.finished_parts(self.kind, tables=self.dtypes))
         return finished_files
 
     def write_to_disk(self, table_name: str, updated_date: str, rows: List, fmt: str = 'parquet', verbose: bool = False,
@@ -282,7 +296,12 @@ class Entities:
         ensure_dir(path.parents[0], recursive=True)  # makes sure the parent dirs exist
         if verbose:
             tqdm.write(f'Writing {table_name!r} {len(df):,} rows to {path}')
-        writer_fn(df, path=path, **fun_args, **args)
+        tmp_path = path.with_name(f'.{path.name}.tmp')  # renamed when done so a crash never leaves a partial file
+        start_time = time()
+        writer_fn(df, tmp_path, **fun_args, **args)
+        os.replace(tmp_path, path)
+        self.ledger.record(entity=self.kind, part=str(updated_date), table=table_name, rows=len(df), path=path,
+                           duration=time() - start_time, content_hash=file_digest(path))
         return
 
     def find_missing_tables(self):
@@ -318,7 +337,7 @@ class Entities:
             rows_dict = {col: [] for col in missing_table_names}
             tqdm.write(f'\nProcessing {missing_table_names} {gz_filename}')
 
-            with gzip.open(gz_filename) as fp:
+            with JSONLReader(gz_filename) as fp:
                 for line in fp:
                     json_line = json.loads(line)
                     json_rows_dict = self.process_json(json_line)
@@ -0,0 +1,228 @@
+"""
+Declarative specs of the flattening of the small entities: funders, publishers, sources, topics, concepts and
+institutions. The columns of every table come from the CSV specs (CSV_FILE_SPECS in
+preprocessing/flatten_openalex_files.py), a spec only says where the rows of a table are in a record and which columns
+don't simply come from the key of the same name, and get_entity_scan compiles it into the extractors of an EntityScan.
+Adding an entity is a spec here and its columns in CSV_FILE_SPECS.
+"""
+import json
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import pyarrow as pa
+
+from src.scan import EntityScan, ScanBatch
+from src.utils import convert_openalex_ids_to_int, convert_topic_ids_to_int
+
+ITEM = '.'  # path of the row item itself, eg: the strings of a list of alternate titles
+
+# types of the columns that aren't strings, by column name
+COLUMN_TYPES = {
+    'works_count': pa.uint32(),
+    'cited_by_count': pa.uint32(),
+    'oa_works_count': pa.uint32(),
+    'grants_count': pa.uint32(),
+    'num_works': pa.uint32(),
+    'year': pa.int16(),
+    'level': pa.int8(),
+    'hierarchy_level': pa.int8(),
+    'score': pa.float32(),
+    'mag': pa.int64(),
+    'is_oa': pa.bool_(),
+    'is_in_doaj': pa.bool_(),
+    'latitude': pa.float64(),
+    'longitude': pa.float64(),
+    'oa_percent': pa.float64(),
+    'h_index': pa.uint32(),
+    '2yr_mean_citedness': pa.float64(),
+    '2yr_works_count': pa.uint32(),
+    '2yr_i10_index': pa.uint32(),
+    '2yr_h_index': pa.uint32(),
+    'updated_date': pa.timestamp('ns'),
+}
+
+
+def openalex_ids(values: list) -> pa.Array:
+    return convert_openalex_ids_to_int(values, as_arrow=True)[0]
+
+
+def topic_ids(values: list) -> pa.Array:
+    return convert_topic_ids_to_int(values, as_arrow=True)[0]
+
+
+def json_dumps(values: list) -> pa.Array:
+    """
+    Lists and dicts as JSON strings, like the CSVs always had them (None becomes 'null')
+    """
+    return pa.array([json.dumps(value, ensure_ascii=False) for value in values], type=pa.utf8())
+
+
+class Column(NamedTuple):
+    path: Optional[str] = None  # dotted path in the row item, the column name by default
+    type: Optional[pa.DataType] = None  # COLUMN_TYPES or string by default
+    transform: Optional[Callable[[list], pa.Array]] = None  # batch function of the values, eg: openalex_ids
+
+
+class Table(NamedTuple):
+    rows: Union[None, str, Tuple[str, ...]] = None  # key of the dict or list of rows, the record itself if None
+    columns: Dict[str, Column] = {}
+    require: Optional[str] = None  # skip the row items without this key
+
+
+class EntitySpec(NamedTuple):
+    """
+    id_column and name_column of every table are filled in from the id and display name of the record
+    """
+    id_column: str
+    name_column: Optional[str]
+    tables: Dict[str, Table]
+    id_type: pa.DataType = pa.int64()
+    convert_ids: Callable = convert_openalex_ids_to_int
+
+
+_counts_by_year = Table(rows='counts_by_year')
+_ids = Table(rows='ids')
+
+ENTITY_SPECS: Dict[str, EntitySpec] = {
+    'funders': EntitySpec(id_column='funder_id', name_column='funder_name', tables={
+        'funders': Table(),
+        'ids': _ids,
+        'alternate_titles': Table(rows='alternate_titles', columns={'alternate_title': Column(path=ITEM)}),
+        'roles': Table(rows='roles', columns={'role_type': Column(path='role'),
+                                              'role_id': Column(path='id', type=pa.int64(), transform=openalex_ids)}),
+        'summary_stats': Table(rows='summary_stats'),
+        'counts_by_year': _counts_by_year,
+    }),
+    'publishers': EntitySpec(id_column='publisher_id', name_column='publisher_name', tables={
+        'publishers': Table(columns={'alternate_titles': Column(transform=json_dumps),
+                                     'country_codes': Column(transform=json_dumps)}),
+        'counts_by_year': _counts_by_year,
+        'ids': _ids,
+    }),
+    'sources': EntitySpec(id_column='source_id', name_column='source_name', tables={
+        'sources': Table(columns={'issn': Column(transform=json_dumps)}),
+        'ids': Table(rows='ids', columns={'issn': Column(transform=json_dumps)}),
+        'counts_by_year': _counts_by_year,
+    }),
+    'topics': EntitySpec(id_column='topic_id', name_column='topic_name', id_type=pa.uint32(),
+                         convert_ids=convert_topic_ids_to_int, tables={
+        'topics': Table(columns={
+            'num_works': Column(path='works_count'),
+            **{f'{genre}_id': Column(path=f'{genre}.id', type=pa.uint32(), transform=topic_ids)
+               for genre in ['subfield', 'field', 'domain']},
+            **{f'{genre}_name': Column(path=f'{genre}.display_name') for genre in ['subfield', 'field', 'domain']},
+        }),
+        'keywords': Table(rows='keywords', columns={'keyword': Column(path=ITEM)}),
+        'siblings': Table(rows='siblings', columns={
+            'sibling_topic_id': Column(path='id', type=pa.uint32(), transform=topic_ids),
+            'sibling_topic_name': Column(path='display_name')}),
+    }),
+    'concepts': EntitySpec(id_column='concept_id', name_column='concept_name', tables={
+        'concepts': Table(),
+        # the ancestor and related concept ids are kept as OpenAlex URLs, like in the CSVs
+        'ancestors': Table(rows='ancestors', require='id', columns={'ancestor_id': Column(path='id')}),
+        'counts_by_year': _counts_by_year,
+        'ids': Table(rows='ids', columns={'umls_aui': Column(transform=json_dumps),
+                                          'umls_cui': Column(transform=json_dumps)}),
+        'related_concepts': Table(rows='related_concepts', require='id',
+                                  columns={'related_concept_id': Column(path='id')}),
+    }),
+    'institutions': EntitySpec(id_column='institution_id', name_column='institution_name', tables={
+        'institutions': Table(columns={'display_name_acroynyms': Column(transform=json_dumps),
+                                       'display_name_alternatives': Column(transform=json_dumps)}),
+        'ids': _ids,
+        'geo': Table(rows='geo'),
+        'associated_institutions': Table(
+            rows=('associated_institutions', 'associated_insitutions'),  # typo in the api
+            require='id', columns={'associated_institution_id': Column(path='id', type=pa.int64(),
+                                                                    transform=openalex_ids)}),
+        'counts_by_year': _counts_by_year,
+    }),
+}
+
+
+def _getter(path: str) -> Callable[[object], object]:
+    if path == ITEM:
+        return lambda item: item
+    keys = path.split('.')
+    if len(keys) == 1:
+        return lambda item: item.get(path)
+
+    def _get(item):
+        for key in keys:
+            if not isinstance(item, dict):
+                return None
+            item = item.get(key)
+        return item
+    return _get
+
+
+def _row_items(rows: Union[None, str, Tuple[str, ...]], require: Optional[str]) -> Callable[[Dict], List]:
+    """
+    Function of a record giving the row items of a table: the record, a dict in it or the items of a list in it
+    """
+    if rows is None:
+        return lambda record: [record]
+    keys = (rows,) if isinstance(rows, str) else rows
+
+    def _items(record: Dict) -> List:
+        for key in keys:
+            if value := record.get(key):  # empty dicts and lists have no rows
+                break
+        else:
+            return []
+        items = [value] if isinstance(value, dict) else value
+        if require is not None:
+            items = [item for item in items if isinstance(item, dict) and item.get(require)]
+        return items
+    return _items
+
+
+def get_table_schema(spec: EntitySpec, table: str, columns: Iterable[str]) -> pa.Schema:
+    table_spec = spec.tables[table]
+    fields = []
+    for name in columns:
+        column = table_spec.columns.get(name, Column())
+        if name == spec.id_column:
+            type_ = spec.id_type
+        elif column.type is not None:
+            type_ = column.type
+        else:
+            type_ = COLUMN_TYPES.get(name, pa.utf8())
+        fields.append((name, type_))
+    return pa.schema(fields)
+
+
+def table_extractor(spec: EntitySpec, table: str, columns: Iterable[str]) -> Callable[[ScanBatch, object], None]:
+    """
+    extract(batch, writer) of an EntityScan for one table of the spec, appending the values in the order of columns
+    """
+    table_spec = spec.tables[table]
+    row_items = _row_items(table_spec.rows, require=table_spec.require)
+    # the id and the name come from the record, the other columns from the row items
+    getters = [None if name in (spec.id_column, spec.name_column)
+               else _getter(table_spec.columns.get(name, Column()).path or name) for name in columns]
+    is_id = [name == spec.id_column for name in columns]
+
+    def _extract(batch: ScanBatch, writer) -> None:
+        for record, id_ in zip(batch.records, batch.ids):
+            name = record.get('display_name')
+            for item in row_items(record):
+                writer.append_values(*[get(item) if get is not None else id_ if id_column else name
+                                       for get, id_column in zip(getters, is_id)])
+    return _extract
+
+
+def get_entity_scan(entity: str, table_columns: Dict[str, List[str]], skip_ids=None) -> EntityScan:
+    """
+    EntityScan of an entity with a table for each of the spec, the columns of every table from table_columns.
+    Records seen before by the scan are skipped, like the old seen_*_ids sets
+    """
+    spec = ENTITY_SPECS[entity]
+    scan = EntityScan(entity, skip_ids=skip_ids, convert_ids=spec.convert_ids, dedupe_ids=True)
+    for table in spec.tables:
+        columns = table_columns[table]
+        transforms = {name: column.transform for name, column in spec.tables[table].columns.items()
+                      if column.transform is not None and name in columns}
+        scan.register(table, get_table_schema(spec, table, columns), table_extractor(spec, table, columns),
+                      transforms=transforms or None)
+    return scan
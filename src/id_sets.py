@@ -0,0 +1,85 @@
+"""
+Compact sets of OpenAlex integer IDs backed by sorted uint64 arrays
+"""
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from src.globals import path_type
+
+
+class SortedIDSet:
+    """
+    Read-only set of integer IDs stored as a sorted uint64 numpy array.
+    When built from / loaded from a .npy file, the array is memory-mapped read-only so that every process
+    shares the same pages instead of keeping its own copy of a Python set.
+    Membership checks are O(log n) binary searches, use contains_many for whole arrays.
+    """
+
+    def __init__(self, ids: Optional[Iterable[int]] = None, path: Optional[path_type] = None):
+        self.path: Optional[Path] = Path(path) if path is not None else None
+        if self.path is not None:
+            # asarray drops the np.memmap subclass so that scalar lookups skip its overhead
+            self.ids = np.asarray(np.load(self.path, mmap_mode='r'))
+        else:
+            ids = ids if isinstance(ids, np.ndarray) else list(ids) if ids is not None else []
+            self.ids = np.unique(np.asarray(ids, dtype=np.uint64))
+        return
+
+    @classmethod
+    def build(cls, ids, path: path_type) -> 'SortedIDSet':
+        """
+        Sort and de-duplicate ids, write them to path (.npy) and return the memory-mapped set.
+        The file is written to a temp file first and renamed so readers never see a partial array.
+        """
+        path = Path(path)
+        ids = np.unique(np.asarray(ids, dtype=np.uint64))
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as fp:
+            np.save(fp, ids)
+        os.replace(tmp_path, path)
+        return cls(path=path)
+
+    @classmethod
+    def from_parquet(cls, parquet_path: path_type, path: path_type, column: str = 'id',
+                     extra_ids: Iterable[int] = ()) -> 'SortedIDSet':
+        """
+        Build the set from an integer column of a parquet file, eg: the *_combined_merged_ids.parquet files
+        """
+        ids = pq.read_table(parquet_path, columns=[column]).column(column).drop_null().to_numpy()
+        ids = np.concatenate([ids.astype(np.uint64), np.asarray(list(extra_ids), dtype=np.uint64)])
+        return cls.build(ids=ids, path=path)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, id_) -> bool:
+        if id_ is None or id_ < 0 or len(self.ids) == 0:
+            return False
+        i = self.ids.searchsorted(id_)
+        return bool(i < len(self.ids) and self.ids[i] == id_)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def contains_many(self, ids) -> np.ndarray:
+        """
+        Vectorised membership: returns a boolean mask with True where ids[i] is in the set
+        """
+        ids = np.asarray(ids, dtype=np.uint64)
+        if len(self.ids) == 0 or len(ids) == 0:
+            return np.zeros(len(ids), dtype=bool)
+        pos = np.minimum(self.ids.searchsorted(ids), len(self.ids) - 1)
+        return self.ids[pos] == ids
+
+    def __reduce__(self):
+        # file backed sets are re-mapped in the receiving process (spawned pool workers) instead of copied
+        if self.path is not None:
+            return self.__class__, (None, self.path)
+        return self.__class__, (self.ids,)
+
+    def __repr__(self) -> str:
+        return f'<SortedIDSet {len(self):,} ids{f" at {str(self.path)!r}" if self.path is not None else ""}>'
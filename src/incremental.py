@@ -0,0 +1,117 @@
+"""
+Incremental monthly updates of the flattened works tables
+OpenAlex groups records into updated_date=YYYY-MM-DD partitions, so between two snapshots most part files are
+untouched. The manifest of the snapshot each parquet directory was built from is saved next to it, the next
+month only flattens the new / changed parts and carries the rest forward with the merges and deletions applied.
+"""
+import os
+import shutil
+from collections import namedtuple
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.globals import path_type
+from src.id_sets import SortedIDSet
+from src.writers import PARQUET_WRITE_ARGS
+
+ManifestDiff = namedtuple('ManifestDiff', 'added changed removed unchanged')
+
+
+def saved_manifest_path(parq_dir: path_type, kind: str = 'works') -> Path:
+    return Path(parq_dir) / 'temp' / f'{kind}_manifest.json'
+
+
+def save_manifest_copy(kind: str, snapshot_dir: path_type, parq_dir: path_type) -> Path:
+    """
+    Keep a copy of the snapshot manifest the parquet directory is built from, for the next incremental update
+    """
+    path = saved_manifest_path(parq_dir, kind=kind)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(Path(snapshot_dir) / kind / 'manifest', path)
+    return path
+
+
+def diff_manifests(old_manifest, new_manifest) -> ManifestDiff:
+    """
+    Compare the entries of two manifests (from read_manifest) partition by partition.
+    An entry counts as changed if its record count or its content length differs
+    """
+    old_entries = {entry.updated_date: entry for entry in old_manifest.entries}
+    new_entries = {entry.updated_date: entry for entry in new_manifest.entries}
+
+    added, changed, unchanged = [], [], []
+    for key, entry in new_entries.items():
+        if key not in old_entries:
+            added.append(entry)
+        elif (entry.count, entry.content_length) != (old_entries[key].count, old_entries[key].content_length):
+            changed.append(entry)
+        else:
+            unchanged.append(entry)
+    removed = [entry for key, entry in old_entries.items() if key not in new_entries]
+    return ManifestDiff(added=added, changed=changed, removed=removed, unchanged=unchanged)
+
+
+def carry_forward_part(old_path: path_type, new_path: path_type, drop_ids: SortedIDSet, column: str = 'work_id',
+                       target_column: Optional[str] = None, target_drop_ids: Optional[SortedIDSet] = None,
+                       **parquet_args) -> Tuple[int, int]:
+    """
+    Copy one table parquet of the previous month into the new directory, dropping the rows whose column is in
+    drop_ids (merged / deleted / re-flattened works) and, for edge lists, whose target_column is in target_drop_ids.
+    Unfiltered files are hard linked (or copied), filtered ones are written to a temp file and renamed.
+    Returns the number of rows read and kept
+    """
+    old_path, new_path = Path(old_path), Path(new_path)
+    new_path.parent.mkdir(parents=True, exist_ok=True)
+    table = pq.read_table(old_path)
+
+    keep = ~drop_ids.contains_many(table.column(column).fill_null(0).to_numpy())
+    if target_column is not None and target_drop_ids is not None:
+        keep &= ~target_drop_ids.contains_many(table.column(target_column).fill_null(0).to_numpy())
+
+    if keep.all():
+        try:
+            os.link(old_path, new_path)
+        except OSError:  # different file systems
+            shutil.copy2(old_path, new_path)
+        return table.num_rows, table.num_rows
+
+    num_rows = table.num_rows
+    table = table.filter(keep)
+    _write_table(table, new_path, **parquet_args)
+    return num_rows, table.num_rows
+
+
+def update_num_references(works_path: path_type, referenced_works_path: path_type) -> None:
+    """
+    Recount the num_references column of a carried forward works parquet after edges were dropped from its
+    referenced works parquet
+    """
+    works = pq.read_table(works_path)
+    if Path(referenced_works_path).exists():
+        citing = pq.read_table(referenced_works_path, columns=['work_id']).column('work_id').to_numpy()
+    else:
+        citing = np.array([], dtype=np.int64)
+    citing, counts = np.unique(citing, return_counts=True)
+
+    work_ids = works.column('work_id').fill_null(-1).to_numpy()
+    num_references = np.zeros(len(work_ids), dtype=np.int64)
+    if len(citing) > 0:
+        pos = np.minimum(citing.searchsorted(work_ids), len(citing) - 1)
+        found = citing[pos] == work_ids
+        num_references[found] = counts[pos[found]]
+
+    i = works.schema.get_field_index('num_references')
+    works = works.set_column(i, works.schema.field(i), pa.array(num_references).cast(works.schema.field(i).type))
+    _write_table(works, works_path)
+    return
+
+
+def _write_table(table: pa.Table, path: Path, **parquet_args) -> None:
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    pq.write_table(table, tmp_path, **{**PARQUET_WRITE_ARGS, **parquet_args})
+    os.replace(tmp_path, path)
+    return
@@ -0,0 +1,186 @@
+"""
+Checkpoint ledger of the finished outputs of the flatteners, kept in a single SQLite file
+Replaces the finished_works.txt log, the finished_*.pkl pickles and the directory globs used to resume runs
+"""
+import csv
+import hashlib
+import os
+import pickle
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+from src.globals import path_type
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    entity TEXT NOT NULL,
+    part TEXT NOT NULL,
+    tbl TEXT NOT NULL,
+    status TEXT NOT NULL,
+    rows INTEGER,
+    bytes INTEGER,
+    duration REAL,
+    hash TEXT,
+    path TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (entity, part, tbl)
+) WITHOUT ROWID
+"""
+
+DONE, FAILED = 'done', 'failed'
+
+
+def file_digest(path: path_type, chunk_size: int = 1 << 20) -> str:
+    """
+    blake2b content hash of a file
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fp:
+        while chunk := fp.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Ledger:
+    """
+    Status, row count, byte size, duration and content hash of every (entity, part, table) output.
+    Backed by SQLite in WAL mode so that pool workers can record their parts concurrently and a crash never
+    leaves a half written ledger behind; lookups go through the primary key.
+    Each process opens its own connection, so the ledger can be handed to (forked or spawned) workers.
+    """
+
+    def __init__(self, path: path_type, timeout: float = 60):
+        self.path = Path(path)
+        self.timeout = timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.conn:
+            self.conn.execute(_SCHEMA)
+        return
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():  # sqlite connections don't survive a fork
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._pid = os.getpid()
+        return self._conn
+
+    def __reduce__(self):
+        return self.__class__, (self.path, self.timeout)
+
+    def close(self) -> None:
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        return
+
+    def __enter__(self) -> 'Ledger':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def record(self, entity: str, part: str, table: str, rows: Optional[int] = None, path: Optional[path_type] = None,
+               duration: Optional[float] = None, content_hash: Optional[str] = None, status: str = DONE) -> None:
+        """
+        Mark one output as done (or failed). The byte size is read off path if it exists
+        """
+        self.record_many([dict(entity=entity, part=part, table=table, rows=rows, path=path, duration=duration,
+                               content_hash=content_hash, status=status)])
+
+    def record_many(self, records: Iterable[Dict]) -> None:
+        """
+        Record several outputs in a single transaction, eg: all the tables of one part file
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        values = []
+        for rec in records:
+            path = rec.get('path')
+            nbytes = os.path.getsize(path) if path is not None and os.path.exists(path) else None
+            values.append((rec['entity'], str(rec['part']), rec['table'], rec.get('status', DONE), rec.get('rows'),
+                           nbytes, rec.get('duration'), rec.get('content_hash'),
+                           str(path) if path is not None else None, now))
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO outputs (entity, part, tbl, status, rows, bytes, duration, hash, path, '
+                'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', values
+            )
+        return
+
+    def is_done(self, entity: str, part: str, table: str) -> bool:
+        row = self.conn.execute('SELECT status FROM outputs WHERE entity = ? AND part = ? AND tbl = ?',
+                                (entity, str(part), table)).fetchone()
+        return row is not None and row[0] == DONE
+
+    def get(self, entity: str, part: str, table: str) -> Optional[Dict]:
+        """
+        The record of one output as a dictionary, None if it was never recorded
+        """
+        cursor = self.conn.execute('SELECT * FROM outputs WHERE entity = ? AND part = ? AND tbl = ?',
+                                   (entity, str(part), table))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([col[0] for col in cursor.description], row))
+
+    def done_tables(self, entity: str) -> Dict[str, Set[str]]:
+        """
+        part -> set of finished tables, for every part of entity
+        """
+        parts = {}
+        for part, table in self.conn.execute('SELECT part, tbl FROM outputs WHERE entity = ? AND status = ?',
+                                             (entity, DONE)):
+            parts.setdefault(part, set()).add(table)
+        return parts
+
+    def finished_parts(self, entity: str, tables: Iterable[str]) -> Set[str]:
+        """
+        Parts of entity that have every one of tables done
+        """
+        tables = set(tables)
+        return {part for part, done in self.done_tables(entity).items() if tables <= done}
+
+    def forget(self, entity: str, part: Optional[str] = None, table: Optional[str] = None) -> None:
+        """
+        Drop the records of an entity, optionally only of one part and / or table, so they get recomputed
+        """
+        query, args = 'DELETE FROM outputs WHERE entity = ?', [entity]
+        if part is not None:
+            query, args = query + ' AND part = ?', args + [str(part)]
+        if table is not None:
+            query, args = query + ' AND tbl = ?', args + [table]
+        with self.conn:
+            self.conn.execute(query, args)
+        return
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM outputs').fetchone()[0]
+
+    def has_entity(self, entity: str) -> bool:
+        return self.conn.execute('SELECT 1 FROM outputs WHERE entity = ? LIMIT 1', (entity,)).fetchone() is not None
+
+    def import_finished_works_txt(self, path: path_type, entity: str = 'works') -> int:
+        """
+        One-time import of the old finished_works.txt log (timestamp,path,table,records)
+        """
+        with open(path, newline='') as fp:
+            records = [dict(entity=entity, part=row['path'], table=row['table']) for row in csv.DictReader(fp)]
+        self.record_many(records)
+        return len(records)
+
+    def import_finished_pickle(self, path: path_type, entity: str, table: str) -> int:
+        """
+        One-time import of an old pickled set of finished part files
+        """
+        with open(path, 'rb') as fp:
+            finished_files = pickle.load(fp)
+        self.record_many([dict(entity=entity, part=part, table=table) for part in finished_files])
+        return len(finished_files)
+
+    def __repr__(self) -> str:
+        return f'<Ledger {str(self.path)!r} {len(self):,} outputs>'
@@ -0,0 +1,220 @@
+"""
+Locator index of the rows of a parquet dataset by work id
+A sorted uint64 array of the work ids with, for each, where its rows are: the file (fragment), the row group, the
+offset of the first row in the row group and the number of rows. Both arrays are .npy files that are memory mapped,
+so opening the index costs nothing and pool workers share the pages.
+lookup_many finds the rows of a whole array of ids with binary searches and reads every row group it needs once,
+instead of filtering a file per id like the old ParquetIndices / get_partition_no / get_rows did.
+The index is built incrementally: update indexes the files that are new or changed since the last update (eg: the
+parts that finished flattening) and merges them into the arrays.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.globals import path_type
+
+# where the rows of one run of consecutive rows of the same work id are
+LOCATION_DTYPE = np.dtype([('fragment', '<u4'), ('row_group', '<u4'), ('row', '<u4'), ('count', '<u4')])
+
+
+def _save_npy(array: np.ndarray, path: Path) -> None:
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as fp:
+        np.save(fp, array)
+    os.replace(tmp_path, path)
+    return
+
+
+def index_fragment(path: path_type, fragment: int, key: str = 'work_id'):
+    """
+    (keys, locations) of one parquet file, one entry per run of consecutive rows with the same key in a row group.
+    The rows of a work are written together, so that is one entry per work and row group for most tables
+    """
+    parquet_file = pq.ParquetFile(path)
+    keys, locations = [], []
+    for row_group in range(parquet_file.num_row_groups):
+        ids = parquet_file.read_row_group(row_group, columns=[key]).column(key)
+        valid = ids.is_valid().to_numpy(zero_copy_only=False)
+        ids = ids.fill_null(0).to_numpy().astype(np.uint64)
+        if len(ids) == 0:
+            continue
+        starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+        starts = starts[valid[starts]]  # null keys aren't indexed
+        counts = np.diff(np.append(starts, len(ids)))
+        if not valid.all():  # a run of a key ends at the first null
+            next_null = np.searchsorted(np.flatnonzero(~valid), starts)
+            nulls = np.append(np.flatnonzero(~valid), len(ids))[next_null]
+            counts = np.minimum(counts, nulls - starts)
+
+        location = np.empty(len(starts), dtype=LOCATION_DTYPE)
+        location['fragment'], location['row_group'] = fragment, row_group
+        location['row'], location['count'] = starts, counts
+        keys.append(ids[starts])
+        locations.append(location)
+    if not keys:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=LOCATION_DTYPE)
+    return np.concatenate(keys), np.concatenate(locations)
+
+
+class WorkLocator:
+    """
+    Index of the parquet files under root (eg: <parq_dir>/works or a compacted table) in index_dir:
+    keys.npy (sorted uint64 ids), locations.npy (LOCATION_DTYPE) and fragments.json (the files, by fragment number).
+    A work with rows in several files or row groups has one entry for each.
+    """
+
+    def __init__(self, root: path_type, index_dir: path_type, key: str = 'work_id'):
+        self.root = Path(root)
+        self.index_dir = Path(index_dir)
+        self.key = key
+        self.fragments: List[Dict] = []
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.locations = np.empty(0, dtype=LOCATION_DTYPE)
+        self._files: Dict[int, pq.ParquetFile] = {}
+
+        manifest_path = self.index_dir / 'fragments.json'
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text())
+            assert manifest['key'] == key, f'Index at {str(self.index_dir)!r} is of {manifest["key"]!r}, not {key!r}'
+            self.fragments = manifest['fragments']
+            # asarray drops the np.memmap subclass, like SortedIDSet
+            self.keys = np.asarray(np.load(self.index_dir / 'keys.npy', mmap_mode='r'))
+            self.locations = np.asarray(np.load(self.index_dir / 'locations.npy', mmap_mode='r'))
+        return
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def num_files(self) -> int:
+        return sum(fragment is not None for fragment in self.fragments)
+
+    def __repr__(self) -> str:
+        return f'<WorkLocator {str(self.root)!r} {self.num_files:,} files {len(self):,} entries>'
+
+    @staticmethod
+    def _stat(path: Path) -> Dict:
+        stat = path.stat()
+        return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    def update(self, paths: Optional[Iterable[path_type]] = None) -> int:
+        """
+        Index the files that are new or changed since the last update and drop the ones that are gone.
+        paths: only look at these files (eg: the parts that just finished), all the parquets under root by default
+        Returns the number of files (re)indexed
+        """
+        known = {fragment['path']: i for i, fragment in enumerate(self.fragments) if fragment is not None}
+        if paths is None:
+            paths = sorted(self.root.rglob('*.parquet'))
+            gone = set(known) - {str(path.relative_to(self.root)) for path in paths}
+        else:
+            paths, gone = [Path(path) for path in paths], set()
+
+        drop, new = set(known[name] for name in gone), []
+        for path in paths:
+            name = str(path.relative_to(self.root))
+            stat = self._stat(path)
+            if name in known:
+                if {k: self.fragments[known[name]][k] for k in stat} == stat:
+                    continue
+                drop.add(known[name])  # rewritten, eg: a recomputed table
+            new.append((name, path, stat))
+        if not new and not drop:
+            return 0
+
+        for fragment in drop:  # fragment numbers are never reused, so the old entries can't point to the new files
+            self.fragments[fragment] = None
+        keys, locations = [self.keys], [self.locations]
+        if drop:
+            keep = ~np.isin(self.locations['fragment'], np.fromiter(drop, dtype=np.uint32))
+            keys, locations = [self.keys[keep]], [self.locations[keep]]
+        for name, path, stat in new:
+            fragment_keys, fragment_locations = index_fragment(path, fragment=len(self.fragments), key=self.key)
+            self.fragments.append(dict(path=name, **stat))
+            keys.append(fragment_keys)
+            locations.append(fragment_locations)
+
+        # the old keys are one sorted run, which the stable sort (timsort) merges with the new ones quickly
+        keys, locations = np.concatenate(keys), np.concatenate(locations)
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.locations = keys[order], locations[order]
+        self._save()
+        self._files.clear()
+        return len(new)
+
+    def _save(self) -> None:
+        """
+        Every file is written to a temp file and renamed, the fragments last
+        """
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        _save_npy(self.keys, self.index_dir / 'keys.npy')
+        _save_npy(self.locations, self.index_dir / 'locations.npy')
+        manifest_path = self.index_dir / 'fragments.json'
+        tmp_path = manifest_path.with_name(f'.{manifest_path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps(dict(root=str(self.root), key=self.key, fragments=self.fragments)))
+        os.replace(tmp_path, manifest_path)
+        return
+
+    def locate(self, work_ids):
+        """
+        (positions in work_ids, locations) of every entry of the ids, missing ids have none
+        """
+        work_ids = np.asarray(work_ids, dtype=np.uint64)
+        left, right = np.searchsorted(self.keys, work_ids, side='left'), \
+            np.searchsorted(self.keys, work_ids, side='right')
+        counts = right - left
+        positions = np.repeat(np.arange(len(work_ids)), counts)
+        # index of every entry: the start of its id's range plus its place in the range
+        entries = np.repeat(left - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return positions, self.locations[entries]
+
+    def _parquet_file(self, fragment: int) -> pq.ParquetFile:
+        if fragment not in self._files:
+            self._files[fragment] = pq.ParquetFile(self.root / self.fragments[fragment]['path'])
+        return self._files[fragment]
+
+    def lookup_many(self, work_ids, columns: Optional[Iterable[str]] = None) -> pa.Table:
+        """
+        Rows of the work ids, in the order of work_ids (ids that aren't in the index have no rows).
+        The entries are grouped by file and row group, and each row group needed is read once.
+        columns: columns to read, all of them by default
+        """
+        positions, locations = self.locate(work_ids)
+        if len(locations) == 0:
+            return self._empty_table(columns)
+        columns = list(columns) if columns is not None else None
+
+        # row group of every entry, sorted so that the entries of a row group are next to each other
+        groups = locations['fragment'].astype(np.uint64) << np.uint64(32) | locations['row_group']
+        order = np.argsort(groups, kind='stable')
+        groups, locations, positions = groups[order], locations[order], positions[order]
+        bounds = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1], [True]]))
+
+        tables, row_positions = [], []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            group = locations[start: end]
+            table = self._parquet_file(int(group['fragment'][0])).read_row_group(int(group['row_group'][0]),
+                                                                                   columns=columns)
+            counts = group['count'].astype(np.int64)
+            # row numbers of the runs: the first row of each run repeated, plus 0, 1, .. inside the run
+            rows = np.repeat(group['row'].astype(np.int64) - np.cumsum(counts) + counts, counts) + \
+                np.arange(counts.sum())
+            tables.append(table.take(pa.array(rows)).replace_schema_metadata(None))
+            row_positions.append(np.repeat(positions[start: end], counts))
+
+        table = pa.concat_tables(tables, promote_options='permissive')
+        return table.take(pa.array(np.argsort(np.concatenate(row_positions), kind='stable')))
+
+    def _empty_table(self, columns: Optional[Iterable[str]]) -> pa.Table:
+        if not self.fragments or all(fragment is None for fragment in self.fragments):
+            return pa.table({})
+        fragment = next(i for i, fragment in enumerate(self.fragments) if fragment is not None)
+        schema = self._parquet_file(fragment).schema_arrow.remove_metadata()
+        table = schema.empty_table()
+        return table.select(list(columns)) if columns is not None else table
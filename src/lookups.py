@@ -0,0 +1,184 @@
+"""
+Compiled lookup tables of the institutions and topics, used to fill in the names of the authorships and topics tables
+The CSV is read once and compiled to an Arrow IPC file next to it: the ids sorted, the names dictionary encoded.
+Loading memory maps the file, so pool workers share the pages, and lookups are batched binary searches that hand
+back dictionary arrays built straight from the codes.
+"""
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.ipc as ipc
+
+from src.globals import path_type
+from src.writers import csv_path
+
+INSTITUTION_COLUMNS = ['institution_name', 'country_code']
+TOPIC_COLUMNS = ['topic_name', 'subfield_id', 'subfield_name', 'field_id', 'field_name', 'domain_id', 'domain_name']
+
+
+class CompiledLookup:
+    """
+    key -> columns table with the keys sorted and the string columns dictionary encoded.
+    take(column, keys) looks a whole array of keys up at once, missing keys give nulls
+    """
+
+    def __init__(self, table: pa.Table, key: str):
+        self.table = table
+        self.key = key
+        self.keys = table.column(key).to_numpy()
+        self._columns: Dict[str, pa.Array] = {name: table.column(name).combine_chunks() for name in table.column_names}
+        return
+
+    @classmethod
+    def from_table(cls, table: pa.Table, key: str, columns: Iterable[str]) -> 'CompiledLookup':
+        """
+        Compile a table: drop the rows without a key, keep the first row of repeated keys, sort by key and
+        dictionary encode the string columns
+        """
+        columns = list(columns)
+        table = table.select([key] + columns).filter(pc.is_valid(table.column(key)))
+        table = table.set_column(0, key, table.column(key).cast(pa.int64()))
+        _, first = np.unique(table.column(key).to_numpy(), return_index=True)  # sorted unique keys
+        table = table.take(pa.array(first))
+
+        arrays = [table.column(key).combine_chunks()]
+        for name in columns:
+            array = table.column(name).combine_chunks()
+            if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+                array = array.dictionary_encode()
+            arrays.append(array)
+        return cls(pa.Table.from_arrays(arrays, names=[key] + columns), key=key)
+
+    @classmethod
+    def from_csv(cls, path: path_type, key: str, columns: Iterable[str]) -> 'CompiledLookup':
+        columns = list(columns)
+        table = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(
+            include_columns=[key] + columns, strings_can_be_null=True))
+        return cls.from_table(table, key=key, columns=columns)
+
+    @classmethod
+    def from_dicts(cls, info_d: Dict[str, Dict], key: str) -> 'CompiledLookup':
+        """
+        From the old column -> {id -> value} dictionaries, eg: inst_info_d
+        """
+        keys = sorted({id_ for values in info_d.values() for id_ in values})
+        table = pa.table({key: pa.array(keys, type=pa.int64()),
+                          **{name: pa.array([values.get(id_) for id_ in keys], from_pandas=True)
+                             for name, values in info_d.items()}})
+        return cls.from_table(table, key=key, columns=list(info_d))
+
+    def save(self, path: path_type) -> None:
+        """
+        Uncompressed Arrow IPC file, so that load can memory map it. Written to a temp file and renamed
+        """
+        path = Path(path)
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        with ipc.new_file(tmp_path, self.table.schema) as writer:
+            writer.write_table(self.table)
+        tmp_path.replace(path)
+        return
+
+    @classmethod
+    def load(cls, path: path_type) -> 'CompiledLookup':
+        with pa.memory_map(str(path)) as source:
+            table = ipc.open_file(source).read_all()
+        return cls(table, key=table.schema.names[0])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __repr__(self) -> str:
+        return f'<CompiledLookup {self.key!r} -> {self.table.column_names[1:]} {len(self):,} keys>'
+
+    def positions(self, keys) -> np.ndarray:
+        """
+        Row of every key, -1 for the missing (and null) keys
+        """
+        if isinstance(keys, (pa.Array, pa.ChunkedArray)):
+            keys = keys.cast(pa.int64()).fill_null(-1).to_numpy()
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, pos, -1)
+
+    def take(self, column: str, keys=None, positions: Optional[np.ndarray] = None,
+             type_: Optional[pa.DataType] = None) -> pa.Array:
+        """
+        Values of column for an array of keys (or of positions from self.positions), nulls where not found.
+        Dictionary columns come back as dictionary arrays holding only the values used.
+        type_: cast the result, eg: to the index type of the output schema
+        """
+        if positions is None:
+            positions = self.positions(keys)
+        found = positions >= 0
+        values = self._columns[column]
+
+        if len(values) == 0:  # nothing to take from, eg: a header only lookup CSV
+            result = pa.nulls(len(positions), type=values.type)
+        elif pa.types.is_dictionary(values.type):
+            codes = values.indices.fill_null(-1).to_numpy()[np.where(found, positions, 0)]
+            found &= codes >= 0  # null names
+            used, indices = np.unique(codes[found], return_inverse=True)
+            all_indices = np.zeros(len(positions), dtype=np.int32)
+            all_indices[found] = indices
+            result = pa.DictionaryArray.from_arrays(pa.array(all_indices, mask=~found),
+                                                    values.dictionary.take(pa.array(used, type=pa.int64())))
+        else:
+            result = values.take(pa.array(np.where(found, positions, 0)))
+            result = pc.if_else(pa.array(found), result, pa.nulls(len(result), type=result.type))
+        return result.cast(type_) if type_ is not None else result
+
+    def get(self, column: str, key, default=None):
+        """
+        Single key lookup, like the old dictionaries
+        """
+        pos = self.positions([key if key is not None else -1])[0]
+        if pos < 0:
+            return default
+        return self._columns[column][int(pos)].as_py()
+
+
+def lookup_columns(lookup: Optional[CompiledLookup], key: str,
+                   columns: Iterable[str]) -> Dict[str, Callable[[pa.Table], pa.Array]]:
+    """
+    Derived columns of a TableBuilder: each column looked up from the key column of the built table.
+    All null if there is no lookup
+    """
+    def derive(column: str) -> Callable[[pa.Table], pa.Array]:
+        def _derive(table: pa.Table) -> pa.Array:
+            if lookup is None:
+                return pa.nulls(table.num_rows)
+            return lookup.take(column, keys=table.column(key))
+        return _derive
+
+    return {column: derive(column) for column in columns}
+
+
+def load_lookup(csv_path: path_type, key: str, columns: Iterable[str]) -> Optional[CompiledLookup]:
+    """
+    Load the compiled lookup of a CSV, compiling it first if it is missing or older than the CSV.
+    None if the CSV doesn't exist either
+    """
+    csv_path = Path(csv_path)
+    compiled_path = csv_path.with_name(csv_path.name.split('.')[0] + '_lookup.arrow')
+    if not csv_path.exists():
+        return CompiledLookup.load(compiled_path) if compiled_path.exists() else None
+
+    if not compiled_path.exists() or compiled_path.stat().st_mtime < csv_path.stat().st_mtime:
+        CompiledLookup.from_csv(csv_path, key=key, columns=columns).save(compiled_path)
+    return CompiledLookup.load(compiled_path)
+
+
+def load_institution_lookup(csv_dir: path_type, compression: str = 'gzip') -> Optional[CompiledLookup]:
+    return load_lookup(csv_path(Path(csv_dir) / 'institutions.csv.gz', compression), key='institution_id',
+                       columns=INSTITUTION_COLUMNS)
+
+
+def load_topic_lookup(csv_dir: path_type, compression: str = 'gzip') -> Optional[CompiledLookup]:
+    return load_lookup(csv_path(Path(csv_dir) / 'topics.csv.gz', compression), key='topic_id',
+                       columns=TOPIC_COLUMNS)
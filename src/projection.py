@@ -0,0 +1,109 @@
+"""
+Projection-aware decoding of the works JSON lines
+A work is a deeply nested object, and most of it (abstract_inverted_index, authorships, locations, counts_by_year..)
+is thrown away when only some of the tables are (re)built. With msgspec installed, a work line is decoded into a
+struct holding only the top level keys the missing tables read; the other values are skipped over by the parser
+without creating any Python objects. Without msgspec, lines are parsed in full with orjson.
+"""
+from typing import Any, Dict, Iterable, Optional
+
+import orjson
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# top level keys of a work read by the extractor of each of the works tables of process_work_json_v2
+WORKS_TABLE_KEYS = {
+    'works': {'doi', 'title', 'publication_year', 'publication_date', 'type', 'type_crossref', 'cited_by_count',
+              'language', 'is_retracted', 'is_paratext', 'created_date', 'locations_count'},
+    'ids': {'ids', 'doi'},
+    'primary_location': {'primary_location', 'publication_year'},
+    'locations': {'locations', 'publication_year'},
+    'authorships': {'authorships', 'publication_year'},
+    'biblio': {'biblio'},
+    'concepts': {'concepts', 'publication_year'},
+    'mesh': {'mesh'},
+    'referenced_works': {'referenced_works'},
+    'related_works': {'related_works'},
+    'abstracts': {'abstract_inverted_index', 'title', 'publication_year'},
+    'grants': {'grants', 'publication_year'},
+    'open_access': {'open_access'},
+    'best_oa_location': {'best_oa_location'},
+    'keywords': {'keywords', 'publication_year'},
+    'topics': {'topics', 'publication_year'},
+    'indexed_in': {'indexed_in', 'publication_year'},
+}
+
+# derived columns of a table computed by the extractor of another table, they make it run even if its table is done
+WORKS_TABLE_DEPENDENCIES = {
+    'works': {'authorships': ('num_authors', 'has_complete_institution_info'),
+              'referenced_works': ('num_references',),
+              'locations': ('num_locations',),
+              'keywords': ('has_keywords',),
+              'grants': ('has_grant_info',)},
+}
+
+
+def get_works_keys(tables: Iterable[str]) -> frozenset:
+    """
+    Top level keys needed to build the given works tables, always including the work id
+    """
+    keys = {'id'}
+    for table in tables:
+        keys |= WORKS_TABLE_KEYS[table]
+    return frozenset(keys)
+
+
+class WorksPlan:
+    """
+    What process_work_json_v2 has to do for a set of tables to write: the extractors to run, which includes the ones
+    feeding the derived columns of those tables, and the top level keys to decode.
+    Rebuilding eg: keywords only decodes and walks the keywords of every work
+    """
+
+    def __init__(self, tables: Iterable[str]):
+        self.tables = frozenset(tables)
+        self.extractors = self.tables.union(*(WORKS_TABLE_DEPENDENCIES.get(table, {}) for table in self.tables))
+        self.keys = get_works_keys(self.extractors)
+        return
+
+    def writes(self, table: str) -> bool:
+        return table in self.tables
+
+    def runs(self, extractor: str) -> bool:
+        return extractor in self.extractors
+
+    def __repr__(self) -> str:
+        return f'<WorksPlan tables={sorted(self.tables)} extractors={sorted(self.extractors)} keys={len(self.keys)}>'
+
+
+class ProjectionDecoder:
+    """
+    Callable decoding one JSON line into a dictionary of only the given top level keys (the keys absent from the
+    line stay absent). keys=None decodes everything.
+    backend is 'msgspec' if the projection is done while parsing, 'orjson' for a full parse
+    """
+
+    def __init__(self, keys: Optional[Iterable[str]] = None):
+        self.keys = frozenset(keys) if keys is not None else None
+        if self.keys is not None and msgspec is not None:
+            self.backend = 'msgspec'
+            struct = msgspec.defstruct('Projection', [(key, Any, msgspec.UNSET) for key in sorted(self.keys)])
+            self._fields = struct.__struct_fields__
+            self._decoder = msgspec.json.Decoder(type=struct)
+        else:
+            self.backend = 'orjson'
+        return
+
+    def __call__(self, line: bytes) -> Dict:
+        if self.backend == 'orjson':
+            return orjson.loads(line)
+
+        obj = self._decoder.decode(line)
+        return {field: value for field in self._fields if (value := getattr(obj, field)) is not msgspec.UNSET}
+
+    def __repr__(self) -> str:
+        keys = 'all' if self.keys is None else len(self.keys)
+        return f'<ProjectionDecoder {self.backend} keys={keys}>'
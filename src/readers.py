@@ -0,0 +1,121 @@
+"""
+Pipelined readers for the gzipped JSON lines part files of the snapshot
+Inflating is a sizeable share of every flatten, so a reader thread decompresses the part file into a bounded queue
+of line batches while the caller parses the previous batch. The inflate calls of zlib (and of isal / zlib-ng, used
+when they are installed) release the GIL, so the two stages overlap even on a single thread of python.
+"""
+import gzip
+import queue
+import threading
+from typing import Iterator, List, Optional
+
+from src.globals import path_type
+
+try:  # Intel ISA-L, several times faster than zlib
+    from isal import igzip as _gzip_module
+except ImportError:
+    try:
+        from zlib_ng import gzip_ng as _gzip_module
+    except ImportError:
+        _gzip_module = gzip
+
+GZIP_BACKEND = _gzip_module.__name__
+
+_END = object()
+
+
+def open_gzip(path: path_type, mode: str = 'rb'):
+    """
+    gzip.open with the fastest available backend: isal, zlib-ng or the standard library
+    """
+    return _gzip_module.open(path, mode)
+
+
+class JSONLReader:
+    """
+    Iterate over the lines of a gzipped JSON lines file, decompressed on a background thread.
+    The reader thread inflates chunk_size bytes at a time, cuts them into lines and puts the batches
+    in a queue holding at most max_batches of them, so memory stays bounded when parsing is the slower stage.
+    Drop-in replacement of gzip.open(path, 'r') for reading: use as a context manager, iterate over the lines
+    (bytes) or the batches, or call readlines().
+    """
+
+    def __init__(self, path: path_type, chunk_size: int = 1 << 22, max_batches: int = 8):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        return
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read(self) -> None:
+        try:
+            with open_gzip(self.path) as fp:
+                remainder = b''
+                while chunk := fp.read(self.chunk_size):
+                    lines = (remainder + chunk).split(b'\n')
+                    remainder = lines.pop()
+                    if lines and not self._put(lines):
+                        return
+                if remainder:
+                    self._put([remainder])
+        except BaseException as e:  # re-raised by the consumer
+            self._put(e)
+        self._put(_END)
+        return
+
+    def start(self) -> 'JSONLReader':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._read, name=f'JSONLReader({self.path})', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self) -> None:
+        """
+        Stop the reader thread, also when the lines were not all consumed
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return
+
+    def __enter__(self) -> 'JSONLReader':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def batches(self) -> Iterator[List[bytes]]:
+        """
+        Batches of lines, without the line endings
+        """
+        self.start()
+        while (batch := self._queue.get()) is not _END:
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+        return
+
+    def __iter__(self) -> Iterator[bytes]:
+        for batch in self.batches():
+            yield from batch
+
+    def readlines(self) -> List[bytes]:
+        return [line for batch in self.batches() for line in batch]
+
+
+def read_jsonl_lines(path: path_type, **reader_args) -> Iterator[bytes]:
+    """
+    Generator over the lines of a gzipped JSON lines file, see JSONLReader
+    """
+    with JSONLReader(path, **reader_args) as reader:
+        yield from reader
@@ -0,0 +1,132 @@
+"""
+Single pass scans of the JSON lines parts of an entity (authors, institutions, sources, concepts, topics, ...)
+Every table of an entity is registered on an EntityScan with an extractor function. A part is inflated and parsed
+once, a batch of lines at a time, and each batch is handed to all the extractors, each emitting rows to its own
+writer. Adding a table to a flatten is then a new extractor and not another pass over the snapshot.
+"""
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+import orjson
+import pyarrow as pa
+
+from src.columnar import TableBuilder
+from src.id_sets import SortedIDSet
+from src.readers import JSONLReader
+from src.utils import convert_openalex_ids_to_int
+
+
+class ScanBatch(NamedTuple):
+    """
+    Parsed records of a batch of lines that are kept (valid id, not skipped), with their integer ids
+    """
+    records: List[Dict]
+    ids: List[int]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+class TableExtractor(NamedTuple):
+    schema: pa.Schema
+    extract: Callable[[ScanBatch, object], None]  # (batch, writer) -> None, appends the rows of the batch
+    transforms: Optional[Dict[str, Callable[[list], pa.Array]]] = None  # see TableBuilder
+
+
+class EntityScan:
+    """
+    Tables extracted from the parts of one entity in a single pass.
+    register adds a table: its Arrow schema and extract(batch, writer), which appends the rows of a ScanBatch to the
+    writer (a TableBuilder or a ParquetPartWriter around one) with append_values / append / append_table.
+    scan_part streams one part through the extractors of the chosen tables.
+    """
+
+    def __init__(self, entity: str, skip_ids: Optional[SortedIDSet] = None,
+                 convert_ids: Callable = convert_openalex_ids_to_int, dedupe_ids: bool = False):
+        """
+        skip_ids: merged and deleted ids, records with these ids are dropped
+        convert_ids: batch converter of the OpenAlex ids of the records, returning (ids, valid)
+        dedupe_ids: drop the records whose id was already seen by this scan, in this process
+        """
+        self.entity = entity
+        self.skip_ids = skip_ids
+        self.convert_ids = convert_ids
+        self.dedupe_ids = dedupe_ids
+        self.extractors: Dict[str, TableExtractor] = {}
+        self._seen_ids: set = set()
+        return
+
+    def register(self, table: str, schema: pa.Schema, extract: Callable[[ScanBatch, object], None],
+                 transforms: Optional[Dict[str, Callable[[list], pa.Array]]] = None) -> 'EntityScan':
+        self.extractors[table] = TableExtractor(schema=schema, extract=extract, transforms=transforms)
+        return self
+
+    @property
+    def tables(self) -> List[str]:
+        return list(self.extractors)
+
+    def __repr__(self) -> str:
+        return f'<EntityScan {self.entity!r} tables={self.tables}>'
+
+    def get_buffer(self, table: str) -> TableBuilder:
+        extractor = self.extractors[table]
+        return TableBuilder(schema=extractor.schema, transforms=extractor.transforms)
+
+    def decode(self, lines: Iterable[bytes]) -> ScanBatch:
+        """
+        Parse a batch of lines and drop the records without a valid id, with a skipped id or (if dedupe_ids)
+        with an id seen before
+        """
+        records = [orjson.loads(line) for line in lines if line.strip()]
+        ids, keep = self.convert_ids([record.get('id') for record in records])
+        if self.skip_ids is not None:
+            keep &= ~self.skip_ids.contains_many(ids)
+        records, ids = [records[i] for i in np.flatnonzero(keep)], ids[keep].tolist()
+
+        if self.dedupe_ids:
+            kept = []
+            for i, id_ in enumerate(ids):
+                if id_ not in self._seen_ids:
+                    self._seen_ids.add(id_)
+                    kept.append(i)
+            if len(kept) < len(ids):
+                records, ids = [records[i] for i in kept], [ids[i] for i in kept]
+        return ScanBatch(records=records, ids=ids)
+
+    def scan_part(self, jsonl_filename, writers: Dict[str, object]) -> int:
+        """
+        Inflate and parse the part once, and feed every batch to the extractors of the tables in writers.
+        Writers with a maybe_flush (ParquetPartWriter) get the chance to flush a row group between batches.
+        Returns the number of records kept
+        """
+        extractors = [(self.extractors[table].extract, writer) for table, writer in writers.items()]
+        flushers = [writer.maybe_flush for writer in writers.values() if hasattr(writer, 'maybe_flush')]
+        num_records = 0
+        with JSONLReader(jsonl_filename) as reader:
+            for lines in reader.batches():
+                batch = self.decode(lines)
+                num_records += len(batch)
+                for extract, writer in extractors:
+                    extract(batch, writer)
+                for maybe_flush in flushers:  # between batches, the rows of a record are never split
+                    maybe_flush()
+        return num_records
+
+    def flatten_part(self, jsonl_filename, make_writer: Callable[[str, TableBuilder], object],
+                     tables: Optional[Iterable[str]] = None) -> int:
+        """
+        scan_part into new writers, made by make_writer(table, buffer) from the TableBuilder of each table, and
+        close them. On an error the writers are aborted so that no half written files are left behind
+        tables: the tables to extract, all of them by default
+        Returns the number of records kept
+        """
+        writers = {table: make_writer(table, self.get_buffer(table)) for table in (tables or self.tables)}
+        try:
+            num_records = self.scan_part(jsonl_filename, writers)
+        except BaseException:
+            for writer in writers.values():
+                writer.abort()
+            raise
+        for writer in writers.values():
+            writer.close()
+        return num_records
@@ -0,0 +1,211 @@
+"""
+Arrow schemas for the flattened parquet tables
+Columns follow the order of the csv_files specs in preprocessing/flatten_openalex_files.py
+"""
+import pyarrow as pa
+
+
+def _category(index_type=pa.int32()):
+    return pa.dictionary(index_type, pa.utf8())
+
+
+_location_fields = [
+    ('work_id', pa.int64()),
+    ('publication_year', pa.int16()),
+    ('source_id', pa.int64()),
+    ('source_name', pa.utf8()),
+    ('source_type', _category(pa.int8())),
+    ('version', pa.utf8()),
+    ('license', pa.utf8()),
+    ('landing_page_url', pa.utf8()),
+    ('pdf_url', pa.utf8()),
+    ('is_oa', pa.bool_()),
+    ('is_accepted', pa.bool_()),
+    ('is_published', pa.bool_()),
+]
+
+WORKS_SCHEMAS = {
+    'works': pa.schema([
+        ('work_id', pa.int64()),
+        ('doi', pa.utf8()),
+        ('title', pa.utf8()),
+        ('publication_year', pa.int16()),
+        ('publication_date', pa.timestamp('ms')),
+        ('type', _category(pa.int8())),
+        ('type_crossref', _category(pa.int8())),
+        ('cited_by_count', pa.uint32()),
+        ('num_authors', pa.uint16()),
+        ('num_locations', pa.uint16()),
+        ('num_references', pa.uint16()),
+        ('language', _category(pa.int8())),
+        ('has_complete_institution_info', pa.bool_()),
+        ('has_grant_info', pa.bool_()),
+        ('has_keywords', pa.bool_()),
+        ('is_retracted', pa.bool_()),
+        ('is_paratext', pa.bool_()),
+        ('created_date', pa.timestamp('ns')),
+        ('gz_path', _category(pa.int16())),
+        # ('updated_date', pa.timestamp('ns')),
+    ]),
+    'indexed_in': pa.schema([
+        ('work_id', pa.int64()),
+        ('publication_year', pa.int16()),
+        ('indexed_source', _category(pa.int8())),
+    ]),
+    'topics': pa.schema([
+        ('work_id', pa.int64()),
+        ('publication_year', pa.int16()),
+        ('is_primary_topic', pa.bool_()),
+        ('score', pa.float32()),
+        ('topic_id', pa.uint32()),
+        ('topic_name', _category(pa.int16())),
+        ('subfield_id', pa.uint32()),
+        ('subfield_name', _category(pa.int16())),
+        ('field_id', pa.uint32()),
+        ('field_name', _category(pa.int16())),
+        ('domain_id', pa.uint32()),
+        ('domain_name', _category(pa.int8())),
+    ]),
+    'keywords': pa.schema([
+        ('work_id', pa.int64()),
+        ('publication_year', pa.int16()),
+        ('keyword', _category()),
+        ('score', pa.float32()),
+    ]),
+    'grants': pa.schema([
+        ('work_id', pa.int64()),
+        ('publication_year', pa.int16()),
+        ('funder_id', pa.int64()),
+        ('funder_name', pa.utf8()),
+        ('award_id', pa.utf8()),
+    ]),
+    'abstracts': pa.schema([
+        ('work_id', pa.int64()),
+        ('title', pa.utf8()),
+        ('publication_year', pa.int16()),
+        ('abstract', pa.utf8()),
+    ]),
+    'primary_location': pa.schema(_location_fields),
+    'locations': pa.schema(_location_fields),
+    'authorships': pa.schema([
+        ('work_id', pa.int64()),
+        ('author_position', _category(pa.int8())),
+        ('author_id', pa.int64()),
+        ('author_name', pa.utf8()),
+        ('raw_author_name', pa.utf8()),
+        ('institution_lineage_level', pa.int8()),
+        ('assigned_institution', pa.bool_()),
+        ('institution_id', pa.int64()),
+        ('institution_name', _category()),
+        ('country_code', _category(pa.int16())),
+        ('raw_affiliation_string', pa.utf8()),
+        ('publication_year', pa.int16()),
+        ('is_corresponding', pa.bool_()),
+    ]),
+    'biblio': pa.schema([
+        ('work_id', pa.int64()),
+        ('volume', pa.utf8()),
+        ('issue', pa.utf8()),
+        ('first_page', pa.utf8()),
+        ('last_page', pa.utf8()),
+    ]),
+    'concepts': pa.schema([
+        ('work_id', pa.int64()),
+        ('publication_year', pa.int16()),
+        ('score', pa.float32()),
+        ('concept_id', pa.int64()),
+        ('concept_name', _category()),
+        ('level', pa.int8()),
+    ]),
+    'ids': pa.schema([
+        ('work_id', pa.int64()),
+        ('openalex', pa.utf8()),
+        ('doi', pa.utf8()),
+        ('mag', pa.int64()),
+        ('pmid', pa.utf8()),
+        ('pmcid', pa.utf8()),
+    ]),
+    'mesh': pa.schema([
+        ('work_id', pa.int64()),
+        ('descriptor_ui', pa.utf8()),
+        ('descriptor_name', pa.utf8()),
+        ('qualifier_ui', pa.utf8()),
+        ('qualifier_name', pa.utf8()),
+        ('is_major_topic', pa.utf8()),
+    ]),
+    'open_access': pa.schema([
+        ('work_id', pa.int64()),
+        ('is_oa', pa.bool_()),
+        ('oa_status', _category(pa.int8())),
+        ('oa_url', pa.utf8()),
+        ('any_repository_has_fulltext', pa.bool_()),
+    ]),
+    'best_oa_location': pa.schema([
+        ('work_id', pa.int64()),
+        ('pdf_url', pa.utf8()),
+        ('is_oa', pa.bool_()),
+        ('is_accepted', pa.bool_()),
+        ('is_published', pa.bool_()),
+        ('source_id', pa.int64()),
+        ('source_name', pa.utf8()),
+        ('source_type', _category(pa.int8())),
+    ]),
+    'referenced_works': pa.schema([
+        ('work_id', pa.int64()),
+        ('referenced_work_id', pa.int64()),
+    ]),
+    'related_works': pa.schema([
+        ('work_id', pa.int64()),
+        ('related_work_id', pa.int64()),
+    ]),
+}
+
+_authors_concepts_schema = pa.schema([
+    ('author_id', pa.int64()),
+    ('author_name', pa.utf8()),
+    ('works_count', pa.uint32()),
+    ('cited_by_count', pa.uint32()),
+    ('concept_id', pa.int64()),
+    ('concept_name', _category()),
+    ('level', pa.int8()),
+    ('score', pa.float32()),
+])
+
+AUTHORS_SCHEMAS = {
+    'authors': pa.schema([
+        ('author_id', pa.int64()),
+        ('orcid', pa.utf8()),
+        ('author_name', pa.utf8()),
+        ('display_name_alternatives', pa.utf8()),  # JSON list
+        ('works_count', pa.uint32()),
+        ('cited_by_count', pa.uint32()),
+        ('last_known_institution', pa.int64()),
+        ('updated_date', pa.timestamp('ns')),
+    ]),
+    'ids': pa.schema([
+        ('author_id', pa.int64()),
+        ('author_name', pa.utf8()),
+        ('openalex', pa.utf8()),
+        ('orcid', pa.utf8()),
+        ('scopus', pa.utf8()),
+        ('twitter', pa.utf8()),
+        ('wikipedia', pa.utf8()),
+        ('mag', pa.int64()),
+    ]),
+    'counts_by_year': pa.schema([
+        ('author_id', pa.int64()),
+        ('author_name', pa.utf8()),
+        ('year', pa.int16()),
+        ('works_count', pa.uint32()),
+        ('cited_by_count', pa.uint32()),
+    ]),
+    'concepts': _authors_concepts_schema,
+    'concepts_zero': _authors_concepts_schema,  # level 0 concepts
+    'hints': pa.schema([
+        ('author_id', pa.int64()),
+        ('author_name', pa.utf8()),
+        ('works_count', pa.uint32()),
+        ('cited_by_count', pa.uint32()),
+        ('most_cited_work', pa.utf8()),
+    ]),
+}
@@ -0,0 +1,183 @@
+"""
+Semi-joins of works tables against a selected set of works, for slicing the dataset (preprocessing/filter_dataset.py)
+The selected work ids are kept as a sorted uint64 array (a SortedIDSet, memory mapped so pool workers share it)
+instead of a Python set, plus a packed bitmap over the id range of the selection (or over the dense ids, for tables
+written in dense ids, see src/dense_ids.py), so that checking a row is one byte read instead of a binary search or
+a hash of a Python int. The rows are filtered with it one record batch at a time.
+Edge tables (works_referenced_works) are checked at both ends in the same pass, and row groups whose work id
+range holds no selected work are skipped from the footer statistics without being read.
+"""
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.dense_ids import DenseIDMap
+from src.globals import path_type
+from src.id_sets import SortedIDSet
+
+BATCH_ROWS = 1_000_000  # rows read and filtered at a time
+BITMAP_BYTES = 1 << 30  # largest bitmap over the work id range, 8.6B ids, binary searches of the sorted ids above it
+
+# the columns checked against the selected works, the work id alone for the other tables
+KEY_COLUMNS = {
+    'referenced_works': ['work_id', 'referenced_work_id'],
+    'referenced_works_dense': ['work_id', 'referenced_work_id'],
+    'related_works': ['work_id', 'related_work_id'],
+}
+
+
+class IDBitmap:
+    """
+    Packed bitmap of sorted, unique ids in [offset, offset + 8 * len(bits))
+    """
+
+    def __init__(self, ids: np.ndarray, offset: int, size: int):
+        self.offset = offset
+        self.bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+        if len(ids) > 0:
+            ids = np.asarray(ids, dtype=np.uint64) - np.uint64(offset)
+            byte, bit = (ids >> np.uint64(3)).astype(np.int64), (ids & np.uint64(7)).astype(np.uint8)
+            # the ids are sorted, so the ids of a byte are next to each other and or-ed together in one go
+            starts = np.flatnonzero(np.concatenate([[True], byte[1:] != byte[:-1]]))
+            self.bits[byte[starts]] = np.bitwise_or.reduceat(np.left_shift(1, bit, dtype=np.uint8), starts)
+        return
+
+    @property
+    def size(self) -> int:
+        return len(self.bits) * 8
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Boolean mask of the ids in the bitmap, ids outside its range aren't
+        """
+        ids = ids.astype(np.int64, copy=False) - self.offset
+        in_range = ids.view(np.uint64) < np.uint64(self.size)  # ids below the offset wrap around to huge values
+        found = self.bits.take(ids >> 3, mode='clip') & np.left_shift(1, (ids & 7).astype(np.uint8), dtype=np.uint8)
+        return in_range & found.astype(bool)
+
+    def any(self, low: int, high: int) -> bool:
+        """
+        Whether an id in [low, high] is in the bitmap
+        """
+        low, high = max(int(low) - self.offset, 0), min(int(high) - self.offset, self.size - 1)
+        if low > high:
+            return False
+        first, last = low >> 3, high >> 3
+        first_mask, last_mask = (0xFF << (low & 7)) & 0xFF, 0xFF >> (7 - (high & 7))
+        if first == last:
+            return bool(self.bits[first] & first_mask & last_mask)
+        return bool(self.bits[first] & first_mask) or bool(self.bits[last] & last_mask) or \
+            bool(self.bits[first + 1: last].any())
+
+
+class WorkSet:
+    """
+    Selected works: a SortedIDSet of work ids with a bitmap over their range if it fits in bitmap_bytes, and a bitmap
+    over the dense work ids if dense_ids is given
+    """
+
+    def __init__(self, work_ids: SortedIDSet, dense_ids: Optional[DenseIDMap] = None,
+                 bitmap_bytes: int = BITMAP_BYTES):
+        self.work_ids = work_ids
+        self.bitmap, self.dense_bitmap = None, None
+        ids = work_ids.ids
+        if len(ids) > 0 and (int(ids[-1]) - int(ids[0])) // 8 < bitmap_bytes:
+            self.bitmap = IDBitmap(ids, offset=int(ids[0]), size=int(ids[-1]) - int(ids[0]) + 1)
+        if dense_ids is not None:
+            dense, found = dense_ids.to_dense(ids)
+            self.dense_bitmap = IDBitmap(dense[found], offset=0, size=len(dense_ids))
+        return
+
+    def __len__(self) -> int:
+        return len(self.work_ids)
+
+    def __repr__(self) -> str:
+        bitmaps = [name for name, bitmap in [('bitmap', self.bitmap), ('dense bitmap', self.dense_bitmap)] if bitmap]
+        return f'<WorkSet {len(self):,} works{" with a " + " and ".join(bitmaps) if bitmaps else ""}>'
+
+    def contains(self, ids) -> np.ndarray:
+        """
+        Boolean mask of the ids (an Arrow or numpy array of work ids, or of dense ids if uint32) that are selected.
+        Nulls are never selected
+        """
+        if isinstance(ids, (pa.Array, pa.ChunkedArray)):
+            if ids.type == pa.uint32():
+                ids = ids.fill_null(np.iinfo(np.uint32).max).to_numpy()  # past the dense ids
+            else:
+                ids = ids.cast(pa.int64()).fill_null(-1).to_numpy()  # -1 is no work id
+        ids = np.asarray(ids)
+        if ids.dtype == np.uint32:
+            assert self.dense_bitmap is not None, 'dense ids need the WorkSet built with the DenseIDMap'
+            return self.dense_bitmap.contains(ids)
+        if self.bitmap is not None:
+            return self.bitmap.contains(ids)
+        if len(ids) == 0:
+            return np.zeros(0, dtype=bool)
+        # the rows of a work are next to each other in the works tables, so only the first row of a run is searched
+        starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+        return np.repeat(self.work_ids.contains_many(ids[starts]), np.diff(np.append(starts, len(ids))))
+
+    def may_contain(self, low, high, dense: bool = False) -> bool:
+        """
+        Whether a selected work id (or dense id) lies in [low, high], for skipping row groups from their statistics
+        """
+        if dense:
+            assert self.dense_bitmap is not None, 'dense ids need the WorkSet built with the DenseIDMap'
+            return self.dense_bitmap.any(low, high)
+        ids = self.work_ids.ids
+        return bool(ids.searchsorted(np.uint64(low)) < ids.searchsorted(np.uint64(high), side='right'))
+
+    def filter_batch(self, batch: pa.RecordBatch, key_columns: Iterable[str]) -> pa.RecordBatch:
+        """
+        Rows of the batch with every key column selected, the later columns are only checked in the rows kept
+        """
+        for column in key_columns:
+            batch = batch.filter(pa.array(self.contains(batch.column(column))))
+        return batch
+
+
+def _row_group_range(metadata: pq.FileMetaData, row_group: int, column: str):
+    """
+    (min, max) of a column in a row group from the footer, None without statistics
+    """
+    row_group = metadata.row_group(row_group)
+    for i in range(row_group.num_columns):
+        chunk = row_group.column(i)
+        if chunk.path_in_schema == column:
+            stats = chunk.statistics
+            if stats is not None and stats.has_min_max:
+                return stats.min, stats.max
+            return None
+    return None
+
+
+def semi_join_parquet(path: path_type, work_set: WorkSet, key_columns: Iterable[str] = ('work_id',),
+                      columns: Optional[Iterable[str]] = None, batch_rows: int = BATCH_ROWS) -> pa.Table:
+    """
+    Rows of a parquet file whose key columns are all selected works, read a record batch at a time.
+    Row groups whose first key column range has no selected work are skipped unread
+    columns: columns to read, all of them by default (the key columns are always read)
+    Returns the kept rows, with the schema of the file
+    """
+    parquet_file = pq.ParquetFile(Path(path))
+    key_columns = list(key_columns)
+    schema = parquet_file.schema_arrow
+    if columns is not None:
+        columns = list(columns) + [column for column in key_columns if column not in columns]
+        schema = pa.schema([schema.field(column) for column in columns], metadata=schema.metadata)
+    dense = schema.field(key_columns[0]).type == pa.uint32()
+
+    row_groups = []
+    for row_group in range(parquet_file.num_row_groups):
+        value_range = _row_group_range(parquet_file.metadata, row_group, key_columns[0])
+        if value_range is None or value_range[0] is None or work_set.may_contain(*value_range, dense=dense):
+            row_groups.append(row_group)
+    if not row_groups:
+        return schema.empty_table()
+
+    batches = [work_set.filter_batch(batch, key_columns)
+               for batch in parquet_file.iter_batches(batch_size=batch_rows, row_groups=row_groups, columns=columns)]
+    return pa.Table.from_batches(batches, schema=schema)
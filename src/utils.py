@@ -7,18 +7,21 @@ from collections import namedtuple
 from datetime import datetime
 from multiprocessing import Pool
 from pathlib import Path
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pypq
 
 import numpy as np
 import orjson
 import pandas as pd
-import requests
 import ujson as json
 import unicodedata
 from box import Box
 from tqdm import tqdm
 from unidecode import unidecode_expect_ascii
 
+from src.abstracts import reconstruct_abstracts
+
 path_type = str | Path
 
 
@@ -116,6 +119,60 @@ def convert_topic_id_to_int(openalex_id):
     return id_
 
 
+def _to_string_array(ids) -> pa.Array:
+    """
+    Turn a list / numpy array / pandas Series / Arrow (chunked) array of IDs into a single Arrow string array
+    """
+    if isinstance(ids, pa.ChunkedArray):
+        ids = ids.combine_chunks()
+    if not isinstance(ids, pa.Array):
+        ids = pa.array(ids if isinstance(ids, (list, np.ndarray, pd.Series)) else list(ids), from_pandas=True)
+    if pa.types.is_dictionary(ids.type):
+        ids = ids.dictionary_decode()
+    if not (pa.types.is_string(ids.type) or pa.types.is_large_string(ids.type)):
+        ids = ids.cast(pa.utf8())
+    return ids
+
+
+def _digits_to_uint64(digits: pa.Array, as_arrow: bool):
+    """
+    Parse an Arrow string array of digits into uint64, anything that's not 1-19 digits is invalid
+    """
+    valid = pc.fill_null(pc.and_(pc.ascii_is_decimal(digits), pc.less_equal(pc.binary_length(digits), 19)), False)
+    ids = pc.cast(pc.if_else(valid, digits, '0'), pa.uint64())
+    if as_arrow:
+        return pc.if_else(valid, ids, pa.scalar(None, pa.uint64())), valid
+    return ids.to_numpy(zero_copy_only=False), valid.to_numpy(zero_copy_only=False)
+
+
+def convert_openalex_ids_to_int(openalex_ids, as_arrow: bool = False):
+    """
+    Batch version of convert_openalex_id_to_int with Arrow string kernels
+    openalex_ids: list / numpy array / pandas Series / Arrow array of OpenAlex IDs or URLs,
+    eg: https://openalex.org/W123
+    Returns (ids, valid): a uint64 array of the integer IDs (0 where invalid) and a boolean validity mask,
+    as numpy arrays, or as Arrow arrays with nulls for the invalid IDs if as_arrow
+    """
+    openalex_ids = pc.utf8_trim_whitespace(_to_string_array(openalex_ids))
+    openalex_ids = pc.replace_substring(openalex_ids, 'https://openalex.org/', '')
+    return _digits_to_uint64(pc.utf8_slice_codeunits(openalex_ids, 1), as_arrow=as_arrow)
+
+
+def convert_topic_ids_to_int(openalex_ids, as_arrow: bool = False):
+    """
+    Batch version of convert_topic_id_to_int, handles the old (https://openalex.org/T10102) and the
+    new (https://openalex.org/topics/T10102, https://openalex.org/fields/17) formats
+    Returns (ids, valid) like convert_openalex_ids_to_int
+    """
+    openalex_ids = pc.utf8_trim_whitespace(_to_string_array(openalex_ids))
+    openalex_ids = pc.replace_substring(openalex_ids, 'https://openalex.org/', '')
+    new_format = pc.fill_null(pc.match_substring(openalex_ids, '/'), False)
+    # new format: last path segment, with the T of topics stripped; old format: drop the leading letter
+    new_digits = pc.replace_substring_regex(pc.replace_substring_regex(openalex_ids, r'^.*/', ''), r'^[Tt]', '')
+    old_digits = pc.utf8_slice_codeunits(openalex_ids, 1)
+    return _digits_to_uint64(pc.if_else(new_format, new_digits, old_digits), as_arrow=as_arrow)
+
+
 def get_concept_id(name) -> int:
     cached = {'Complex network': 'C34947359', 'Computer science': 'C41008148', 'Physics': 'C121332964',
               'Network science': 'C137753397', 'Graphene': 'C30080830', 'Feshbach resonance': 'C39190425',
@@ -131,6 +188,7 @@ def get_concept_id(name) -> int:
     if name in cached:
         id_ = cached[name]
     else:
+        import requests  # only needed on a cache miss, kept out of the import time
         url = f'https://api.openalex.org/concepts?filter=display_name.search:{name}'
         json = requests.get(url, params={'mailto': 'ssikdar@iu.edu'}).json()
         # pick the top result
@@ -147,6 +205,7 @@ def get_author_id(name) -> int:
     if name in cached:
         id_ = cached[name]
     else:
+        import requests
         url = f'https://api.openalex.org/authors?filter=display_name.search:{name}'
         json = requests.get(url, params={'mailto': 'ssikdar@iu.edu'}).json()
         # pick the top result
@@ -203,8 +262,12 @@ def normalize_string(text, decode=True):
 
 
 # Read file list from MANIFEST
-def read_manifest(kind: str, snapshot_dir) -> Box:
-    manifest_path = snapshot_dir / kind / 'manifest'
+def read_manifest(kind: str, snapshot_dir, manifest_path=None) -> Box:
+    """
+    manifest_path: read a saved copy of the manifest instead of the one in the snapshot,
+        the file names still point inside snapshot_dir
+    """
+    manifest_path = Path(manifest_path) if manifest_path is not None else snapshot_dir / kind / 'manifest'
     create_date = datetime.fromtimestamp(manifest_path.stat().st_ctime).strftime("%a, %b %d %Y")
 
     raw_data = Box(json.load(open(manifest_path)))
@@ -217,6 +280,7 @@ def read_manifest(kind: str, snapshot_dir) -> Box:
         filename = snapshot_dir / raw_entry.url.replace('s3://openalex/data/', '')
         entry = Box({'filename': filename, 'kind': kind,
                      'count': raw_entry.meta.record_count,
+                     'content_length': raw_entry.meta.get('content_length'),
                      'updated_date': '_'.join(filename.parts[-2:]).replace('.gz', '')})
         if entry.count > 0:
             entries.append(entry)
@@ -272,24 +336,9 @@ def construct_abstracts(inv_abstracts):
     Construct abstracts from inverted index
     keys: words, values: list of locations
     """
-    abstracts = []
-
-    for inv_abstract_st in tqdm(inv_abstracts, desc='Constructing abstracts..'):
-        inv_abstract_st = ast.literal_eval(inv_abstract_st)  # convert to python object
-        if isinstance(inv_abstract_st, bytes):
-            inv_abstract_st = inv_abstract_st.decode('utf-8', errors='replace')
-
-        inv_abstract = json.loads(inv_abstract_st) if isinstance(inv_abstract_st, str) else inv_abstract_st
-        abstract_dict = {}
-        for word, locs in inv_abstract.items():  # invert the inversion
-            for loc in locs:
-                abstract_dict[loc] = word
-        abstract = ' '.join(map(lambda x: x[1],  # pick the words
-                                sorted(abstract_dict.items())))  # sort abstract dictionary by indices
-        if len(abstract) == 0:
-            abstract = None
-        abstracts.append(abstract)
-    return abstracts
+    inv_abstracts = [ast.literal_eval(inv_abstract_st)  # convert to python object
+                     for inv_abstract_st in tqdm(inv_abstracts, desc='Constructing abstracts..')]
+    return reconstruct_abstracts(inv_abstracts).to_pylist()
 
 
 def reconstruct_abstract(inv_abstract_st):
@@ -334,7 +383,11 @@ def dump_pickle(obj, path):
         pickle.dump(obj, writer)
 
 
-def parse_authorships(work_id, publication_year, authorships, author_skip_ids, inst_skip_ids, inst_info_d):
+def parse_authorships(work_id, publication_year, authorships, author_skip_ids, inst_skip_ids, inst_info_d=None):
+    """
+    inst_info_d: column -> {institution id -> value} dictionaries of the institution names and country codes.
+        If None, the names and country codes are left null, to be looked up in batch from the institution ids
+    """
     authorship_rows = []
     num_authors = 0
     has_complete_institution_info = True and (len(authorships) > 0)  # to make sure empty authorships dont trigger True
@@ -387,8 +440,11 @@ def parse_authorships(work_id, publication_year, authorships, author_skip_ids, i
 
                     assigned_institution = (institution_id == lin_inst_id)
 
-                    inst_name = inst_info_d['institution_name'].get(inst_id, pd.NA)
-                    country_code = inst_info_d['country_code'].get(inst_id, pd.NA)
+                    if inst_info_d is not None:
+                        inst_name = inst_info_d['institution_name'].get(inst_id, pd.NA)
+                        country_code = inst_info_d['country_code'].get(inst_id, pd.NA)
+                    else:
+                        inst_name = country_code = None
 
                     # raw affil string is forcibly set to pd.NA
 
@@ -0,0 +1,269 @@
+"""
+Streaming writers for the flattened tables
+"""
+import os
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from src.globals import path_type
+
+PARQUET_WRITE_ARGS = dict(compression='brotli', coerce_timestamps='ms', allow_truncated_timestamps=True)
+
+CSV_SUFFIXES = {'gzip': '.csv.gz', 'zstd': '.csv.zst'}
+
+
+class RowBuffer:
+    """
+    Buffer of row dictionaries, turned into an Arrow table by to_table(rows) (eg: a pandas based conversion)
+    """
+
+    def __init__(self, to_table: Callable[[List], pa.Table]):
+        self.rows: List = []
+        self._to_table = to_table
+
+    def append(self, row) -> None:
+        self.rows.append(row)
+
+    def extend(self, rows) -> None:
+        self.rows.extend(rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def clear(self) -> None:
+        self.rows = []
+
+    def to_table(self) -> pa.Table:
+        return self._to_table(self.rows)
+
+
+class ParquetPartWriter:
+    """
+    Streams the rows of one table for one part file into a single parquet file.
+    Rows are collected in a buffer (a RowBuffer or a columnar TableBuilder) and written out as a row group
+    once flush_rows rows or roughly flush_bytes bytes pile up, so memory stays bounded no matter how large
+    the part is.
+    The parquet is written to a hidden temp file and renamed on close, so a crashed run never leaves a
+    partial file behind that looks finished.
+    """
+
+    def __init__(self, path: path_type, buffer, flush_rows: int = 500_000, flush_bytes: int = 256 * 1024 ** 2,
+                 **parquet_args):
+        """
+        buffer: collects the rows, needs append, extend, __len__, clear and to_table methods
+        """
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(f'.{self.path.name}.tmp')
+        self.buffer = buffer
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.parquet_args = {**PARQUET_WRITE_ARGS, **parquet_args}
+
+        self.rows_written = 0
+        self.bytes_written = 0  # in-memory arrow bytes of the flushed batches
+        self._bytes_per_row = None  # estimated from the first flushed batch
+        self._writer: Optional[pq.ParquetWriter] = None
+        return
+
+    def append(self, row) -> None:
+        self.buffer.append(row)
+
+    def append_values(self, *values) -> None:
+        self.buffer.append_values(*values)
+
+    def extend(self, rows) -> None:
+        self.buffer.extend(rows)
+
+    def append_table(self, table: pa.Table) -> None:
+        self.buffer.append_table(table)
+
+    def add_edges(self, sources, targets) -> None:
+        self.buffer.add_edges(sources, targets)
+
+    def __len__(self) -> int:
+        return self.rows_written + len(self.buffer)
+
+    @property
+    def buffered_bytes(self) -> float:
+        if self._bytes_per_row is None:
+            return 0
+        return len(self.buffer) * self._bytes_per_row
+
+    def maybe_flush(self) -> bool:
+        """
+        Flush if the buffer crossed the row / byte thresholds.
+        The very first flush happens early to calibrate the bytes per row estimate.
+        Call this between records so that rows from one record are never split across row groups.
+        """
+        flush_rows = self.flush_rows if self._bytes_per_row is not None else min(self.flush_rows, 10_000)
+        if len(self.buffer) >= flush_rows or self.buffered_bytes >= self.flush_bytes:
+            self.flush()
+            return True
+        return False
+
+    def flush(self) -> None:
+        if len(self.buffer) == 0:
+            return
+        table = self.buffer.to_table()
+        self.buffer.clear()
+
+        if self._writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # the first batch's schema carries the pandas metadata along, if any
+            self._writer = pq.ParquetWriter(self.tmp_path, schema=table.schema, **self.parquet_args)
+        self._writer.write_table(table.replace_schema_metadata(self._writer.schema.metadata))
+
+        if table.num_rows > 0:
+            self._bytes_per_row = table.nbytes / table.num_rows
+        self.rows_written += table.num_rows
+        self.bytes_written += table.nbytes
+        return
+
+    def close(self) -> bool:
+        """
+        Flush the remaining rows and move the finished file in place.
+        Nothing is written if the table never received any rows, and a file left by an earlier run is removed.
+        """
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            os.replace(self.tmp_path, self.path)
+            self._writer = None
+        else:
+            self.path.unlink(missing_ok=True)
+        return True
+
+    def abort(self) -> None:
+        """
+        Drop the buffer and the partially written temp file
+        """
+        self.buffer.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self.tmp_path.unlink(missing_ok=True)
+        return
+
+
+class RowCounter:
+    """
+    Stand-in for a row buffer when a table is not being written, only keeps count of the rows
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def append(self, row) -> None:
+        self.count += 1
+
+    def extend(self, rows) -> None:
+        for _ in rows:
+            self.count += 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def maybe_flush(self) -> bool:
+        return False
+
+
+def csv_path(path: path_type, compression: str = 'gzip') -> Path:
+    """
+    path (eg: authors.csv.gz) with the suffix of the compression, eg: authors.csv.zst for zstd
+    """
+    path = Path(path)
+    name = path.name
+    for suffix in CSV_SUFFIXES.values():
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    return path.with_name(name + CSV_SUFFIXES[compression])
+
+
+def to_csv_columns(table: pa.Table) -> pa.Table:
+    """
+    Columns written the way the CSVs always had them: dictionaries decoded, booleans as True / False and timestamps
+    in ISO 8601 with microseconds
+    """
+    arrays = []
+    for column in table.columns:
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        if pa.types.is_boolean(column.type):
+            column = pc.if_else(column, 'True', 'False')
+        elif pa.types.is_timestamp(column.type):
+            column = pc.strftime(column.cast(pa.timestamp('us')), format='%Y-%m-%dT%H:%M:%S')
+        arrays.append(column)
+    return pa.Table.from_arrays(arrays, names=table.column_names)
+
+
+class CSVTableWriter:
+    """
+    Streams Arrow tables (or record batches) into one compressed CSV, without going through python rows.
+    Every write is turned into CSV by pyarrow.csv and compressed as one gzip member (or zstd frame) at
+    compression_level; the members of a file are decompressed one after the other by gzip.open, pandas and pyarrow,
+    so the file reads as one CSV. The header is written as is and the columns follow its order.
+    Arrow quotes every string value, which CSV readers take the same way as the minimal quoting of the csv module.
+    The file is written to a hidden temp file and renamed on close.
+    """
+
+    def __init__(self, path: path_type, columns: List[str], compression: str = 'gzip',
+                 compression_level: Optional[int] = None):
+        """
+        path: the suffix is set by the compression, see csv_path
+        compression: gzip or zstd
+        compression_level: the codec's default if None (6 for gzip, 1 for zstd)
+        """
+        self.path = csv_path(path, compression=compression)
+        self.tmp_path = self.path.with_name(f'.{self.path.name}.tmp')
+        self.columns = list(columns)
+        self.codec = pa.Codec(compression, compression_level=compression_level)
+        self.rows_written = 0
+        self.bytes_written = 0  # uncompressed CSV bytes
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.tmp_path, 'wb')
+        self._write_bytes((','.join(self.columns) + '\n').encode('utf-8'))
+        return
+
+    def _write_bytes(self, data) -> None:
+        self._file.write(self.codec.compress(data, asbytes=True))
+        self.bytes_written += len(data)
+
+    def write(self, table) -> None:
+        if table.num_rows == 0:
+            return
+        if isinstance(table, pa.RecordBatch):
+            table = pa.Table.from_batches([table])
+        sink = pa.BufferOutputStream()
+        pacsv.write_csv(to_csv_columns(table.select(self.columns)), sink,
+                        write_options=pacsv.WriteOptions(include_header=False))
+        self._write_bytes(sink.getvalue())
+        self.rows_written += table.num_rows
+        return
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+            os.replace(self.tmp_path, self.path)
+        return
+
+    def abort(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        self.tmp_path.unlink(missing_ok=True)
+        return
+
+    def __enter__(self) -> 'CSVTableWriter':
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()